@@ -0,0 +1,317 @@
+"""
+Внутрипроцессные кэши API.
+
+Справочник специализаций меняется редко, а читается на каждом запуске клиента,
+поэтому держим его в памяти процесса:
+  - TTL — страховка на случай потерянного уведомления;
+  - ETag — sha1 от содержимого ответа (для If-None-Match / 304);
+  - invalidate() — явный сброс; вызывается слушателем NOTIFY specializations_changed
+    (триггер из sql/020_specializations_notify.sql) и может вызываться кодом записи.
+
+Первые страницы /doctors/search (несколько популярных сочетаний фильтров дают
+большую часть трафика) кэшируются в SearchResultCache: LRU ограниченного размера
+с коротким TTL и выборочной инвалидацией из записей репозитория по врачу.
+"""
+import hashlib
+import json
+import os
+import select
+import threading
+import time
+from collections import OrderedDict
+from datetime import date
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+
+import psycopg2
+
+from .db import PG_USER, PG_PASS, PG_HOST, PG_PORT, PG_DB, DB_READ_AFTER_WRITE_SECONDS, replicas_enabled
+
+SPECIALIZATIONS_CACHE_TTL = int(os.getenv("SPECIALIZATIONS_CACHE_TTL", "3600"))
+SPECIALIZATIONS_LISTEN = os.getenv("SPECIALIZATIONS_LISTEN", "true").lower() == "true"
+SPECIALIZATIONS_CHANNEL = "specializations_changed"
+
+SEARCH_CACHE_SIZE = int(os.getenv("SEARCH_CACHE_SIZE", "512"))
+SEARCH_CACHE_TTL = float(os.getenv("SEARCH_CACHE_TTL", "30"))
+
+
+def _etag(rows: List[Dict]) -> str:
+    payload = json.dumps(rows, ensure_ascii=False, sort_keys=True, default=str)
+    return '"' + hashlib.sha1(payload.encode("utf-8")).hexdigest() + '"'
+
+
+class SpecializationCatalogCache:
+    """
+    Кэш справочника специализаций.
+
+    Хранит полный список (популярные первыми, затем по имени); вариант
+    popular_only — его префикс, поэтому оба ответа строятся из одной загрузки.
+    """
+
+    def __init__(self, ttl: int = SPECIALIZATIONS_CACHE_TTL):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries: Optional[Dict[bool, Tuple[List[Dict], str]]] = None
+        self._expires_at = 0.0
+        self._generation = 0
+
+    def get(self, loader: Callable[[], List[Dict]], popular_only: bool = False) -> Tuple[List[Dict], str]:
+        """
+        Возвращает (rows, etag). loader() вызывается только при пустом/протухшем кэше
+        и должен вернуть полный список в порядке is_popular desc, name.
+        """
+        with self._lock:
+            if self._entries is not None and time.monotonic() < self._expires_at:
+                return self._entries[popular_only]
+            generation = self._generation
+
+        rows = loader()
+        popular = [r for r in rows if r["is_popular"]]
+        entries = {False: (rows, _etag(rows)), True: (popular, _etag(popular))}
+
+        with self._lock:
+            # если пока грузили, пришла инвалидация — результат не запоминаем
+            if generation == self._generation:
+                self._entries = entries
+                self._expires_at = time.monotonic() + self.ttl
+        return entries[popular_only]
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._entries = None
+            self._expires_at = 0.0
+            self._generation += 1
+
+
+specializations_cache = SpecializationCatalogCache()
+
+
+def _normalize_filter(name: str, value: Any) -> Any:
+    if isinstance(value, str):
+        value = " ".join(value.split())
+        return value.lower() if name == "q" else value
+    if isinstance(value, (list, tuple, set)) and name == "specialization_ids":
+        return tuple(sorted(set(value)))
+    if isinstance(value, (list, tuple)):
+        return tuple(value)
+    if hasattr(value, "value"):  # Enum
+        return value.value
+    return value
+
+
+class _SearchEntry:
+    __slots__ = ("rows", "expires_at", "doctor_ids", "city", "specialization_ids", "day")
+
+    def __init__(self, rows: List[Dict], expires_at: float, filters: Dict):
+        self.rows = rows
+        self.expires_at = expires_at
+        self.doctor_ids = frozenset(r["id"] for r in rows)
+        self.city = filters.get("city")
+        self.specialization_ids = filters.get("specialization_ids")
+        self.day = filters.get("date_filter")
+
+    def affected_by(self, doctor_id: int, city: Optional[str],
+                    specialization_ids: Iterable[int], day: Optional[date]) -> bool:
+        """Могла ли запись по врачу изменить эту выдачу (первую страницу)."""
+        if day is not None and self.day != day:
+            # слоты влияют только на выдачу с фильтром по этому дню
+            return False
+        if doctor_id in self.doctor_ids:
+            return True
+        # врач мог попасть в выдачу или сдвинуть порядок — если подходит по городу/специализации
+        if self.city is not None and self.city != city:
+            return False
+        if self.specialization_ids is not None and not set(self.specialization_ids) & set(specialization_ids):
+            return False
+        return True
+
+
+class SearchResultCache:
+    """
+    LRU-кэш первых страниц поиска врачей.
+
+    Ключ — нормализованные фильтры + limit + sort. Кэшируются только первые
+    страницы (offset=0, без cursor): тогда выдачу меняет лишь врач, который в неё
+    уже входит или подходит по фильтрам после изменения, и инвалидация может
+    проверять только новое состояние врача. TTL ограничивает устаревание от
+    записей в обход репозитория и от других воркеров (у каждого свой кэш).
+
+    С репликами выдача, загруженная вскоре после записи, могла прийти с отстающей
+    реплики: инвалидации последних lag_window секунд запоминаются, и такая выдача
+    не кэшируется, если запись могла её изменить.
+    """
+
+    def __init__(self, max_size: int = SEARCH_CACHE_SIZE, ttl: float = SEARCH_CACHE_TTL,
+                 lag_window: float = 0.0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.lag_window = lag_window
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[Tuple, _SearchEntry]" = OrderedDict()
+        self._recent: List[Tuple[float, int, Optional[str], Tuple[int, ...], Optional[date]]] = []
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_size > 0 and self.ttl > 0
+
+    @staticmethod
+    def make_key(filters: Dict, limit: int, sort: Optional[str]) -> Tuple:
+        items = []
+        for name, value in filters.items():
+            if value is None or value is False or value == [] or value == "":
+                continue
+            if name == "radius_km" and filters.get("near") is None:
+                continue
+            items.append((name, _normalize_filter(name, value)))
+        return tuple(sorted(items)) + (("limit", limit), ("sort", sort))
+
+    def _lookup(self, key: Tuple) -> Tuple[Optional[List[Dict]], int]:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and now < entry.expires_at:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry.rows, self._generation
+            self.misses += 1
+            return None, self._generation
+
+    def _store(self, key: Tuple, rows: List[Dict], generation: int) -> None:
+        entry = _SearchEntry(rows, time.monotonic() + self.ttl, dict(key))
+        with self._lock:
+            # пока грузили, была запись по какому-то врачу — результат мог устареть
+            if generation == self._generation and not self._recently_affected(entry):
+                self._entries[key] = entry
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_size:
+                    self._entries.popitem(last=False)
+                    self.evictions += 1
+
+    def _recently_affected(self, entry: _SearchEntry) -> bool:
+        if not self._recent:
+            return False
+        horizon = time.monotonic() - self.lag_window
+        self._recent = [inv for inv in self._recent if inv[0] >= horizon]
+        return any(entry.affected_by(*inv[1:]) for inv in self._recent)
+
+    def get(self, filters: Dict, limit: int, sort: Optional[str],
+            loader: Callable[[], List[Dict]]) -> List[Dict]:
+        """Выдача из кэша или loader() с запоминанием результата."""
+        if not self.enabled:
+            return loader()
+        key = self.make_key(filters, limit, sort)
+        rows, generation = self._lookup(key)
+        if rows is None:
+            rows = loader()
+            self._store(key, rows, generation)
+        return rows
+
+    async def aget(self, filters: Dict, limit: int, sort: Optional[str],
+                   loader: Callable[[], Awaitable[List[Dict]]]) -> List[Dict]:
+        """То же, что get(), для асинхронного loader()."""
+        if not self.enabled:
+            return await loader()
+        key = self.make_key(filters, limit, sort)
+        rows, generation = self._lookup(key)
+        if rows is None:
+            rows = await loader()
+            self._store(key, rows, generation)
+        return rows
+
+    def invalidate_doctor(self, doctor_id: int, city: Optional[str] = None,
+                          specialization_ids: Iterable[int] = (),
+                          day: Optional[date] = None) -> int:
+        """
+        Сбрасывает выдачи, которые могли измениться после записи по врачу
+        (city/specialization_ids — его текущие значения, day — день изменённого слота).
+        Возвращает число удалённых записей.
+        """
+        specialization_ids = tuple(specialization_ids)
+        with self._lock:
+            self._generation += 1
+            if self.lag_window > 0:
+                self._recent.append((time.monotonic(), doctor_id, city, specialization_ids, day))
+            stale = [
+                key for key, entry in self._entries.items()
+                if entry.affected_by(doctor_id, city, specialization_ids, day)
+            ]
+            for key in stale:
+                del self._entries[key]
+            self.invalidations += len(stale)
+        return len(stale)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "enabled": self.enabled,
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "ttl_seconds": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
+
+
+search_cache = SearchResultCache(lag_window=DB_READ_AFTER_WRITE_SECONDS if replicas_enabled() else 0.0)
+
+
+def _listen_specializations(stop: threading.Event) -> None:
+    """Слушает NOTIFY specializations_changed и сбрасывает кэш. Переподключается при обрыве."""
+    while not stop.is_set():
+        conn = None
+        try:
+            conn = psycopg2.connect(
+                host=PG_HOST, port=PG_PORT, dbname=PG_DB, user=PG_USER, password=PG_PASS
+            )
+            conn.autocommit = True
+            with conn.cursor() as cur:
+                cur.execute(f"LISTEN {SPECIALIZATIONS_CHANNEL}")
+            # изменения могли произойти, пока соединения не было
+            specializations_cache.invalidate()
+            while not stop.is_set():
+                if select.select([conn], [], [], 5.0) == ([], [], []):
+                    continue
+                conn.poll()
+                if conn.notifies:
+                    conn.notifies.clear()
+                    specializations_cache.invalidate()
+        except Exception as e:
+            print(f"⚠️ specializations listener: {e}")
+            stop.wait(5.0)
+        finally:
+            if conn is not None:
+                conn.close()
+
+
+_listener_stop = threading.Event()
+_listener_thread: Optional[threading.Thread] = None
+
+
+def start_specializations_listener() -> None:
+    global _listener_thread
+    if not SPECIALIZATIONS_LISTEN or _listener_thread is not None:
+        return
+    _listener_thread = threading.Thread(
+        target=_listen_specializations, args=(_listener_stop,),
+        name="specializations-listener", daemon=True,
+    )
+    _listener_thread.start()
+
+
+def stop_specializations_listener() -> None:
+    global _listener_thread
+    _listener_stop.set()
+    _listener_thread = None
@@ -1,9 +1,15 @@
 import os
+import time
 import requests
 from typing import List, Dict
 
 OPENROUTER_API_KEY = os.getenv("OPENROUTER_API_KEY")
 
+# Заглушка LLM для нагрузочных тестов (scripts/load_test.py): без похода в OpenRouter,
+# ответ по ключевым словам после задержки CHAT_LLM_MOCK_DELAY_MS (имитация времени модели)
+CHAT_LLM_MOCK = os.getenv("CHAT_LLM_MOCK", "false").lower() == "true"
+CHAT_LLM_MOCK_DELAY_MS = int(os.getenv("CHAT_LLM_MOCK_DELAY_MS", "200"))
+
 OPENROUTER_API_URL = "https://openrouter.ai/api/v1/chat/completions"
 
 SYSTEM_PROMPT = """
@@ -73,6 +79,25 @@ def convert_history_to_openai_format(history: List[dict]) -> List[dict]:
     return openai_messages
 
 
+_MOCK_ANSWERS = [
+    (("груд", "сердц", "давлен"), "Рекомендую обратиться к кардиологу. Эти симптомы требуют его консультации."),
+    (("голов", "головокруж"), "Рекомендую обратиться к неврологу. Он занимается головными болями."),
+    (("зуб", "десн"), "Рекомендую обратиться к стоматологу. Он лечит зубы и дёсны."),
+    (("глаз", "зрени"), "Рекомендую обратиться к офтальмологу. Он проверит зрение."),
+    (("ребён", "ребен", "сын", "дочь"), "Рекомендую обратиться к педиатру. Он специализируется на детях."),
+    (("травм", "перелом", "порез"), "Рекомендую обратиться к хирургу. Он занимается травмами."),
+]
+
+
+def _mock_response(user_message: str) -> str:
+    time.sleep(CHAT_LLM_MOCK_DELAY_MS / 1000)
+    text = user_message.lower()
+    for keywords, answer in _MOCK_ANSWERS:
+        if any(k in text for k in keywords):
+            return answer
+    return "Рекомендую обратиться к терапевту. Он проведет первичный осмотр."
+
+
 def send_message_with_context(user_message: str, history: List[dict]) -> str:
     """
     Send message to OpenRouter API with conversation history
@@ -84,6 +109,9 @@ def send_message_with_context(user_message: str, history: List[dict]) -> str:
     Returns:
         AI response text
     """
+    if CHAT_LLM_MOCK:
+        return _mock_response(user_message)
+
     if not OPENROUTER_API_KEY:
         raise ValueError("OPENROUTER_API_KEY must be set in environment variables")
 
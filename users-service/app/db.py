@@ -1,7 +1,15 @@
+import itertools
 import os
+import threading
+import time
+from contextvars import ContextVar, Token
+from typing import Any, Callable, Dict, Iterator, List, TypeVar
 from dotenv import load_dotenv
 from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+from starlette.concurrency import run_in_threadpool
 
 load_dotenv()
 
@@ -12,9 +20,245 @@ PG_PORT = os.getenv("POSTGRES_PORT", "5432")
 PG_DB   = os.getenv("POSTGRES_DB", "usersdb")
 
 DATABASE_URL = f"postgresql+psycopg2://{PG_USER}:{PG_PASS}@{PG_HOST}:{PG_PORT}/{PG_DB}"
+ASYNC_DATABASE_URL = f"postgresql+asyncpg://{PG_USER}:{PG_PASS}@{PG_HOST}:{PG_PORT}/{PG_DB}"
 
-engine = create_engine(DATABASE_URL, pool_pre_ping=True)
+# Реплики только для чтения: "host[:port],host2[:port]" (те же пользователь, пароль и БД)
+PG_REPLICA_HOSTS = [h.strip() for h in os.getenv("POSTGRES_REPLICA_HOSTS", "").split(",") if h.strip()]
+# Сколько секунд после записи клиент читает с primary (реплика может отставать)
+DB_READ_AFTER_WRITE_SECONDS = float(os.getenv("DB_READ_AFTER_WRITE_SECONDS", "5"))
+
+
+def _replica_url(driver: str, host_port: str) -> str:
+    host, _, port = host_port.partition(":")
+    return f"postgresql+{driver}://{PG_USER}:{PG_PASS}@{host}:{port or '5432'}/{PG_DB}"
+
+# true — async-эндпоинты ходят в БД через asyncpg, не занимая поток пула на время запроса
+ASYNC_DB = os.getenv("ASYNC_DB", "false").lower() == "true"
+
+# Пул соединений (на процесс). Итоговый предел соединений к БД:
+# (DB_POOL_SIZE + DB_MAX_OVERFLOW) * число воркеров uvicorn
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+
+
+class PoolStats:
+    """
+    Счётчики выдачи соединений из пула: сколько раз брали, сколько ждали и как долго
+    (ожидание включает установку нового соединения, если пул ещё не заполнен).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def record(self, waited: float, timed_out: bool = False) -> None:
+        with self._lock:
+            if timed_out:
+                self.timeouts += 1
+            else:
+                self.checkouts += 1
+            self.wait_total += waited
+            self.wait_max = max(self.wait_max, waited)
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            return {
+                "checkouts": self.checkouts,
+                "timeouts": self.timeouts,
+                "wait_total_ms": round(self.wait_total * 1000, 3),
+                "wait_avg_ms": round(self.wait_total * 1000 / self.checkouts, 3) if self.checkouts else 0.0,
+                "wait_max_ms": round(self.wait_max * 1000, 3),
+            }
+
+
+class _TimedPoolMixin:
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.stats = PoolStats()
+
+    def _do_get(self):
+        t0 = time.perf_counter()
+        try:
+            conn = super()._do_get()
+        except PoolTimeoutError:
+            self.stats.record(time.perf_counter() - t0, timed_out=True)
+            raise
+        self.stats.record(time.perf_counter() - t0)
+        return conn
+
+
+class InstrumentedQueuePool(_TimedPoolMixin, QueuePool):
+    pass
+
+
+class InstrumentedAsyncQueuePool(_TimedPoolMixin, AsyncAdaptedQueuePool):
+    pass
+
+
+_POOL_KWARGS = dict(
+    pool_pre_ping=True,
+    pool_size=DB_POOL_SIZE,
+    max_overflow=DB_MAX_OVERFLOW,
+    pool_timeout=DB_POOL_TIMEOUT,
+    pool_recycle=DB_POOL_RECYCLE,
+)
+
+engine = create_engine(DATABASE_URL, poolclass=InstrumentedQueuePool, **_POOL_KWARGS)
 SessionLocal = sessionmaker(bind=engine, autoflush=False, autocommit=False)
 
+replica_engines = [
+    create_engine(_replica_url("psycopg2", h), poolclass=InstrumentedQueuePool, **_POOL_KWARGS)
+    for h in PG_REPLICA_HOSTS
+]
+_replica_makers = [sessionmaker(bind=e, autoflush=False, autocommit=False) for e in replica_engines]
+
+async_engine = None
+AsyncSessionLocal = None
+async_replica_engines: List = []
+_async_replica_makers: List = []
+if ASYNC_DB:
+    from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+    async_engine = create_async_engine(ASYNC_DATABASE_URL, poolclass=InstrumentedAsyncQueuePool, **_POOL_KWARGS)
+    AsyncSessionLocal = async_sessionmaker(bind=async_engine, autoflush=False, expire_on_commit=False)
+    async_replica_engines = [
+        create_async_engine(_replica_url("asyncpg", h), poolclass=InstrumentedAsyncQueuePool, **_POOL_KWARGS)
+        for h in PG_REPLICA_HOSTS
+    ]
+    _async_replica_makers = [
+        async_sessionmaker(bind=e, autoflush=False, expire_on_commit=False) for e in async_replica_engines
+    ]
+
+# True — текущий запрос читает только с primary (клиент недавно что-то записал)
+_primary_pinned: ContextVar[bool] = ContextVar("db_primary_pinned", default=False)
+_replica_counter = itertools.count()
+
+
+def replicas_enabled() -> bool:
+    return bool(PG_REPLICA_HOSTS)
+
+
+def pin_primary(pinned: bool = True) -> Token:
+    """Закрепить чтения текущего запроса за primary; вернуть токен для unpin_primary."""
+    return _primary_pinned.set(pinned)
+
+
+def unpin_primary(token: Token) -> None:
+    _primary_pinned.reset(token)
+
+
+def _read_maker(primary, replicas: List):
+    """sessionmaker для чтения: реплика по кругу, если они есть и запрос не закреплён за primary."""
+    if not replicas or _primary_pinned.get():
+        return primary
+    return replicas[next(_replica_counter) % len(replicas)]
+
+T = TypeVar("T")
+
+
 def get_session():
-    return SessionLocal()
\ No newline at end of file
+    return SessionLocal()
+
+
+def get_read_session():
+    """Сессия для чтения вне зависимостей FastAPI (например, в потоковом ответе); закрывает вызывающий."""
+    return _read_maker(SessionLocal, _replica_makers)()
+
+
+def db_session() -> Iterator[Session]:
+    """
+    FastAPI-зависимость: сессия на запрос. Соединение берётся из пула только
+    при первом обращении к БД (эндпоинт, упавший на валидации, пул не трогает)
+    и всегда возвращается после ответа, в том числе при исключении.
+    """
+    s = SessionLocal()
+    try:
+        yield s
+    finally:
+        s.close()
+
+
+def read_session() -> Iterator[Session]:
+    """
+    То же, что db_session, для эндпоинтов, которые только читают: сессия
+    на реплике (round-robin по POSTGRES_REPLICA_HOSTS) либо на primary, если
+    реплик нет или клиент недавно писал (см. pin_primary).
+    """
+    s = _read_maker(SessionLocal, _replica_makers)()
+    try:
+        yield s
+    finally:
+        s.close()
+
+
+def _pool_status(pool) -> Dict:
+    return {
+        "size": pool.size(),
+        "max_overflow": DB_MAX_OVERFLOW,
+        "checked_out": pool.checkedout(),
+        "checked_in": pool.checkedin(),
+        "overflow": max(pool.overflow(), 0),
+        "timeout_seconds": DB_POOL_TIMEOUT,
+        "recycle_seconds": DB_POOL_RECYCLE,
+        **pool.stats.snapshot(),
+    }
+
+
+def pool_status() -> Dict:
+    """Занятость пулов и счётчики ожидания соединений (на процесс)."""
+    status = {"sync": _pool_status(engine.pool)}
+    if async_engine is not None:
+        status["async"] = _pool_status(async_engine.pool)
+    if replica_engines:
+        status["replicas"] = {
+            host: _pool_status(e.pool) for host, e in zip(PG_REPLICA_HOSTS, replica_engines)
+        }
+    if async_replica_engines:
+        status["async_replicas"] = {
+            host: _pool_status(e.pool) for host, e in zip(PG_REPLICA_HOSTS, async_replica_engines)
+        }
+    return status
+
+
+def _call_with_maker(maker, fn: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    s = maker()
+    try:
+        return fn(s, *args, **kwargs)
+    finally:
+        s.close()
+
+
+async def run_db(fn: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """
+    Вызов функции репозитория fn(session, *args, **kwargs) из async-эндпоинта.
+
+    ASYNC_DB=true: AsyncSession (asyncpg) + run_sync — тот же синхронный код
+    репозитория исполняется в greenlet'е поверх асинхронного соединения, поток
+    на ожидание БД не тратится. Иначе — обычная сессия psycopg2 в threadpool
+    (как у sync-эндпоинтов).
+    """
+    if AsyncSessionLocal is None:
+        return await run_in_threadpool(_call_with_maker, SessionLocal, fn, *args, **kwargs)
+    async with AsyncSessionLocal() as s:
+        return await s.run_sync(fn, *args, **kwargs)
+
+
+async def run_db_read(fn: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """run_db для функций репозитория, которые только читают: реплика, если можно (см. read_session)."""
+    if AsyncSessionLocal is None:
+        maker = _read_maker(SessionLocal, _replica_makers)
+        return await run_in_threadpool(_call_with_maker, maker, fn, *args, **kwargs)
+    async with _read_maker(AsyncSessionLocal, _async_replica_makers)() as s:
+        return await s.run_sync(fn, *args, **kwargs)
+
+
+async def dispose_engines() -> None:
+    if async_engine is not None:
+        await async_engine.dispose()
+    for e in async_replica_engines:
+        await e.dispose()
@@ -0,0 +1,135 @@
+"""
+Учёт SQL-запросов в рамках одного HTTP-запроса.
+
+События SQLAlchemy (before/after_cursor_execute на классе Engine — то есть на primary,
+репликах и async-движках) пишут каждый запрос в QueryStats текущего запроса
+(ContextVar, который выставляет middleware в app/main.py). По итогам запроса
+известны:
+  - queries  — сколько запросов ушло в БД;
+  - time_ms  — суммарное время в БД;
+  - duplicates — повторы одного и того же SQL с теми же параметрами (лишний поход);
+  - repeated — один SQL с разными параметрами DB_N_PLUS_ONE_THRESHOLD+ раз (похоже на N+1).
+
+Ответ получает заголовки X-DB-Queries / X-DB-Time-Ms / X-DB-Duplicates, а строка
+лога печатается при DB_QUERY_LOG=true, при повторах и при превышении бюджета.
+
+Бюджет маршрута задаётся декоратором @query_budget(n). С DB_QUERY_BUDGET_STRICT=true
+(режим для тестов и scripts/check_query_budgets.py) превышение бюджета превращает
+ответ в 500, без него — только строка в логе.
+"""
+import os
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+DB_QUERY_LOG = os.getenv("DB_QUERY_LOG", "false").lower() == "true"
+DB_QUERY_BUDGET_STRICT = os.getenv("DB_QUERY_BUDGET_STRICT", "false").lower() == "true"
+DB_N_PLUS_ONE_THRESHOLD = int(os.getenv("DB_N_PLUS_ONE_THRESHOLD", "5"))
+
+QUERY_BUDGET_ATTR = "__query_budget__"
+
+
+class QueryStats:
+    """Запросы одного HTTP-запроса (или блока capture_queries())."""
+
+    def __init__(self):
+        self.queries = 0
+        self.time = 0.0
+        self._by_sql: Counter = Counter()
+        self._by_call: Counter = Counter()
+
+    def record(self, statement: str, parameters, elapsed: float) -> None:
+        self.queries += 1
+        self.time += elapsed
+        self._by_sql[statement] += 1
+        try:
+            self._by_call[(statement, repr(parameters))] += 1
+        except Exception:
+            pass
+
+    @property
+    def duplicates(self) -> int:
+        return sum(n - 1 for n in self._by_call.values() if n > 1)
+
+    def repeated(self, threshold: int = DB_N_PLUS_ONE_THRESHOLD) -> List[Tuple[str, int]]:
+        """SQL, выполненные threshold+ раз за запрос — кандидаты в N+1."""
+        return [(sql, n) for sql, n in self._by_sql.most_common() if n >= threshold]
+
+    def headers(self) -> Dict[str, str]:
+        return {
+            "X-DB-Queries": str(self.queries),
+            "X-DB-Time-Ms": f"{self.time * 1000:.3f}",
+            "X-DB-Duplicates": str(self.duplicates),
+        }
+
+    def summary(self) -> str:
+        line = f"queries={self.queries} db_ms={self.time * 1000:.1f} duplicates={self.duplicates}"
+        for sql, n in self.repeated():
+            line += f"\n    x{n}: {_short(sql)}"
+        return line
+
+
+_current: ContextVar[Optional[QueryStats]] = ContextVar("db_query_stats", default=None)
+
+
+def _short(sql: str, width: int = 120) -> str:
+    sql = " ".join(sql.split())
+    return sql if len(sql) <= width else sql[:width - 3] + "..."
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _current.get() is not None:
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    stats = _current.get()
+    if stats is None:
+        return
+    starts = conn.info.get("query_start")
+    if not starts:
+        return
+    elapsed = time.perf_counter() - starts.pop()
+    # PREPARE из app/statements.py — разовый на соединение, в бюджет маршрута не входит
+    if statement.lstrip()[:8].lower() == "prepare ":
+        return
+    stats.record(statement, parameters, elapsed)
+
+
+def start_request():
+    """Начать учёт для текущего контекста; вернуть (stats, token) для finish_request."""
+    stats = QueryStats()
+    return stats, _current.set(stats)
+
+
+def finish_request(token) -> None:
+    _current.reset(token)
+
+
+@contextmanager
+def capture_queries() -> Iterator[QueryStats]:
+    """Учёт запросов блока кода (скрипты, отладка): with capture_queries() as stats: ..."""
+    stats, token = start_request()
+    try:
+        yield stats
+    finally:
+        finish_request(token)
+
+
+def query_budget(max_queries: int) -> Callable:
+    """Декоратор эндпоинта: не больше max_queries запросов к БД на вызов."""
+    def decorator(fn: Callable) -> Callable:
+        setattr(fn, QUERY_BUDGET_ATTR, max_queries)
+        return fn
+    return decorator
+
+
+def budget_of(endpoint: Optional[Callable]) -> Optional[int]:
+    return getattr(endpoint, QUERY_BUDGET_ATTR, None) if endpoint else None
@@ -1,11 +1,17 @@
 from fastapi.middleware.cors import CORSMiddleware
-from typing import List, Optional
-from fastapi import FastAPI, HTTPException, Query, BackgroundTasks, UploadFile, File
-from fastapi.responses import FileResponse, JSONResponse
+from typing import List, Optional, Literal
+from fastapi import FastAPI, HTTPException, Query, Header, Depends, BackgroundTasks, UploadFile, File, Response, Request
+from fastapi.responses import FileResponse, JSONResponse, StreamingResponse
 from sqlalchemy.exc import IntegrityError
 from psycopg2 import errors as pgerr
-from .db import get_session
+from sqlalchemy.orm import Session
+from .db import (
+    get_session, get_read_session, db_session, read_session, run_db_read, dispose_engines, pool_status,
+    replicas_enabled, pin_primary, unpin_primary, DB_READ_AFTER_WRITE_SECONDS,
+)
 import os
+import math
+import time
 import uuid
 from pathlib import Path
 from PIL import Image
@@ -19,17 +25,27 @@ from .models import (
     ComplaintIn, ComplaintOut, ComplaintPatch,
     NoteIn, NoteOut, NotePatch,
     UserProfilePatch,
-    SpecializationOut, DoctorSearchOut, Gender,
+    SpecializationOut, DoctorSearchOut, DoctorSearchFacetsOut, Gender,
     DoctorPatientOut,
     ChatRequest, ChatResponse, ChatSessionOut,
     AppointmentReviewIn, AppointmentReviewOut, AppointmentReviewSummary,
     NextAppointmentOut,
+    UserBatchIn, UserBatchOut,
 )
 from . import repository as repo
 from . import chat
+from .cache import (
+    specializations_cache, search_cache,
+    start_specializations_listener, stop_specializations_listener,
+)
 from .repository import RESET_TOKEN_TTL_MIN
+from .serialization import json_rows, ndjson_chunks, NDJSON_MEDIA_TYPE
+from .instrumentation import (
+    start_request, finish_request, query_budget, budget_of,
+    DB_QUERY_LOG, DB_QUERY_BUDGET_STRICT,
+)
 from passlib.hash import bcrypt
-from datetime import date
+from datetime import date, datetime
 
 BYPASS_EMAIL_VERIFICATION = os.getenv("BYPASS_EMAIL_VERIFICATION", "false").lower() == "true"
 
@@ -40,8 +56,69 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "ETag", "X-DB-Primary-Until",
+                    "X-DB-Queries", "X-DB-Time-Ms", "X-DB-Duplicates"],
 )
 
+# Чтение своей записи при репликах: после успешного изменяющего запроса клиент
+# DB_READ_AFTER_WRITE_SECONDS секунд читает с primary. Срок отдаётся cookie и
+# заголовком X-DB-Primary-Until (unix time) — клиент без cookie может вернуть заголовок сам.
+PRIMARY_UNTIL_COOKIE = "db_primary_until"
+PRIMARY_UNTIL_HEADER = "X-DB-Primary-Until"
+# POST-запросы, которые только читают (batch-поиск, календарь врачей), primary не закрепляют
+READ_ONLY_POSTS = {"/users/batch", "/doctors/batch", "/clients/batch", "/doctors/availability"}
+
+
+def _primary_until(request: Request) -> float:
+    raw = request.headers.get(PRIMARY_UNTIL_HEADER) or request.cookies.get(PRIMARY_UNTIL_COOKIE)
+    try:
+        return float(raw) if raw else 0.0
+    except ValueError:
+        return 0.0
+
+
+@app.middleware("http")
+async def read_after_write_routing(request: Request, call_next):
+    if not replicas_enabled():
+        return await call_next(request)
+
+    token = pin_primary(_primary_until(request) > time.time())
+    try:
+        response = await call_next(request)
+    finally:
+        unpin_primary(token)
+
+    if (request.method not in ("GET", "HEAD", "OPTIONS") and request.url.path not in READ_ONLY_POSTS
+            and response.status_code < 400):
+        until = f"{time.time() + DB_READ_AFTER_WRITE_SECONDS:.3f}"
+        response.set_cookie(PRIMARY_UNTIL_COOKIE, until,
+                            max_age=math.ceil(DB_READ_AFTER_WRITE_SECONDS), httponly=True, samesite="lax")
+        response.headers[PRIMARY_UNTIL_HEADER] = until
+    return response
+
+
+@app.middleware("http")
+async def db_query_stats(request: Request, call_next):
+    # число запросов / время в БД / повторы — в заголовки ответа и в лог (app/instrumentation.py)
+    stats, token = start_request()
+    try:
+        response = await call_next(request)
+    finally:
+        finish_request(token)
+
+    budget = budget_of(request.scope.get("endpoint"))
+    over_budget = budget is not None and stats.queries > budget
+    if DB_QUERY_LOG or over_budget or stats.duplicates or stats.repeated():
+        note = f" budget={budget} EXCEEDED" if over_budget else ""
+        print(f"[db] {request.method} {request.url.path} {response.status_code} {stats.summary()}{note}")
+    if over_budget and DB_QUERY_BUDGET_STRICT:
+        response = JSONResponse(
+            status_code=500,
+            content={"detail": f"query budget exceeded: {stats.queries} > {budget}"},
+        )
+    response.headers.update(stats.headers())
+    return response
+
 # Настройки для аватарок
 AVATARS_DIR = Path(__file__).parent.parent / "avatars"
 AVATARS_DIR.mkdir(exist_ok=True)
@@ -53,220 +130,248 @@ MAX_IMAGE_DIMENSION = 2048  # максимальный размер сторон
 def health():
     return {"status": "ok"}
 
+SPECIALIZATIONS_HTTP_MAX_AGE = int(os.getenv("SPECIALIZATIONS_HTTP_MAX_AGE", "60"))
+
+
+@app.on_event("startup")
+def warm_specializations_cache():
+    # прогрев справочника, чтобы первый клиент не ходил в БД
+    try:
+        specializations_cache.get(_load_specializations)
+    except Exception as e:
+        print(f"⚠️ Не удалось прогреть кэш специализаций: {e}")
+    start_specializations_listener()
+
+
+@app.on_event("shutdown")
+def stop_specializations_cache_listener():
+    stop_specializations_listener()
+
+
+@app.on_event("shutdown")
+async def close_async_engine():
+    await dispose_engines()
+
+
+def _load_specializations():
+    s = get_session()
+    try:
+        return repo.list_specializations(s)
+    finally:
+        s.close()
+
+
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    tags = [t.strip() for t in if_none_match.split(",")]
+    return "*" in tags or etag in tags or f"W/{etag}" in tags
+
+
 @app.get("/specializations", response_model=List[SpecializationOut])
-def api_list_specializations(popular_only: bool = Query(False)):
+def api_list_specializations(
+    response: Response,
+    popular_only: bool = Query(False),
+    if_none_match: Optional[str] = Header(None),
+):
     """
     popular_only=true -> только популярные,
     popular_only=false -> все, популярные первыми.
+
+    Отдаётся из кэша процесса; поддерживает ETag / If-None-Match (304).
     """
-    s = get_session()
-    try:
-        return repo.list_specializations(s, popular_only=popular_only)
-    finally:
-        s.close()
+    rows, etag = specializations_cache.get(_load_specializations, popular_only=popular_only)
+    cache_control = f"public, max-age={SPECIALIZATIONS_HTTP_MAX_AGE}"
+    if _etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers={"ETag": etag, "Cache-Control": cache_control})
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = cache_control
+    return rows
 
-@app.get("/users", response_model=List[UserOut])
-def get_users(role: Optional[str] = Query(None)):
-    s = get_session()
+def _stream_users(s: Session, role: Optional[str], after_id: Optional[int], limit: Optional[int]):
     try:
-        return repo.list_users(s, role)
+        yield from ndjson_chunks(repo.iter_users(s, role, after_id, limit), UserOut)
     finally:
         s.close()
 
+
+@app.get(
+    "/users",
+    response_model=List[UserOut],
+    responses={200: {"content": {NDJSON_MEDIA_TYPE: {}}}},
+)
+@query_budget(1)
+def get_users(
+    response: Response,
+    role: Optional[str] = Query(None),
+    after_id: Optional[int] = Query(None, ge=0),
+    limit: Optional[int] = Query(None, ge=1, le=repo.USERS_PAGE_MAX),
+    fmt: Literal["json", "ndjson"] = Query("json", alias="format"),
+    s: Session = Depends(read_session),
+):
+    """
+    Пользователи по возрастанию id.
+    - limit + after_id: keyset-пагинация; id для следующей страницы — в заголовке
+      X-Next-Cursor (нет заголовка — страница последняя). Без limit — весь список, как раньше.
+    - format=ndjson: потоковая выгрузка (строка JSON на пользователя) через серверный
+      курсор — память не растёт с размером таблицы; after_id/limit тоже работают.
+    """
+    if fmt == "ndjson":
+        # сессия зависимости закрывается до отправки тела — у потока своя
+        return StreamingResponse(_stream_users(get_read_session(), role, after_id, limit),
+                                 media_type=NDJSON_MEDIA_TYPE)
+    rows = repo.list_users(s, role, after_id, limit)
+    if limit is not None and len(rows) == limit:
+        response.headers["X-Next-Cursor"] = str(rows[-1]["id"])
+    return json_rows(rows, UserOut, response)
+
 @app.patch("/users/{user_id}/profile", response_model=UserOut)
-def patch_user_profile(user_id: int, p: UserProfilePatch):
-    s = get_session()
+@query_budget(3)  # users + clinic_id в doctors/admins + сброс кэша поиска, если это врач
+def patch_user_profile(user_id: int, p: UserProfilePatch, s: Session = Depends(db_session)):
     try:
-        try:
-            r = repo.update_user_profile(s, user_id, p)
-            if not r:
-                # либо не найден, либо нечего обновлять
-                raise HTTPException(404, "user not found or nothing to update")
-            return r
-        except IntegrityError as e:
-            s.rollback()
-            raise _map_integrity(e)
-    finally:
-        s.close()
+        r = repo.update_user_profile(s, user_id, p)
+        if not r:
+            # либо не найден, либо нечего обновлять
+            raise HTTPException(404, "user not found or nothing to update")
+        return r
+    except IntegrityError as e:
+        s.rollback()
+        raise _map_integrity(e)
         
 # --- User profile (read) ---
 @app.get("/users/{user_id}/profile", response_model=UserOut)
-def api_get_user_profile(user_id: int):
-    s = get_session()
-    try:
-        u = repo.get_user_profile(s, user_id)
-        if not u:
-            raise HTTPException(404, "user not found")
-        return u
-    finally:
-        s.close()
+@query_budget(1)
+async def api_get_user_profile(user_id: int):
+    u = await run_db_read(repo.get_user_profile, user_id)
+    if not u:
+        raise HTTPException(404, "user not found")
+    return u
+
+@app.post("/users/batch", response_model=UserBatchOut)
+@query_budget(1)
+async def api_get_users_batch(body: UserBatchIn):
+    """Пользователи по списку users.id (by=id) или clients.id (by=client_id) одним запросом."""
+    items, missing = await run_db_read(repo.get_users_batch, body.ids, body.by)
+    return {"items": items, "missing": missing}
 
 @app.get("/users/by-email/{email}", response_model=Optional[UserOut])
-def find_by_email(email: str):
-    s = get_session()
-    try:
-        return repo.find_by_email(s, email)
-    finally:
-        s.close()
+def find_by_email(email: str, s: Session = Depends(read_session)):
+    return repo.find_by_email(s, email)
 
 @app.get("/users/by-login/{login}", response_model=Optional[UserOut])
-def find_by_login(login: str):
-    s = get_session()
-    try:
-        return repo.find_by_login(s, login)
-    finally:
-        s.close()
+def find_by_login(login: str, s: Session = Depends(read_session)):
+    return repo.find_by_login(s, login)
 
 @app.get("/users/exists/email/{email}", response_model=bool)
-def exists_by_email(email: str):
-    s = get_session()
-    try:
-        return repo.exists_by_email(s, email)
-    finally:
-        s.close()
+def exists_by_email(email: str, s: Session = Depends(read_session)):
+    return repo.exists_by_email(s, email)
 
 @app.get("/users/exists/login/{login}", response_model=bool)
-def exists_by_login(login: str):
-    s = get_session()
-    try:
-        return repo.exists_by_login(s, login)
-    finally:
-        s.close()
+def exists_by_login(login: str, s: Session = Depends(read_session)):
+    return repo.exists_by_login(s, login)
 
 @app.post("/users", response_model=UserOut, status_code=201)
-def insert_user(user: UserIn):
-    s = get_session()
+def insert_user(user: UserIn, s: Session = Depends(db_session)):
     try:
-        try:
-            return repo.insert_user(s, user)
-        except IntegrityError as e:
-            s.rollback()
-            raise _map_integrity(e)
-        except ValueError as ve:
-            s.rollback()
-            raise HTTPException(status_code=400, detail=str(ve))
-    finally:
-        s.close()
+        return repo.insert_user(s, user)
+    except IntegrityError as e:
+        s.rollback()
+        raise _map_integrity(e)
+    except ValueError as ve:
+        s.rollback()
+        raise HTTPException(status_code=400, detail=str(ve))
 
 @app.post("/register", response_model=UserOut, status_code=201)
-def register(reg: RegistrationIn):
-    s = get_session()
+def register(reg: RegistrationIn, s: Session = Depends(db_session)):
     try:
-        try:
-            return repo.register_user_with_role(s, reg)
-        except IntegrityError as e:
-            s.rollback()
-            raise _map_integrity(e)
-        except ValueError as ve:
-            s.rollback()
-            raise HTTPException(status_code=400, detail=str(ve))
-    finally:
-        s.close()
+        return repo.register_user_with_role(s, reg)
+    except IntegrityError as e:
+        s.rollback()
+        raise _map_integrity(e)
+    except ValueError as ve:
+        s.rollback()
+        raise HTTPException(status_code=400, detail=str(ve))
 
 @app.post("/auth/login", response_model=ApiLoginResponse)
-def auth_login(req: LoginIn):
-    s = get_session()
-    try:
-        u = repo.find_auth_by_login_or_email(s, req.login_or_email)
+def auth_login(req: LoginIn, s: Session = Depends(db_session)):
+    u = repo.find_auth_by_login_or_email(s, req.login_or_email)
 
-        # нет юзера, отключен, или неверный пароль
-        if not u:
-            return ApiLoginResponse(
-            success=False,
-            error="USER_NOT_FOUND",
-            )
-
-        # пользователь отключен
-        if not u["is_active"]:
-            return ApiLoginResponse(
-            success=False,
-            error="ACCOUNT_DISABLED",
-            )
+    # нет юзера, отключен, или неверный пароль
+    if not u:
+        return ApiLoginResponse(
+        success=False,
+        error="USER_NOT_FOUND",
+        )
 
-        # неверный пароль
-        if not bcrypt.verify(req.password, u["password_hash"]):
-            return ApiLoginResponse(
-            success=False,
-            error="INVALID_PASSWORD",
-            )
+    # пользователь отключен
+    if not u["is_active"]:
+        return ApiLoginResponse(
+        success=False,
+        error="ACCOUNT_DISABLED",
+        )
 
+    # неверный пароль
+    if not bcrypt.verify(req.password, u["password_hash"]):
+        return ApiLoginResponse(
+        success=False,
+        error="INVALID_PASSWORD",
+        )
 
-        # пароль ок, но email не подтверждён
-        if u.get("email_verified_at") is None and not BYPASS_EMAIL_VERIFICATION:
-            return ApiLoginResponse(
-                success=False,
-                error="EMAIL_NOT_VERIFIED",
-            )
 
-        # всё ок
+    # пароль ок, но email не подтверждён
+    if u.get("email_verified_at") is None and not BYPASS_EMAIL_VERIFICATION:
         return ApiLoginResponse(
-            success=True,
-            role=u["role"],
+            success=False,
+            error="EMAIL_NOT_VERIFIED",
         )
-    finally:
-        s.close()
+
+    # всё ок
+    return ApiLoginResponse(
+        success=True,
+        role=u["role"],
+    )
 
 @app.post("/auth/email/start")
-def start_email_verification(body: EmailStartVerificationIn, bt: BackgroundTasks):
-    s = get_session()
-    try:
-        uid = repo.find_user_id_by_email(s, body.email)
-        if not uid:
-            raise HTTPException(404, "user not found")
-        raw_token = repo.start_email_verification(s, uid)
+def start_email_verification(body: EmailStartVerificationIn, bt: BackgroundTasks, s: Session = Depends(db_session)):
+    uid = repo.find_user_id_by_email(s, body.email)
+    if not uid:
+        raise HTTPException(404, "user not found")
+    raw_token = repo.start_email_verification(s, uid)
 
-        return {"token": raw_token, "message": "verification link sent to email"}
-    finally:
-        s.close()
+    return {"token": raw_token, "message": "verification link sent to email"}
 
 @app.post("/auth/email/verify")
-def verify_email(body: EmailVerifyIn):
-    s = get_session()
-    try:
-        ok = repo.verify_email_token(s, body.token)
-        if not ok:
-            raise HTTPException(400, "invalid or expired token")
-        return {"status": "verified"}
-    finally:
-        s.close()
+def verify_email(body: EmailVerifyIn, s: Session = Depends(db_session)):
+    ok = repo.verify_email_token(s, body.token)
+    if not ok:
+        raise HTTPException(400, "invalid or expired token")
+    return {"status": "verified"}
 
 @app.get("/auth/email/verify")
-def verify_email_by_link(token: str):
-    s = get_session()
-    try:
-        ok = repo.verify_email_token(s, token)
-        if not ok:
-            raise HTTPException(400, "invalid or expired token")
-        return {"status": "verified"}
-    finally:
-        s.close()
+def verify_email_by_link(token: str, s: Session = Depends(db_session)):
+    ok = repo.verify_email_token(s, token)
+    if not ok:
+        raise HTTPException(400, "invalid or expired token")
+    return {"status": "verified"}
 
 # == Password reset ==
 @app.post("/auth/password/forgot")
-def password_forgot(body: PasswordForgotIn, bt: BackgroundTasks):
-    s = get_session()
-    try:
-        uid = repo.find_user_id_by_email(s, body.email)
-        if not uid:
-            # чтобы не палить существование пользователя, можно всегда возвращать 200
-            raise HTTPException(404, "user not found")
+def password_forgot(body: PasswordForgotIn, bt: BackgroundTasks, s: Session = Depends(db_session)):
+    uid = repo.find_user_id_by_email(s, body.email)
+    if not uid:
+        # чтобы не палить существование пользователя, можно всегда возвращать 200
+        raise HTTPException(404, "user not found")
 
-        raw = repo.start_password_reset(s, uid)
+    raw = repo.start_password_reset(s, uid)
 
-        return {"token": raw, "message": "reset link sent to email"}
-    finally:
-        s.close()
+    return {"token": raw, "message": "reset link sent to email"}
 
 @app.post("/auth/password/reset")
-def password_reset(body: PasswordResetIn):
-    s = get_session()
-    try:
-        ok = repo.consume_password_reset(s, body.token, body.new_password)
-        if not ok:
-            raise HTTPException(400, "invalid or expired token")
-        return {"status": "password_changed"}
-    finally:
-        s.close()
+def password_reset(body: PasswordResetIn, s: Session = Depends(db_session)):
+    ok = repo.consume_password_reset(s, body.token, body.new_password)
+    if not ok:
+        raise HTTPException(400, "invalid or expired token")
+    return {"status": "password_changed"}
 
 def _map_integrity(e: IntegrityError) -> HTTPException:
     orig = getattr(e, "orig", None)
@@ -284,86 +389,54 @@ def _map_integrity(e: IntegrityError) -> HTTPException:
 # ===== Complaints =====
 
 @app.post("/patients/{patient_id}/complaints", response_model=ComplaintOut, status_code=201)
-def create_complaint(patient_id: int, c: ComplaintIn):
-    s = get_session()
-    try:
-        # (опционально) можно проверить, что patient_id существует и это CLIENT
-        r = repo.create_complaint(s, patient_id, c)
-        return r
-    finally:
-        s.close()
+def create_complaint(patient_id: int, c: ComplaintIn, s: Session = Depends(db_session)):
+    # (опционально) можно проверить, что patient_id существует и это CLIENT
+    r = repo.create_complaint(s, patient_id, c)
+    return r
 
 @app.get("/patients/{patient_id}/complaints", response_model=List[ComplaintOut])
-def list_complaints(patient_id: int, status: Optional[str] = Query(None)):
-    s = get_session()
-    try:
-        return repo.list_complaints(s, patient_id, status)
-    finally:
-        s.close()
+def list_complaints(patient_id: int, status: Optional[str] = Query(None), s: Session = Depends(read_session)):
+    return repo.list_complaints(s, patient_id, status)
 
 @app.patch("/complaints/{complaint_id}", response_model=ComplaintOut)
-def patch_complaint(complaint_id: int, p: ComplaintPatch):
-    s = get_session()
-    try:
-        r = repo.patch_complaint(s, complaint_id, p)
-        if not r:
-            raise HTTPException(404, "complaint not found or nothing to update")
-        return r
-    finally:
-        s.close()
+def patch_complaint(complaint_id: int, p: ComplaintPatch, s: Session = Depends(db_session)):
+    r = repo.patch_complaint(s, complaint_id, p)
+    if not r:
+        raise HTTPException(404, "complaint not found or nothing to update")
+    return r
 
 @app.delete("/complaints/{complaint_id}", status_code=204)
-def delete_complaint(complaint_id: int):
-    s = get_session()
-    try:
-        ok = repo.delete_complaint(s, complaint_id)
-        if not ok:
-            raise HTTPException(404, "complaint not found")
-        return
-    finally:
-        s.close()
+def delete_complaint(complaint_id: int, s: Session = Depends(db_session)):
+    ok = repo.delete_complaint(s, complaint_id)
+    if not ok:
+        raise HTTPException(404, "complaint not found")
+    return
 
 # ===== Doctor Notes =====
 
 @app.post("/patients/{patient_id}/notes", response_model=NoteOut, status_code=201)
-def create_note(patient_id: int, n: NoteIn):
-    s = get_session()
-    try:
-        # (опционально) проверить, что doctor_id существует и role == DOCTOR
-        r = repo.create_note(s, patient_id, n)
-        return r
-    finally:
-        s.close()
+def create_note(patient_id: int, n: NoteIn, s: Session = Depends(db_session)):
+    # (опционально) проверить, что doctor_id существует и role == DOCTOR
+    r = repo.create_note(s, patient_id, n)
+    return r
 
 @app.get("/patients/{patient_id}/notes", response_model=List[NoteOut])
-def list_notes(patient_id: int, include_internal: bool = Query(True)):
-    s = get_session()
-    try:
-        return repo.list_notes(s, patient_id, include_internal)
-    finally:
-        s.close()
+def list_notes(patient_id: int, include_internal: bool = Query(True), s: Session = Depends(read_session)):
+    return repo.list_notes(s, patient_id, include_internal)
 
 @app.patch("/notes/{note_id}", response_model=NoteOut)
-def patch_note(note_id: int, p: NotePatch):
-    s = get_session()
-    try:
-        r = repo.patch_note(s, note_id, p)
-        if not r:
-            raise HTTPException(404, "note not found or nothing to update")
-        return r
-    finally:
-        s.close()
+def patch_note(note_id: int, p: NotePatch, s: Session = Depends(db_session)):
+    r = repo.patch_note(s, note_id, p)
+    if not r:
+        raise HTTPException(404, "note not found or nothing to update")
+    return r
 
 @app.delete("/notes/{note_id}", status_code=204)
-def delete_note(note_id: int):
-    s = get_session()
-    try:
-        ok = repo.delete_note(s, note_id)
-        if not ok:
-            raise HTTPException(404, "note not found")
-        return
-    finally:
-        s.close()
+def delete_note(note_id: int, s: Session = Depends(db_session)):
+    ok = repo.delete_note(s, note_id)
+    if not ok:
+        raise HTTPException(404, "note not found")
+    return
         
         
 # ===== NEW: Domain v2 routes =====
@@ -372,293 +445,300 @@ from .models import (
     DoctorIn, DoctorOut,
     AdminIn, AdminOut,
     SlotIn, SlotOut,
+    ScheduleTemplateIn, ScheduleTemplateOut, ScheduleExceptionIn, ScheduleExceptionOut,
+    ScheduleOut, ScheduleGenerateIn, ScheduleGenerateOut,
     AppointmentIn, AppointmentOut,
     MedicalRecordIn, MedicalRecordOut,
     MedicalDocumentIn, MedicalDocumentOut,
     DoctorReviewIn, DoctorReviewOut,
     ClientPatch, DoctorPatch, AdminPatch,
+    DoctorBatchIn, DoctorBatchOut, ClientBatchIn, ClientBatchOut,
+    DoctorAvailabilityIn, DoctorAvailabilityBatchOut,
+    EarliestSlotOut, EARLIEST_SLOTS_MAX,
 )
 
 # --- Clients ---
 @app.post("/clients", response_model=ClientOut, status_code=201)
-def api_create_client(body: ClientIn):
-    s = get_session()
-    try:
-        return repo.create_client(s, body)
-    finally:
-        s.close()
+def api_create_client(body: ClientIn, s: Session = Depends(db_session)):
+    return repo.create_client(s, body)
 
 @app.get("/clients/by-user/{user_id}", response_model=ClientOut | None)
-def api_get_client_by_user(user_id: int):
-    s = get_session()
-    try:
-        return repo.get_client_by_user_id(s, user_id)
-    finally:
-        s.close()
+async def api_get_client_by_user(user_id: int):
+    return await run_db_read(repo.get_client_by_user_id, user_id)
 
 @app.get("/users/by-client/{client_id}", response_model=UserOut | None)
-def api_get_client_by_user(client_id: int):
-    s = get_session()
-    try:
-        return repo.get_user_by_client_id(s, client_id)
-    finally:
-        s.close()
+def api_get_client_by_user(client_id: int, s: Session = Depends(read_session)):
+    return repo.get_user_by_client_id(s, client_id)
 
 @app.get("/clients/{client_id}", response_model=ClientOut | None)
-def api_get_client(client_id: int):
-    s = get_session()
-    try:
-        return repo.get_client(s, client_id)
-    finally:
-        s.close()
+async def api_get_client(client_id: int):
+    return await run_db_read(repo.get_client, client_id)
+
+@app.post("/clients/batch", response_model=ClientBatchOut)
+@query_budget(1)
+async def api_get_clients_batch(body: ClientBatchIn):
+    """Клиенты по списку clients.id (by=id) или users.id (by=user_id) одним запросом."""
+    items, missing = await run_db_read(repo.get_clients_batch, body.ids, body.by)
+    return {"items": items, "missing": missing}
 
 # --- Doctors ---
 @app.post("/doctors", response_model=DoctorOut, status_code=201)
-def api_create_doctor(body: DoctorIn):
-    s = get_session()
-    try:
-        return repo.create_doctor(s, body)
-    finally:
-        s.close()
+def api_create_doctor(body: DoctorIn, s: Session = Depends(db_session)):
+    return repo.create_doctor(s, body)
 
 @app.get("/doctors/by-user/{user_id}", response_model=DoctorOut | None)
-def api_get_doctor_by_user(user_id: int):
-    s = get_session()
+async def api_get_doctor_by_user(user_id: int):
+    return await run_db_read(repo.get_doctor_by_user_id, user_id)
+
+@app.post("/doctors/batch", response_model=DoctorBatchOut)
+@query_budget(1)
+async def api_get_doctors_batch(body: DoctorBatchIn):
+    """Врачи по списку doctors.id (by=id) или users.id (by=user_id) одним запросом."""
+    items, missing = await run_db_read(repo.get_doctors_batch, body.ids, body.by)
+    return {"items": items, "missing": missing}
+
+@app.post("/doctors/availability", response_model=DoctorAvailabilityBatchOut)
+@query_budget(1)
+async def api_get_doctors_availability(body: DoctorAvailabilityIn):
+    """
+    Календарь для нескольких карточек врачей: число свободных слотов по дням
+    за [date_from, date_to] (не больше 92 дней) одним запросом.
+    """
     try:
-        return repo.get_doctor_by_user_id(s, user_id)
-    finally:
-        s.close()
-        
+        items, missing = await run_db_read(
+            repo.list_availability_for_doctors, body.ids, body.date_from, body.date_to)
+    except ValueError as ve:
+        raise HTTPException(400, str(ve))
+    return {"items": items, "missing": missing}
+
 @app.get("/doctors/{doctor_id}/available-dates", response_model=List[date])
-def api_get_doctor_available_dates(doctor_id: int):
+@query_budget(1)
+async def api_get_doctor_available_dates(doctor_id: int):
     """
     Доступные даты для календаря врача:
     только те дни, когда есть хотя бы один свободный слот.
     """
-    s = get_session()
-    try:
-        return repo.list_available_dates_for_doctor(s, doctor_id)
-    finally:
-        s.close()
+    return await run_db_read(repo.list_available_dates_for_doctor, doctor_id)
 
 # --- Client complaints (совместимость: принимаем patient_user_id) ---
 @app.post("/v2/patients/{patient_user_id}/complaints", status_code=201)
-def api_create_client_complaint(patient_user_id: int, c: ComplaintIn):
-    s = get_session()
-    try:
-        r = repo.create_client_complaint_by_user(s, patient_user_id, c)
-        if not r:
-            raise HTTPException(404, "client not found for given user")
-        return r
-    finally:
-        s.close()
+def api_create_client_complaint(patient_user_id: int, c: ComplaintIn, s: Session = Depends(db_session)):
+    r = repo.create_client_complaint_by_user(s, patient_user_id, c)
+    if not r:
+        raise HTTPException(404, "client not found for given user")
+    return r
 
 @app.get("/v2/patients/{patient_user_id}/complaints")
-def api_list_client_complaints(patient_user_id: int):
-    s = get_session()
-    try:
-        return repo.list_client_complaints_by_user(s, patient_user_id)
-    finally:
-        s.close()
+def api_list_client_complaints(patient_user_id: int, s: Session = Depends(read_session)):
+    return repo.list_client_complaints_by_user(s, patient_user_id)
 
 # --- Slots ---
 @app.post("/doctors/{doctor_id}/slots", response_model=SlotOut, status_code=201)
-def api_create_slot(doctor_id: int, body: SlotIn):
+def api_create_slot(doctor_id: int, body: SlotIn, s: Session = Depends(db_session)):
     if body.doctor_id != doctor_id:
         raise HTTPException(400, "doctor_id mismatch")
-    s = get_session()
-    try:
-        return repo.create_slot(s, body)
-    finally:
-        s.close()
+    return repo.create_slot(s, body)
 
 @app.get("/doctors/{doctor_id}/slots", response_model=List[SlotOut])
-def api_list_slots(
+@query_budget(1)
+async def api_list_slots(
     doctor_id: int,
     date_filter: Optional[date] = Query(None, alias="date"),
 ):
     """
     Все слоты врача. Если передать ?date=YYYY-MM-DD — вернёт слоты только за этот день.
     """
-    s = get_session()
-    try:
-        return repo.list_slots_for_doctor(s, doctor_id, date_filter)
-    finally:
-        s.close()
+    return await run_db_read(repo.list_slots_for_doctor, doctor_id, date_filter)
+
+@app.get("/slots/earliest", response_model=List[EarliestSlotOut])
+@query_budget(1)
+async def api_list_earliest_slots(
+    specialization_id: Optional[int] = Query(None),
+    city: Optional[str] = Query(None),
+    after: Optional[datetime] = Query(None),
+    limit: int = Query(10, ge=1, le=EARLIEST_SLOTS_MAX),
+):
+    """
+    Ближайшие свободные слоты среди врачей специализации и/или города:
+    по одному самому раннему слоту на врача, не раньше after (по умолчанию — сейчас),
+    отсортированы по времени начала.
+    """
+    return await run_db_read(repo.list_earliest_slots, specialization_id, city, after, limit)
         
 @app.delete("/doctors/{doctor_id}/slots/{slot_id}", status_code=204)
-def api_delete_slot(doctor_id: int, slot_id: int):
+def api_delete_slot(doctor_id: int, slot_id: int, s: Session = Depends(db_session)):
     """
     Удалить слот врача. Нельзя удалить занятый слот.
     """
-    s = get_session()
+    ok = repo.delete_slot_for_doctor(s, doctor_id, slot_id)
+    if not ok:
+        # чтобы не палить детали, даём общее сообщение
+        raise HTTPException(
+            400,
+            "slot not found, belongs to another doctor or is already booked",
+        )
+    return
+
+# --- Doctor schedule templates ---
+def _schedule_error(e: IntegrityError) -> HTTPException:
+    if isinstance(getattr(e, "orig", None), pgerr.ForeignKeyViolation):
+        return HTTPException(404, "doctor not found")
+    # CHECK: start < end, перерыв внутри интервала, часы исключения без slot_minutes
+    return HTTPException(400, "invalid schedule interval")
+
+@app.get("/doctors/{doctor_id}/schedule", response_model=ScheduleOut)
+def api_get_schedule(doctor_id: int, s: Session = Depends(read_session)):
+    """Недельные шаблоны расписания врача и исключения с сегодняшнего дня."""
+    return repo.get_doctor_schedule(s, doctor_id)
+
+@app.put("/doctors/{doctor_id}/schedule/templates", response_model=List[ScheduleTemplateOut])
+def api_replace_schedule_templates(doctor_id: int, body: List[ScheduleTemplateIn],
+                                   s: Session = Depends(db_session)):
+    """Заменить недельные шаблоны врача целиком (пустой список — удалить все)."""
+    try:
+        return repo.replace_schedule_templates(s, doctor_id, body)
+    except IntegrityError as e:
+        s.rollback()
+        raise _schedule_error(e)
+    except ValueError as ve:
+        raise HTTPException(400, str(ve))
+
+@app.put("/doctors/{doctor_id}/schedule/exceptions/{day}", response_model=ScheduleExceptionOut)
+def api_put_schedule_exception(doctor_id: int, day: date, body: ScheduleExceptionIn,
+                               s: Session = Depends(db_session)):
+    """Исключение на день: без часов — выходной, с часами — они вместо шаблонов этого дня."""
+    try:
+        return repo.upsert_schedule_exception(s, doctor_id, day, body)
+    except IntegrityError as e:
+        s.rollback()
+        raise _schedule_error(e)
+
+@app.delete("/doctors/{doctor_id}/schedule/exceptions/{day}", status_code=204)
+def api_delete_schedule_exception(doctor_id: int, day: date, s: Session = Depends(db_session)):
+    if not repo.delete_schedule_exception(s, doctor_id, day):
+        raise HTTPException(404, "schedule exception not found")
+    return
+
+@app.post("/doctors/{doctor_id}/schedule/generate", response_model=ScheduleGenerateOut)
+def api_generate_slots(doctor_id: int, body: ScheduleGenerateIn, s: Session = Depends(db_session)):
+    """
+    Создать слоты по шаблонам за [date_from, date_to] (не больше года) одним запросом.
+    Прошедшие и пересекающиеся с существующими слоты пропускаются — повторный вызов
+    ничего не создаёт.
+    """
     try:
-        ok = repo.delete_slot_for_doctor(s, doctor_id, slot_id)
-        if not ok:
-            # чтобы не палить детали, даём общее сообщение
-            raise HTTPException(
-                400,
-                "slot not found, belongs to another doctor or is already booked",
-            )
-        return
-    finally:
-        s.close()
+        return repo.generate_slots_from_schedule(s, doctor_id, body.date_from, body.date_to)
+    except ValueError as ve:
+        raise HTTPException(400, str(ve))
 
 # --- Appointments ---
 @app.post("/appointments", response_model=AppointmentOut, status_code=201)
-def api_book_appointment(body: AppointmentIn):
-    s = get_session()
-    try:
-        r = repo.book_appointment(s, body)
-        if not r:
-            raise HTTPException(400, "slot not available")
-        return r
-    finally:
-        s.close()
+@query_budget(2)  # запись + сброс кэша поиска по врачу
+def api_book_appointment(body: AppointmentIn, s: Session = Depends(db_session)):
+    try:
+        return repo.book_appointment(s, body)
+    except IntegrityError:
+        # внешний ключ: нет такого клиента или типа приёма
+        s.rollback()
+        raise HTTPException(400, "client or appointment type does not exist")
+    except ValueError as ve:
+        if str(ve) == "slot_not_found":
+            raise HTTPException(404, "slot not found")
+        raise HTTPException(409, "slot already booked")
 
 @app.get("/clients/{client_id}/appointments", response_model=List[AppointmentOut])
-def api_list_appointments_for_client(client_id: int):
-    s = get_session()
-    try:
-        return repo.list_appointments_for_client(s, client_id)
-    finally:
-        s.close()
+@query_budget(1)
+async def api_list_appointments_for_client(client_id: int):
+    return json_rows(await run_db_read(repo.list_appointments_for_client, client_id), AppointmentOut)
 
 
 @app.get(
     "/clients/{client_id}/appointments/next",
     response_model=NextAppointmentOut | None,
 )
-def api_get_next_appointment_for_client(client_id: int):
-    s = get_session()
-    try:
-        r = repo.get_next_appointment_for_client(s, client_id)
-        return r if r else None
-    finally:
-        s.close()
+@query_budget(1)
+async def api_get_next_appointment_for_client(client_id: int):
+    r = await run_db_read(repo.get_next_appointment_for_client, client_id)
+    return r if r else None
+
+
+def _review_summary(r: dict) -> dict:
+    """Строка истории приёмов -> AppointmentReviewSummary (dict, вложенный review — тоже dict)."""
+    return {
+        "appointment_id": r["appointment_id"],
+        "status": r["status"],
+        "slot_start": r["slot_start"],
+        "slot_end": r["slot_end"],
+        "doctor_id": r["doctor_id"],
+        "doctor_name": " ".join(filter(None, [r.get("doctor_surname"), r.get("doctor_name")])) or None,
+        "doctor_profession": r.get("doctor_profession"),
+        "review": {
+            "id": r["review_id"],
+            "appointment_id": r["review_appointment_id"],
+            "doctor_id": r["review_doctor_id"],
+            "client_id": r["review_client_id"],
+            "rating": r["rating"],
+            "comment": r["comment"],
+            "created_at": r["review_created_at"],
+            "updated_at": r["review_updated_at"],
+        } if r.get("review_id") else None,
+    }
 
 
 @app.get("/clients/{client_id}/appointments/history", response_model=List[AppointmentReviewSummary])
-def api_list_appointment_history(client_id: int):
-    s = get_session()
-    try:
-        rows = repo.list_appointments_with_reviews(s, client_id)
-        return [
-            AppointmentReviewSummary(
-                appointment_id=r["appointment_id"],
-                status=r["status"],
-                slot_start=r["slot_start"],
-                slot_end=r["slot_end"],
-                doctor_id=r["doctor_id"],
-                doctor_name=" ".join(
-                    filter(None, [r.get("doctor_surname"), r.get("doctor_name")])
-                ) or None,
-                doctor_profession=r.get("doctor_profession"),
-                review=
-                    AppointmentReviewOut(
-                        id=r["review_id"],
-                        appointment_id=r["review_appointment_id"],
-                        doctor_id=r["review_doctor_id"],
-                        client_id=r["review_client_id"],
-                        rating=r["rating"],
-                        comment=r["comment"],
-                        created_at=r["review_created_at"],
-                        updated_at=r["review_updated_at"],
-                    )
-                    if r.get("review_id")
-                    else None,
-            )
-            for r in rows
-        ]
-    finally:
-        s.close()
+def api_list_appointment_history(client_id: int, s: Session = Depends(read_session)):
+    rows = repo.list_appointments_with_reviews(s, client_id)
+    return json_rows(map(_review_summary, rows), AppointmentReviewSummary)
 
 
 @app.get(
     "/clients/{client_id}/appointments/pending-reviews",
     response_model=List[AppointmentReviewSummary],
 )
-def api_list_pending_reviews(client_id: int):
-    s = get_session()
-    try:
-        rows = repo.list_pending_reviews(s, client_id)
-        return [
-            AppointmentReviewSummary(
-                appointment_id=r["appointment_id"],
-                status=r["status"],
-                slot_start=r["slot_start"],
-                slot_end=r["slot_end"],
-                doctor_id=r["doctor_id"],
-                doctor_name=" ".join(
-                    filter(None, [r.get("doctor_surname"), r.get("doctor_name")])
-                ) or None,
-                doctor_profession=r.get("doctor_profession"),
-                review=None,
-            )
-            for r in rows
-        ]
-    finally:
-        s.close()
+def api_list_pending_reviews(client_id: int, s: Session = Depends(read_session)):
+    # у ожидающих отзыва review_id нет — review будет None
+    rows = repo.list_pending_reviews(s, client_id)
+    return json_rows(map(_review_summary, rows), AppointmentReviewSummary)
         
 @app.post("/appointments/{appointment_id}/cancel", status_code=204)
-def api_cancel_appointment(appointment_id: int):
+def api_cancel_appointment(appointment_id: int, s: Session = Depends(db_session)):
     """
     Клиент отменяет запись:
     - слот становится свободным
     - запись помечена как CANCELED
     """
-    s = get_session()
-    try:
-        ok = repo.cancel_appointment(s, appointment_id)
-        if not ok:
-            raise HTTPException(404, "appointment not found")
-        return
-    finally:
-        s.close()
+    ok = repo.cancel_appointment(s, appointment_id)
+    if not ok:
+        raise HTTPException(404, "appointment not found")
+    return
 
 @app.post("/appointments/{appointment_id}/complete", status_code=204)
-def api_complete_appointment(appointment_id: int):
+def api_complete_appointment(appointment_id: int, s: Session = Depends(db_session)):
     """
     Завершить приём (инициировано врачом).
     """
-    s = get_session()
-    try:
-        ok = repo.complete_appointment(s, appointment_id)
-        if not ok:
-            raise HTTPException(404, "appointment not found")
-        return
-    finally:
-        s.close()
+    ok = repo.complete_appointment(s, appointment_id)
+    if not ok:
+        raise HTTPException(404, "appointment not found")
+    return
 
 
 @app.get("/appointments/{appointment_id}/review", response_model=AppointmentReviewOut | None)
-def api_get_appointment_review(appointment_id: int):
-    s = get_session()
-    try:
-        return repo.get_appointment_review(s, appointment_id)
-    finally:
-        s.close()
+def api_get_appointment_review(appointment_id: int, s: Session = Depends(read_session)):
+    return repo.get_appointment_review(s, appointment_id)
 
 
 @app.put("/appointments/{appointment_id}/review", response_model=AppointmentReviewOut)
-def api_upsert_appointment_review(appointment_id: int, body: AppointmentReviewIn):
-    s = get_session()
-    try:
-        r = repo.upsert_appointment_review(s, appointment_id, body)
-        if not r:
-            raise HTTPException(404, "appointment not found")
-        return r
-    finally:
-        s.close()
+def api_upsert_appointment_review(appointment_id: int, body: AppointmentReviewIn, s: Session = Depends(db_session)):
+    r = repo.upsert_appointment_review(s, appointment_id, body)
+    if not r:
+        raise HTTPException(404, "appointment not found")
+    return r
 
 # --- Medical records / documents ---
 @app.post("/records", response_model=MedicalRecordOut, status_code=201)
-def api_create_medical_record(body: MedicalRecordIn):
-    s = get_session()
-    try:
-        return repo.create_medical_record(s, body)
-    finally:
-        s.close()
+def api_create_medical_record(body: MedicalRecordIn, s: Session = Depends(db_session)):
+    return repo.create_medical_record(s, body)
 
 # --- Medical records by client ---
 
@@ -667,137 +747,111 @@ def api_create_medical_record(body: MedicalRecordIn):
     response_model=MedicalRecordOut,
     status_code=201
 )
-def api_create_medical_record_for_client(client_id: int, body: MedicalRecordIn):
-    s = get_session()
-    try:
-        # client_id из URL является основным
-        return repo.create_medical_record_for_client(s, client_id, body)
-    finally:
-        s.close()
+def api_create_medical_record_for_client(client_id: int, body: MedicalRecordIn, s: Session = Depends(db_session)):
+    # client_id из URL является основным
+    return repo.create_medical_record_for_client(s, client_id, body)
 
 
 @app.patch(
     "/clients/medical-records/{record_id}",
     response_model=MedicalRecordOut
 )
-def api_patch_medical_record(record_id: int, p: m.MedicalRecordIn):
-    s = get_session()
-    try:
-        r = repo.patch_medical_record(s, p.client_id, record_id, p)
-        if not r:
-            raise HTTPException(404, "medical record not found or nothing to update")
-        return r
-    finally:
-        s.close()
+def api_patch_medical_record(record_id: int, p: m.MedicalRecordIn, s: Session = Depends(db_session)):
+    r = repo.patch_medical_record(s, p.client_id, record_id, p)
+    if not r:
+        raise HTTPException(404, "medical record not found or nothing to update")
+    return r
 
 
 @app.delete(
     "/clients/medical-records/{record_id}",
     status_code=204
 )
-def api_delete_medical_record(record_id: int):
-    s = get_session()
-    try:
-        ok = repo.delete_medical_record(s, record_id)
-        if not ok:
-            raise HTTPException(404, "medical record not found")
-        return
-    finally:
-        s.close()
+def api_delete_medical_record(record_id: int, s: Session = Depends(db_session)):
+    ok = repo.delete_medical_record(s, record_id)
+    if not ok:
+        raise HTTPException(404, "medical record not found")
+    return
 
 @app.get(
     "/clients/medical-records/{record_id}",
     status_code=200
 )
-def api_get_medical_record(record_id: int):
-    s = get_session()
-    try:
-        ok = repo.get_medical_record(s, record_id)
-        if not ok:
-            raise HTTPException(404, "medical record not found")
-        return ok
-    finally:
-        s.close()
+def api_get_medical_record(record_id: int, s: Session = Depends(read_session)):
+    ok = repo.get_medical_record(s, record_id)
+    if not ok:
+        raise HTTPException(404, "medical record not found")
+    return ok
 
 @app.post("/records/{record_id}/documents", response_model=MedicalDocumentOut, status_code=201)
-def api_add_medical_document(record_id: int, body: MedicalDocumentIn):
+def api_add_medical_document(record_id: int, body: MedicalDocumentIn, s: Session = Depends(db_session)):
     if body.record_id != record_id:
         raise HTTPException(400, "record_id mismatch")
-    s = get_session()
-    try:
-        return repo.add_medical_document(s, body)
-    finally:
-        s.close()
+    return repo.add_medical_document(s, body)
 
 # --- Doctor reviews ---
 @app.post("/doctors/{doctor_id}/reviews", response_model=DoctorReviewOut, status_code=201)
-def api_create_review(doctor_id: int, body: DoctorReviewIn):
+def api_create_review(doctor_id: int, body: DoctorReviewIn, s: Session = Depends(db_session)):
     if body.doctor_id != doctor_id:
         raise HTTPException(400, "doctor_id mismatch")
-    s = get_session()
-    try:
-        r = repo.create_doctor_review(s, body)
-        if not r:
-            raise HTTPException(400, "duplicate review or invalid ref")
-        return r
-    finally:
-        s.close()
+    r = repo.create_doctor_review(s, body)
+    if not r:
+        raise HTTPException(400, "duplicate review or invalid ref")
+    return r
 
 @app.get("/doctors/{doctor_id}/reviews", response_model=List[DoctorReviewOut])
-def api_list_reviews(doctor_id: int):
-    s = get_session()
-    try:
-        return repo.list_doctor_reviews(s, doctor_id)
-    finally:
-        s.close()
+def api_list_reviews(doctor_id: int, s: Session = Depends(read_session)):
+    return repo.list_doctor_reviews(s, doctor_id)
 
 
 @app.get("/admins/by-user/{user_id}", response_model=AdminOut | None)
-def api_get_admin_by_user(user_id: int):
-    s = get_session()
-    try:
-        return repo.get_admin_by_user_id(s, user_id)
-    finally:
-        s.close()
+def api_get_admin_by_user(user_id: int, s: Session = Depends(read_session)):
+    return repo.get_admin_by_user_id(s, user_id)
         
 # --- PATCH Clients by user_id ---
 @app.patch("/clients/by-user/{user_id}", response_model=ClientOut)
-def api_patch_client_by_user(user_id: int, p: ClientPatch):
-    s = get_session()
-    try:
-        r = repo.patch_client_by_user_id(s, user_id, p)
-        if not r:
-            raise HTTPException(404, "client not found or nothing to update")
-        return r
-    finally:
-        s.close()
+def api_patch_client_by_user(user_id: int, p: ClientPatch, s: Session = Depends(db_session)):
+    r = repo.patch_client_by_user_id(s, user_id, p)
+    if not r:
+        raise HTTPException(404, "client not found or nothing to update")
+    return r
 
 # --- PATCH Doctors by user_id ---
 @app.patch("/doctors/by-user/{user_id}", response_model=DoctorOut)
-def api_patch_doctor_by_user(user_id: int, p: DoctorPatch):
-    s = get_session()
+def api_patch_doctor_by_user(user_id: int, p: DoctorPatch, s: Session = Depends(db_session)):
     try:
         r = repo.patch_doctor_by_user_id(s, user_id, p)
-        if not r:
-            raise HTTPException(404, "doctor not found or nothing to update")
-        return r
-    finally:
-        s.close()
+    except ValueError as ve:
+        raise HTTPException(status_code=400, detail=str(ve))
+    if not r:
+        raise HTTPException(404, "doctor not found or nothing to update")
+    return r
 
 # --- PATCH Admins by user_id ---
 @app.patch("/admins/by-user/{user_id}", response_model=AdminOut)
-def api_patch_admin_by_user(user_id: int, p: AdminPatch):
-    s = get_session()
-    try:
-        r = repo.patch_admin_by_user_id(s, user_id, p)
-        if not r:
-            raise HTTPException(404, "admin not found or nothing to update")
-        return r
-    finally:
-        s.close()
+def api_patch_admin_by_user(user_id: int, p: AdminPatch, s: Session = Depends(db_session)):
+    r = repo.patch_admin_by_user_id(s, user_id, p)
+    if not r:
+        raise HTTPException(404, "admin not found or nothing to update")
+    return r
         
-@app.get("/doctors/search", response_model=List[DoctorSearchOut])
-def api_search_doctors(
+def _parse_near(near: Optional[str]):
+    if near is None:
+        return None
+    try:
+        lat_s, lon_s = near.split(",")
+        lat, lon = float(lat_s), float(lon_s)
+    except ValueError:
+        raise HTTPException(400, "near must be 'lat,lon'")
+    if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+        raise HTTPException(400, "near is out of range")
+    return lat, lon
+
+
+def doctor_search_filters(
+    q: Optional[str] = Query(None, max_length=200),
+    near: Optional[str] = Query(None, description="lat,lon"),
+    radius_km: float = Query(repo.DEFAULT_RADIUS_KM, gt=0, le=500),
     specialization_ids: Optional[List[int]] = Query(None),
     city: Optional[str] = Query(None),
     region: Optional[str] = Query(None),
@@ -816,11 +870,45 @@ def api_search_doctors(
     max_experience: Optional[int] = Query(None),
 
     date_filter: Optional[date] = Query(None, alias="date"),
+) -> dict:
+    """Фильтры поиска врачей — общие для выдачи и фасетов."""
+    return {
+        "q": q,
+        "near": _parse_near(near),
+        "radius_km": radius_km,
+        "specialization_ids": specialization_ids,
+        "city": city,
+        "region": region,
+        "metro": metro,
+        "online_only": online_only,
+        "min_price": min_price,
+        "max_price": max_price,
+        "min_rating": min_rating,
+        "gender": gender,
+        "min_age": min_age,
+        "max_age": max_age,
+        "min_experience": min_experience,
+        "max_experience": max_experience,
+        "date_filter": date_filter,
+    }
+
+
+@app.get("/doctors/search", response_model=List[DoctorSearchOut])
+@query_budget(2)  # с q: проба слов запроса + выдача
+async def api_search_doctors(
+    response: Response,
+    filters: dict = Depends(doctor_search_filters),
     limit: int = Query(50, ge=1, le=200),
     offset: int = Query(0, ge=0),
+    cursor: Optional[str] = Query(None),
+    sort: Optional[Literal["distance"]] = Query(None),
 ):
     """
     Поиск врачей с фильтрами из ТЗ.
+    - q: текст (ФИО, профессия, специализация, описание), терпим к опечаткам;
+      выдача тогда сортируется по релевантности, cursor не поддерживается
+    - near=lat,lon и radius_km: врачи клиник в радиусе, в ответе distance_km
+    - sort=distance: по расстоянию (нужен near, cursor не поддерживается)
     - specialization_ids: список id специализаций
     - city/region/metro: локация клиники
     - online_only: только онлайн-консультации
@@ -830,225 +918,226 @@ def api_search_doctors(
     - min/max_age: возраст врача
     - min/max_experience: стаж
     - date: наличие свободного слота в указанный день
+    - cursor: keyset-пагинация; значение берётся из заголовка X-Next-Cursor
+      предыдущего ответа (offset тогда игнорируется)
+
+    Первая страница (без offset/cursor) отдаётся из кэша выдачи, см. /stats/search-cache.
     """
-    s = get_session()
-    try:
-        return repo.search_doctors(
-            s,
-            specialization_ids=specialization_ids,
-            city=city,
-            region=region,
-            metro=metro,
-            online_only=online_only,
-            min_price=min_price,
-            max_price=max_price,
-            min_rating=min_rating,
-            gender=gender,
-            min_age=min_age,
-            max_age=max_age,
-            min_experience=min_experience,
-            max_experience=max_experience,
-            date_filter=date_filter,
+    def load():
+        return run_db_read(
+            repo.search_doctors,
+            **filters,
             limit=limit,
             offset=offset,
+            cursor=cursor,
+            sort=sort,
         )
-    finally:
-        s.close()
+
+    try:
+        if offset == 0 and cursor is None:
+            rows = await search_cache.aget(filters, limit, sort, load)
+        else:
+            rows = await load()
+    except ValueError as ve:
+        raise HTTPException(400, str(ve))
+    if len(rows) == limit and rows[-1]["search_rank"] is None and sort is None:
+        response.headers["X-Next-Cursor"] = repo.encode_search_cursor(rows[-1])
+    return rows
+
+
+@app.get("/doctors/search/facets", response_model=DoctorSearchFacetsOut)
+@query_budget(2)  # с q: проба слов запроса + выдача
+async def api_search_doctor_facets(filters: dict = Depends(doctor_search_filters)):
+    """
+    Количество врачей по городу, метро, специализации, полу, ценовой корзине
+    и онлайн-приёму для тех же фильтров, что и /doctors/search.
+    """
+    return await run_db_read(repo.search_doctor_facets, **filters)
+
+
+@app.get("/stats/db-pool")
+def api_db_pool_stats():
+    """Занятость пула соединений к БД, число выдач и время ожидания соединения (на процесс)."""
+    return pool_status()
+
+
+@app.get("/stats/search-cache")
+def api_search_cache_stats():
+    """Счётчики кэша выдачи /doctors/search (на процесс)."""
+    return search_cache.stats()
 
 
 @app.get("/clients/{client_id}/medical-records", response_model=List[MedicalRecordOut])
-def api_list_medical_records_for_client(client_id: int):
-    s = get_session()
-    try:
-        return repo.list_medical_records_for_client(s, client_id)
-    finally:
-        s.close()
+def api_list_medical_records_for_client(client_id: int, s: Session = Depends(read_session)):
+    return repo.list_medical_records_for_client(s, client_id)
 
 
 @app.get("/doctors/{doctor_id}/appointments", response_model=List[AppointmentOut])
-def api_list_appointments_for_doctor(doctor_id: int):
-    s = get_session()
-    try:
-        return repo.list_appointments_for_doctor(s, doctor_id)
-    finally:
-        s.close()
+@query_budget(1)
+async def api_list_appointments_for_doctor(doctor_id: int):
+    return json_rows(await run_db_read(repo.list_appointments_for_doctor, doctor_id), AppointmentOut)
 
 
 @app.get("/doctors/{doctor_id}/patients", response_model=List[DoctorPatientOut])
-def api_list_patients_for_doctor(doctor_id: int):
-    s = get_session()
-    try:
-        return repo.list_patients_for_doctor(s, doctor_id)
-    finally:
-        s.close()
+def api_list_patients_for_doctor(doctor_id: int, s: Session = Depends(read_session)):
+    return json_rows(repo.list_patients_for_doctor(s, doctor_id), DoctorPatientOut)
 
 
 # ========== AVATAR ENDPOINTS ==========
 
 @app.post("/users/{user_id}/avatar", status_code=201)
-async def upload_avatar(user_id: int, file: UploadFile = File(...)):
+@query_budget(2)
+async def upload_avatar(user_id: int, file: UploadFile = File(...), s: Session = Depends(db_session)):
     """
     Загрузить аватарку пользователя.
     Поддерживаемые форматы: JPG, JPEG, PNG, WebP, GIF
     Максимальный размер: 5 MB
     """
-    # Проверка существования пользователя
-    s = get_session()
-    try:
-        user = repo.get_user_profile(s, user_id)
-        if not user:
-            raise HTTPException(404, "user not found")
+    # Проверка существования пользователя (и текущая аватарка)
+    user = repo.get_user_avatar(s, user_id)
+    if not user:
+        raise HTTPException(404, "user not found")
         
-        # Проверка расширения файла
-        file_ext = Path(file.filename or "").suffix.lower()
-        if file_ext not in ALLOWED_EXTENSIONS:
-            raise HTTPException(
-                400, 
-                f"Invalid file type. Allowed: {', '.join(ALLOWED_EXTENSIONS)}"
-            )
+    # Проверка расширения файла
+    file_ext = Path(file.filename or "").suffix.lower()
+    if file_ext not in ALLOWED_EXTENSIONS:
+        raise HTTPException(
+            400, 
+            f"Invalid file type. Allowed: {', '.join(ALLOWED_EXTENSIONS)}"
+        )
         
-        # Чтение файла
-        contents = await file.read()
+    # Чтение файла
+    contents = await file.read()
         
-        # Проверка размера
-        if len(contents) > MAX_FILE_SIZE:
-            raise HTTPException(
-                400, 
-                f"File too large. Maximum size: {MAX_FILE_SIZE // 1024 // 1024} MB"
-            )
+    # Проверка размера
+    if len(contents) > MAX_FILE_SIZE:
+        raise HTTPException(
+            400, 
+            f"File too large. Maximum size: {MAX_FILE_SIZE // 1024 // 1024} MB"
+        )
         
-        # Проверка, что это действительно изображение + оптимизация
-        try:
-            image = Image.open(io.BytesIO(contents))
+    # Проверка, что это действительно изображение + оптимизация
+    try:
+        image = Image.open(io.BytesIO(contents))
             
-            # Конвертация в RGB если нужно (для JPEG)
-            if image.mode in ("RGBA", "LA", "P") and file_ext in [".jpg", ".jpeg"]:
-                background = Image.new("RGB", image.size, (255, 255, 255))
-                if image.mode == "P":
-                    image = image.convert("RGBA")
-                background.paste(image, mask=image.split()[-1] if image.mode == "RGBA" else None)
-                image = background
+        # Конвертация в RGB если нужно (для JPEG)
+        if image.mode in ("RGBA", "LA", "P") and file_ext in [".jpg", ".jpeg"]:
+            background = Image.new("RGB", image.size, (255, 255, 255))
+            if image.mode == "P":
+                image = image.convert("RGBA")
+            background.paste(image, mask=image.split()[-1] if image.mode == "RGBA" else None)
+            image = background
             
-            # Изменение размера если слишком большое
-            if image.width > MAX_IMAGE_DIMENSION or image.height > MAX_IMAGE_DIMENSION:
-                image.thumbnail((MAX_IMAGE_DIMENSION, MAX_IMAGE_DIMENSION), Image.Resampling.LANCZOS)
+        # Изменение размера если слишком большое
+        if image.width > MAX_IMAGE_DIMENSION or image.height > MAX_IMAGE_DIMENSION:
+            image.thumbnail((MAX_IMAGE_DIMENSION, MAX_IMAGE_DIMENSION), Image.Resampling.LANCZOS)
             
-            # Сохранение оптимизированного изображения
-            optimized = io.BytesIO()
-            save_format = "JPEG" if file_ext in [".jpg", ".jpeg"] else image.format or "PNG"
-            image.save(optimized, format=save_format, quality=85, optimize=True)
-            contents = optimized.getvalue()
+        # Сохранение оптимизированного изображения
+        optimized = io.BytesIO()
+        save_format = "JPEG" if file_ext in [".jpg", ".jpeg"] else image.format or "PNG"
+        image.save(optimized, format=save_format, quality=85, optimize=True)
+        contents = optimized.getvalue()
             
-        except Exception as e:
-            raise HTTPException(400, f"Invalid image file: {str(e)}")
+    except Exception as e:
+        raise HTTPException(400, f"Invalid image file: {str(e)}")
         
-        # Удаление старой аватарки
-        old_avatar = user.get("avatar")
-        if old_avatar and old_avatar.startswith("avatars/"):
-            old_path = AVATARS_DIR.parent / old_avatar
-            if old_path.exists():
-                old_path.unlink()
+    # Удаление старой аватарки
+    old_avatar = user.get("avatar")
+    if old_avatar and old_avatar.startswith("avatars/"):
+        old_path = AVATARS_DIR.parent / old_avatar
+        if old_path.exists():
+            old_path.unlink()
         
-        # Генерация уникального имени файла
-        filename = f"user_{user_id}_{uuid.uuid4().hex[:8]}{file_ext}"
-        file_path = AVATARS_DIR / filename
+    # Генерация уникального имени файла
+    filename = f"user_{user_id}_{uuid.uuid4().hex[:8]}{file_ext}"
+    file_path = AVATARS_DIR / filename
         
-        # Сохранение файла
-        with open(file_path, "wb") as f:
-            f.write(contents)
+    # Сохранение файла
+    with open(file_path, "wb") as f:
+        f.write(contents)
         
-        # Обновление пути в БД
-        avatar_path = f"avatars/{filename}"
-        patch = m.UserProfilePatch(avatar=avatar_path)
-        repo.update_user_profile(s, user_id, patch)
-        s.commit()
+    # Обновление пути в БД
+    avatar_path = f"avatars/{filename}"
+    patch = m.UserProfilePatch(avatar=avatar_path)
+    repo.update_user_profile(s, user_id, patch)
         
-        return JSONResponse(
-            status_code=201,
-            content={
-                "message": "avatar uploaded successfully",
-                "avatar_url": f"/users/{user_id}/avatar",
-                "filename": filename
-            }
-        )
-    finally:
-        s.close()
+    return JSONResponse(
+        status_code=201,
+        content={
+            "message": "avatar uploaded successfully",
+            "avatar_url": f"/users/{user_id}/avatar",
+            "filename": filename
+        }
+    )
 
 
 @app.get("/users/{user_id}/avatar")
-def get_avatar(user_id: int):
+@query_budget(1)
+def get_avatar(user_id: int, s: Session = Depends(read_session)):
     """
     Получить аватарку пользователя.
     Возвращает файл изображения или 404 если аватарка не установлена.
     """
-    s = get_session()
-    try:
-        user = repo.get_user_profile(s, user_id)
-        if not user:
-            raise HTTPException(404, "user not found")
+    user = repo.get_user_avatar(s, user_id)
+    if not user:
+        raise HTTPException(404, "user not found")
         
-        avatar_path = user.get("avatar")
-        if not avatar_path:
-            raise HTTPException(404, "avatar not set")
+    avatar_path = user.get("avatar")
+    if not avatar_path:
+        raise HTTPException(404, "avatar not set")
         
-        # Поддержка как относительных, так и полных путей
-        if avatar_path.startswith("avatars/"):
-            file_path = AVATARS_DIR.parent / avatar_path
-        else:
-            file_path = Path(avatar_path)
+    # Поддержка как относительных, так и полных путей
+    if avatar_path.startswith("avatars/"):
+        file_path = AVATARS_DIR.parent / avatar_path
+    else:
+        file_path = Path(avatar_path)
         
-        if not file_path.exists():
-            raise HTTPException(404, "avatar file not found")
+    if not file_path.exists():
+        raise HTTPException(404, "avatar file not found")
         
-        # Определение MIME-типа по расширению
-        ext = file_path.suffix.lower()
-        media_types = {
-            ".jpg": "image/jpeg",
-            ".jpeg": "image/jpeg",
-            ".png": "image/png",
-            ".webp": "image/webp",
-            ".gif": "image/gif"
-        }
-        media_type = media_types.get(ext, "image/jpeg")
+    # Определение MIME-типа по расширению
+    ext = file_path.suffix.lower()
+    media_types = {
+        ".jpg": "image/jpeg",
+        ".jpeg": "image/jpeg",
+        ".png": "image/png",
+        ".webp": "image/webp",
+        ".gif": "image/gif"
+    }
+    media_type = media_types.get(ext, "image/jpeg")
         
-        return FileResponse(
-            file_path,
-            media_type=media_type,
-            filename=file_path.name
-        )
-    finally:
-        s.close()
+    return FileResponse(
+        file_path,
+        media_type=media_type,
+        filename=file_path.name
+    )
 
 
 @app.delete("/users/{user_id}/avatar", status_code=204)
-def delete_avatar(user_id: int):
+@query_budget(2)
+def delete_avatar(user_id: int, s: Session = Depends(db_session)):
     """
     Удалить аватарку пользователя.
     """
-    s = get_session()
-    try:
-        user = repo.get_user_profile(s, user_id)
-        if not user:
-            raise HTTPException(404, "user not found")
+    user = repo.get_user_avatar(s, user_id)
+    if not user:
+        raise HTTPException(404, "user not found")
         
-        avatar_path = user.get("avatar")
-        if not avatar_path:
-            return  # Уже нет аватарки
+    avatar_path = user.get("avatar")
+    if not avatar_path:
+        return  # Уже нет аватарки
         
-        # Удаление файла
-        if avatar_path.startswith("avatars/"):
-            file_path = AVATARS_DIR.parent / avatar_path
-            if file_path.exists():
-                file_path.unlink()
+    # Удаление файла
+    if avatar_path.startswith("avatars/"):
+        file_path = AVATARS_DIR.parent / avatar_path
+        if file_path.exists():
+            file_path.unlink()
         
-        # Очистка поля в БД
-        patch = m.UserProfilePatch(avatar=None)
-        repo.update_user_profile(s, user_id, patch)
-        s.commit()
+    # Очистка поля в БД
+    patch = m.UserProfilePatch(avatar=None)
+    repo.update_user_profile(s, user_id, patch)
         
-        return
-    finally:
-        s.close()
+    return
 
 
 # ============================================================================
@@ -1056,7 +1145,7 @@ def delete_avatar(user_id: int):
 # ============================================================================
 
 @app.post("/chat/message", response_model=ChatResponse)
-def send_chat_message(req: ChatRequest):
+def send_chat_message(req: ChatRequest, s: Session = Depends(db_session)):
     """
     Send message to medical assistant chatbot
     
@@ -1077,41 +1166,32 @@ def send_chat_message(req: ChatRequest):
             "session_id": null
         }
     """
-    s = get_session()
-    try:
-        # Verify user exists
-        user = repo.get_user_profile(s, req.user_id)
-        if not user:
-            raise HTTPException(404, "user not found")
-        print("okkkkk")
-        # Get or create chat session
-        session = repo.get_or_create_chat_session(s, req.user_id, req.session_id)
-        print("ok")
-        # Get conversation history
-        history = session.get("messages", [])
-        print("okeoke")
-        # Send message to OpenRouter with context
-        ai_response = chat.send_message_with_context(req.message, history)
-        print("okeokffffffffffffffe")
-
-        # Update history with new messages
-        history.append(chat.format_message_for_db("user", req.message))
-        history.append(chat.format_message_for_db("model", ai_response))
+    # Verify user exists
+    if not repo.user_exists(s, req.user_id):
+        raise HTTPException(404, "user not found")
+    # Get or create chat session
+    session = repo.get_or_create_chat_session(s, req.user_id, req.session_id)
+    # Get conversation history
+    history = session.get("messages", [])
+    # Send message to OpenRouter with context
+    ai_response = chat.send_message_with_context(req.message, history)
+
+    # Update history with new messages
+    history.append(chat.format_message_for_db("user", req.message))
+    history.append(chat.format_message_for_db("model", ai_response))
         
-        # Save updated history to DB
-        repo.update_chat_session_messages(s, session["session_id"], history)
-        print("okeokffffffffffffffffjoidfjvoidfjvsiogdoirse")
+    # Save updated history to DB
+    repo.update_chat_session_messages(s, session["session_id"], history)
 
-        return ChatResponse(
-            response=ai_response,
-            session_id=str(session["session_id"])
-        )
-    finally:
-        s.close()
+    return ChatResponse(
+        response=ai_response,
+        session_id=str(session["session_id"])
+    )
 
 
 @app.get("/chat/history/{user_id}", response_model=List[ChatSessionOut])
-def get_user_chat_history(user_id: int, limit: int = Query(10, ge=1, le=100)):
+@query_budget(2)
+def get_user_chat_history(user_id: int, limit: int = Query(10, ge=1, le=100), s: Session = Depends(read_session)):
     """
     Get chat conversation history for user
     
@@ -1122,28 +1202,19 @@ def get_user_chat_history(user_id: int, limit: int = Query(10, ge=1, le=100)):
     Returns:
         List of chat sessions with full message history
     """
-    s = get_session()
-    try:
-        user = repo.get_user_profile(s, user_id)
-        if not user:
-            raise HTTPException(404, "user not found")
+    if not repo.user_exists(s, user_id):
+        raise HTTPException(404, "user not found")
         
-        sessions = repo.get_chat_history(s, user_id, limit)
-        return sessions
-    finally:
-        s.close()
+    sessions = repo.get_chat_history(s, user_id, limit)
+    return sessions
 
 
 @app.delete("/chat/session/{session_id}", status_code=204)
-def delete_chat_session(session_id: str):
+def delete_chat_session(session_id: str, s: Session = Depends(db_session)):
     """
     Delete a chat session
     
     Args:
         session_id: UUID of session to delete
     """
-    s = get_session()
-    try:
-        repo.delete_chat_session(s, session_id)
-    finally:
-        s.close()
+    repo.delete_chat_session(s, session_id)
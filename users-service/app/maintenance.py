@@ -0,0 +1,110 @@
+"""
+Служебные команды обслуживания БД (запускать из корня users-service):
+
+    python -m app.maintenance rating-backfill   # пересчитать doctor_rating_stats
+    python -m app.maintenance rating-check      # сверить агрегат рейтинга с отзывами
+    python -m app.maintenance search-index-rebuild  # пересобрать doctor_search_index
+    python -m app.maintenance free-slots-rebuild    # пересчитать doctor_free_slot_days
+    python -m app.maintenance free-slots-check      # сверить doctor_free_slot_days со слотами
+"""
+import argparse
+import sys
+
+from .db import get_session
+from . import repository as repo
+
+
+def rating_backfill(args) -> int:
+    s = get_session()
+    try:
+        n = repo.rebuild_doctor_rating_stats(s)
+        print(f"✅ doctor_rating_stats пересчитан для {n} врачей")
+        return 0
+    finally:
+        s.close()
+
+
+def rating_check(args) -> int:
+    s = get_session()
+    try:
+        drift = repo.check_doctor_rating_stats(s)
+        if not drift:
+            print("✅ doctor_rating_stats консистентен")
+            return 0
+        print(f"❌ Расхождения у {len(drift)} врачей:")
+        for r in drift[: args.show]:
+            print(f"   doctor_id={r['doctor_id']}: "
+                  f"appointment {r['stored_appointment_reviews_sum']}/{r['stored_appointment_reviews_count']}"
+                  f" -> {r['appointment_reviews_sum']}/{r['appointment_reviews_count']}, "
+                  f"doctor {r['stored_doctor_reviews_sum']}/{r['stored_doctor_reviews_count']}"
+                  f" -> {r['doctor_reviews_sum']}/{r['doctor_reviews_count']}")
+        print("   Исправить: python -m app.maintenance rating-backfill")
+        return 1
+    finally:
+        s.close()
+
+
+def search_index_rebuild(args) -> int:
+    s = get_session()
+    try:
+        n = repo.rebuild_doctor_search_index(s)
+        print(f"✅ doctor_search_index пересобран: {n} врачей")
+        return 0
+    finally:
+        s.close()
+
+
+def free_slots_rebuild(args) -> int:
+    s = get_session()
+    try:
+        n = repo.rebuild_doctor_free_slot_days(s)
+        print(f"✅ doctor_free_slot_days пересчитан: {n} дней со свободными слотами")
+        return 0
+    finally:
+        s.close()
+
+
+def free_slots_check(args) -> int:
+    s = get_session()
+    try:
+        drift = repo.check_doctor_free_slot_days(s)
+        if not drift:
+            print("✅ doctor_free_slot_days консистентен")
+            return 0
+        print(f"❌ Расхождения в {len(drift)} днях:")
+        for r in drift[: args.show]:
+            print(f"   doctor_id={r['doctor_id']} {r['day']}: "
+                  f"{r['stored_free_count']} -> {r['free_count']}")
+        print("   Исправить: python -m app.maintenance free-slots-rebuild")
+        return 1
+    finally:
+        s.close()
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m app.maintenance")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    sub.add_parser("rating-backfill", help="пересчитать doctor_rating_stats по отзывам") \
+        .set_defaults(func=rating_backfill)
+
+    p = sub.add_parser("rating-check", help="сверить doctor_rating_stats с отзывами")
+    p.add_argument("--show", type=int, default=20, help="сколько расхождений вывести")
+    p.set_defaults(func=rating_check)
+
+    sub.add_parser("search-index-rebuild", help="пересобрать doctor_search_index") \
+        .set_defaults(func=search_index_rebuild)
+
+    sub.add_parser("free-slots-rebuild", help="пересчитать doctor_free_slot_days по слотам") \
+        .set_defaults(func=free_slots_rebuild)
+
+    p = sub.add_parser("free-slots-check", help="сверить doctor_free_slot_days со слотами")
+    p.add_argument("--show", type=int, default=20, help="сколько расхождений вывести")
+    p.set_defaults(func=free_slots_check)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
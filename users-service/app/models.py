@@ -1,7 +1,7 @@
 from typing import List, Optional
 from pydantic import BaseModel, EmailStr, Field
 from typing import Literal
-from datetime import datetime, date
+from datetime import datetime, date, time
 
 Gender = Literal["MALE", "FEMALE"]
 
@@ -194,6 +194,7 @@ class DoctorOut(DoctorIn):
     id: int
     created_at: datetime
     updated_at: datetime
+    specialization_names: List[str] = []
 
 class AdminIn(BaseModel):
     user_id: int
@@ -205,6 +206,33 @@ class AdminOut(AdminIn):
     created_at: datetime
     updated_at: datetime
 
+# --- Batch lookups (POST /users/batch, /doctors/batch, /clients/batch) ---
+BATCH_MAX_IDS = 200
+
+class UserBatchIn(BaseModel):
+    ids: List[int] = Field(min_length=1, max_length=BATCH_MAX_IDS)
+    by: Literal["id", "client_id"] = "id"
+
+class UserBatchOut(BaseModel):
+    items: List[UserOut]       # в порядке ids, без повторов и без missing
+    missing: List[int] = []
+
+class DoctorBatchIn(BaseModel):
+    ids: List[int] = Field(min_length=1, max_length=BATCH_MAX_IDS)
+    by: Literal["id", "user_id"] = "id"
+
+class DoctorBatchOut(BaseModel):
+    items: List[DoctorOut]
+    missing: List[int] = []
+
+class ClientBatchIn(BaseModel):
+    ids: List[int] = Field(min_length=1, max_length=BATCH_MAX_IDS)
+    by: Literal["id", "user_id"] = "id"
+
+class ClientBatchOut(BaseModel):
+    items: List[ClientOut]
+    missing: List[int] = []
+
 # --- Appointment slots / appointments ---
 AppointmentStatus = Literal['BOOKED','CANCELED','COMPLETED','NO_SHOW']
 
@@ -223,6 +251,88 @@ class SlotOut(BaseModel):
     created_at: datetime
     updated_at: datetime
 
+# --- Availability calendar (несколько врачей за окно дат) ---
+AVAILABILITY_MAX_DAYS = 92
+
+class DoctorAvailabilityIn(BaseModel):
+    ids: List[int] = Field(min_length=1, max_length=BATCH_MAX_IDS)  # doctors.id
+    date_from: date
+    date_to: date  # включительно
+
+class AvailabilityDayOut(BaseModel):
+    day: date
+    free_count: int
+
+class DoctorAvailabilityOut(BaseModel):
+    doctor_id: int
+    days: List[AvailabilityDayOut]  # только дни со свободными слотами
+
+class DoctorAvailabilityBatchOut(BaseModel):
+    items: List[DoctorAvailabilityOut]  # в порядке ids, без повторов
+    missing: List[int] = []
+
+# --- Ближайшие свободные слоты (по одному на врача) ---
+EARLIEST_SLOTS_MAX = 50
+
+class EarliestSlotOut(BaseModel):
+    slot_id: int
+    doctor_id: int
+    start_time: datetime
+    end_time: datetime
+    duration: int
+    # карточка врача из doctor_search_index
+    name: Optional[str] = None
+    surname: Optional[str] = None
+    patronymic: Optional[str] = None
+    profession: str
+    clinic_id: Optional[int] = None
+    city: Optional[str] = None
+    price: Optional[float] = None
+    rating: Optional[float] = None
+
+# --- Doctor schedule templates ---
+SCHEDULE_MAX_DAYS = 366
+
+class ScheduleTemplateIn(BaseModel):
+    weekday: int = Field(ge=1, le=7)  # ISO: 1 = пн … 7 = вс
+    start_time: time
+    end_time: time
+    slot_minutes: int = Field(default=30, ge=5, le=480)
+    break_start: Optional[time] = None
+    break_end: Optional[time] = None
+
+class ScheduleTemplateOut(ScheduleTemplateIn):
+    id: int
+    doctor_id: int
+    created_at: datetime
+    updated_at: datetime
+
+class ScheduleExceptionIn(BaseModel):
+    # без start_time/end_time — выходной; с ними — часы вместо шаблонов этого дня
+    start_time: Optional[time] = None
+    end_time: Optional[time] = None
+    slot_minutes: Optional[int] = Field(default=None, ge=5, le=480)
+    reason: Optional[str] = None
+
+class ScheduleExceptionOut(ScheduleExceptionIn):
+    id: int
+    doctor_id: int
+    day: date
+    created_at: datetime
+    updated_at: datetime
+
+class ScheduleOut(BaseModel):
+    templates: List[ScheduleTemplateOut]
+    exceptions: List[ScheduleExceptionOut]
+
+class ScheduleGenerateIn(BaseModel):
+    date_from: date
+    date_to: date
+
+class ScheduleGenerateOut(BaseModel):
+    created: int
+    skipped: int  # пересеклись с уже существующими слотами
+
 class AppointmentIn(BaseModel):
     slot_id: int
     client_id: int
@@ -377,6 +487,45 @@ class DoctorSearchOut(BaseModel):
     # список названий специализаций врача
     specialization_names: List[str] = []
 
+    name: Optional[str] = None
+    surname: Optional[str] = None
+    patronymic: Optional[str] = None
+    # релевантность текстовому запросу q (только при поиске с q)
+    search_rank: Optional[float] = None
+
+    # координаты клиники и расстояние до точки near (только при поиске с near)
+    latitude: Optional[float] = None
+    longitude: Optional[float] = None
+    distance_km: Optional[float] = None
+
+class FacetValueCount(BaseModel):
+    value: str
+    count: int
+
+class OnlineFacetCount(BaseModel):
+    value: bool
+    count: int
+
+class SpecializationFacetCount(BaseModel):
+    id: int
+    name: str
+    count: int
+
+class PriceBucketCount(BaseModel):
+    # границы корзины [min_price, max_price); None — без ограничения
+    min_price: Optional[float] = None
+    max_price: Optional[float] = None
+    count: int
+
+class DoctorSearchFacetsOut(BaseModel):
+    total: int
+    cities: List[FacetValueCount] = []
+    metros: List[FacetValueCount] = []
+    specializations: List[SpecializationFacetCount] = []
+    genders: List[FacetValueCount] = []
+    price_buckets: List[PriceBucketCount] = []
+    online_available: List[OnlineFacetCount] = []
+
 class DoctorPatientOut(BaseModel):
     client_id: int
     user_id: int
@@ -1,10 +1,14 @@
-from typing import Optional, List, Dict
+from typing import Optional, List, Dict, Tuple, Iterator
+from functools import lru_cache
 from sqlalchemy import text
 from sqlalchemy.orm import Session
 from passlib.hash import bcrypt
-from .models import UserIn, RegistrationIn
+from .models import UserIn, RegistrationIn, SCHEDULE_MAX_DAYS, AVAILABILITY_MAX_DAYS
+from .cache import search_cache
+from .statements import statement, execute
 from datetime import datetime, timedelta, date
-import secrets, hashlib
+from decimal import Decimal, InvalidOperation
+import secrets, hashlib, base64, json, re, math
 
 
 EMAIL_TOKEN_TTL_MIN = 30
@@ -18,41 +22,29 @@ name,surname,date_of_birth,avatar,gender,
 is_active,email_verified_at,password_changed_at,created_at,updated_at
 """
 
-_DOCTOR_RATING_EXPR_TMPL = """
-    coalesce((
-        select avg(rating)::float
-        from (
-            select rating from appointment_reviews where doctor_id = {doctor_ref}
-            union all
-            select rating from doctor_reviews where doctor_id = {doctor_ref}
-        ) r
-    ), 0)
-"""
 
 def _rowmap(r) -> Dict:
     return dict(r) if r else None
 
+# Горячие запросы — в реестре app/statements.py (PREPARE один раз на соединение)
+_USER_BY_EMAIL = statement("users_by_email", f"select {_USER_COLS} from users where email = :e")
+_USER_BY_LOGIN = statement("users_by_login", f"select {_USER_COLS} from users where login = :l")
+_USER_EXISTS_BY_EMAIL = statement("users_exists_by_email", "select 1 from users where email = :e limit 1")
+_USER_EXISTS_BY_LOGIN = statement("users_exists_by_login", "select 1 from users where login = :l limit 1")
+
 def find_by_email(s: Session, email: str) -> Optional[Dict]:
-    r = s.execute(text(f"""
-        select {_USER_COLS}
-        from users where email=:e
-    """), {"e": email}).mappings().first()
+    r = execute(s, _USER_BY_EMAIL, {"e": email}).mappings().first()
     return _rowmap(r)
 
 def find_by_login(s: Session, login: str) -> Optional[Dict]:
-    r = s.execute(text(f"""
-        select {_USER_COLS}
-        from users where login=:l
-    """), {"l": login}).mappings().first()
+    r = execute(s, _USER_BY_LOGIN, {"l": login}).mappings().first()
     return _rowmap(r)
 
 def exists_by_email(s: Session, email: str) -> bool:
-    return bool(s.execute(text("select 1 from users where email=:e limit 1"),
-                          {"e": email}).first())
+    return bool(execute(s, _USER_EXISTS_BY_EMAIL, {"e": email}).first())
 
 def exists_by_login(s: Session, login: str) -> bool:
-    return bool(s.execute(text("select 1 from users where login=:l limit 1"),
-                          {"l": login}).first())
+    return bool(execute(s, _USER_EXISTS_BY_LOGIN, {"l": login}).first())
 
 def insert_user(s: Session, user) -> Dict:
     if user.role not in ("CLIENT", "DOCTOR", "ADMIN"):
@@ -88,20 +80,63 @@ def register_user(s: Session, reg: RegistrationIn) -> Dict:
     s.commit()
     return dict(r)
 
-def list_users(s: Session, role: Optional[str]=None) -> List[Dict]:
+USERS_PAGE_MAX = 1000
+USERS_STREAM_BATCH = 1000
+
+
+def _users_query(role: Optional[str], after_id: Optional[int], limit: Optional[int]):
+    where, params = [], {}
     if role:
-        rows = s.execute(text(f"""
-            select {_USER_COLS}
-            from users where role=:r order by id
-        """), {"r": role}).mappings().all()
-    else:
-        rows = s.execute(text(f"""
-            select {_USER_COLS}
-            from users order by id
-        """)).mappings().all()
+        where.append("role = :r"); params["r"] = role
+    if after_id is not None:
+        where.append("id > :after"); params["after"] = after_id
+    sql = f"select {_USER_COLS} from users"
+    if where:
+        sql += " where " + " and ".join(where)
+    sql += " order by id"
+    if limit is not None:
+        sql += " limit :lim"; params["lim"] = limit
+    return text(sql), params
+
+
+def list_users(s: Session, role: Optional[str]=None,
+               after_id: Optional[int]=None, limit: Optional[int]=None) -> List[Dict]:
+    """Пользователи по id; after_id + limit — keyset-страница (следующая начинается после последнего id)."""
+    stmt, params = _users_query(role, after_id, limit)
+    rows = s.execute(stmt, params).mappings().all()
     return [dict(r) for r in rows]
 
 
+def iter_users(s: Session, role: Optional[str]=None, after_id: Optional[int]=None,
+               limit: Optional[int]=None, batch_size: int = USERS_STREAM_BATCH) -> Iterator[Dict]:
+    """
+    Те же строки, что list_users, но через серверный курсор (stream_results/yield_per):
+    в памяти не больше batch_size строк, сколько бы пользователей ни было.
+    """
+    stmt, params = _users_query(role, after_id, limit)
+    result = s.execute(stmt, params, execution_options={"yield_per": batch_size})
+    for r in result.mappings():
+        yield dict(r)
+
+
+@lru_cache(maxsize=64)
+def _update_user_sql(sets: Tuple[str, ...]):
+    """
+    update users ... returning: один text() на каждый набор изменяемых полей.
+    doctor_id (null, если пользователь не врач) — для сброса кэша поиска.
+    """
+    return text(f"""
+        update users
+        set {', '.join(sets)}
+        where id = :id
+        returning {_USER_COLS},
+                  (select d.id from doctors d where d.user_id = users.id) as doctor_id
+    """)
+
+# поля users, из которых собирается doctor_search_index (ФИО, пол, возраст, клиника)
+_DOCTOR_SEARCH_USER_FIELDS = {"name", "surname", "patronymic", "gender", "date_of_birth", "clinic_id"}
+
+
 def update_user_profile(s: Session, user_id: int, p) -> Optional[Dict]:
     sets = []
     params = {"id": user_id}
@@ -131,18 +166,13 @@ def update_user_profile(s: Session, user_id: int, p) -> Optional[Dict]:
 
     sets.append("updated_at = now()")
 
-    # роль для зеркалирования clinic_id
-    role_row = s.execute(text("select role from users where id = :id"), {"id": user_id}).first()
-    role = role_row[0] if role_row else None
-
-    r = s.execute(text(f"""
-        update users
-        set {', '.join(sets)}
-        where id = :id
-        returning {_USER_COLS}
-    """), params).mappings().first()
+    r = s.execute(_update_user_sql(tuple(sets)), params).mappings().first()
+    r = dict(r) if r else None
+    doctor_id = r.pop("doctor_id") if r else None
 
     # --- синк clinic_id в doctors/admins (если прислали clinic_id) ---
+    # роль берём из returning, отдельный select не нужен
+    role = r["role"] if r else None
     if p.clinic_id is not None:
         if role == "DOCTOR":
             s.execute(text("""
@@ -158,25 +188,73 @@ def update_user_profile(s: Session, user_id: int, p) -> Optional[Dict]:
             """), {"cid": p.clinic_id, "uid": user_id})
 
     s.commit()
-    return dict(r) if r else None
+    if doctor_id is not None and incoming.keys() & _DOCTOR_SEARCH_USER_FIELDS:
+        _invalidate_search_cache(s, doctor_id)
+    return r
 
 # --- User profile by id ---
+_USER_PROFILE = statement("users_profile", f"""
+    select {_USER_COLS}
+    from users
+    where id = :id
+    limit 1
+""")
+
 def get_user_profile(s: Session, user_id: int) -> Optional[Dict]:
-    r = s.execute(text(f"""
-        select {_USER_COLS}
-        from users
-        where id = :id
-        limit 1
-    """), {"id": user_id}).mappings().first()
+    r = execute(s, _USER_PROFILE, {"id": user_id}).mappings().first()
     return dict(r) if r else None
 
+_USER_EXISTS = statement("users_exists", "select 1 from users where id = :id")
+_USER_AVATAR = statement("users_avatar", "select avatar from users where id = :id")
+
+def user_exists(s: Session, user_id: int) -> bool:
+    return bool(execute(s, _USER_EXISTS, {"id": user_id}).first())
+
+def get_user_avatar(s: Session, user_id: int) -> Optional[Dict]:
+    """{"avatar": ...} или None, если пользователя нет (без остальных колонок профиля)."""
+    r = execute(s, _USER_AVATAR, {"id": user_id}).mappings().first()
+    return _rowmap(r)
+
+# --- Batch lookups: один запрос `= any(:ids)` вместо запроса на каждый id ---
+def _unique_ids(ids: List[int]) -> List[int]:
+    return list(dict.fromkeys(ids))
+
+def _batch_result(rows, ids: List[int], key: str) -> Tuple[List[Dict], List[int]]:
+    """(items в порядке ids, без повторов; ids, для которых строки нет)."""
+    by_key = {r[key]: dict(r) for r in rows}
+    items, missing = [], []
+    for i in _unique_ids(ids):
+        if i in by_key:
+            items.append(by_key[i])
+        else:
+            missing.append(i)
+    return items, missing
+
+_USERS_BATCH = {
+    "id": statement("users_batch_by_id", f"select {_USER_COLS} from users where id = any(:ids)",
+                    {"ids": "bigint[]"}),
+    # client_id — из подзапроса по clients, в users такой колонки нет
+    "client_id": statement("users_batch_by_client_id", f"""
+        select c.client_id, {_USER_COLS}
+        from (select id as client_id, user_id from clients where id = any(:ids)) c
+        join users on users.id = c.user_id
+    """, {"ids": "bigint[]"}),
+}
+
+def get_users_batch(s: Session, ids: List[int], by: str = "id") -> Tuple[List[Dict], List[int]]:
+    """Пользователи по списку users.id или clients.id."""
+    rows = execute(s, _USERS_BATCH[by], {"ids": _unique_ids(ids)}).mappings().all()
+    return _batch_result(rows, ids, by)
+
+_USER_AUTH = statement("users_auth", """
+    select id, role, password_hash, is_active, email_verified_at
+    from users
+    where login = :v or email = :v
+    limit 1
+""")
+
 def find_auth_by_login_or_email(s: Session, v: str):
-    r = s.execute(text("""
-        select id, role, password_hash, is_active, email_verified_at
-        from users
-        where login = :v or email = :v
-        limit 1
-    """), {"v": v}).mappings().first()
+    r = execute(s, _USER_AUTH, {"v": v}).mappings().first()
     return dict(r) if r else None
 
 def _gen_token_and_hash() -> tuple[str, str]:
@@ -385,14 +463,27 @@ def create_client(s: Session, body) -> Dict:
     s.commit()
     return dict(r)
 
+_CLIENT_BY_USER = statement("clients_by_user", "select * from clients where user_id = :u")
+_CLIENT_BY_ID = statement("clients_by_id", "select * from clients where id = :cid")
+
 def get_client_by_user_id(s: Session, user_id: int) -> Optional[Dict]:
-    r = s.execute(text("select * from clients where user_id=:u"), {"u": user_id}).mappings().first()
+    r = execute(s, _CLIENT_BY_USER, {"u": user_id}).mappings().first()
     return dict(r) if r else None
 
 def get_client(s: Session, client_id: int) -> Optional[Dict]:
-    r = s.execute(text("select * from clients where id=:cid"), {"cid": client_id}).mappings().first()
+    r = execute(s, _CLIENT_BY_ID, {"cid": client_id}).mappings().first()
     return dict(r) if r else None
 
+_CLIENTS_BATCH = {
+    by: statement(f"clients_batch_by_{by}", f"select * from clients where {by} = any(:ids)", {"ids": "bigint[]"})
+    for by in ("id", "user_id")
+}
+
+def get_clients_batch(s: Session, ids: List[int], by: str = "id") -> Tuple[List[Dict], List[int]]:
+    """Клиенты по списку clients.id или user_id."""
+    rows = execute(s, _CLIENTS_BATCH[by], {"ids": _unique_ids(ids)}).mappings().all()
+    return _batch_result(rows, ids, by)
+
 def get_user_by_client_id(s: Session, client_id: int) -> Optional[Dict]:
     query = text("""
         SELECT u.*
@@ -421,49 +512,56 @@ def set_doctor_specializations(s: Session, doctor_id: int, specialization_ids: L
             [{"did": doctor_id, "sid": sid} for sid in specialization_ids],
         )
         
-def _get_doctor_with_specs_by_id(s: Session, doctor_id: int) -> Optional[Dict]:
-    rating_expr = _DOCTOR_RATING_EXPR_TMPL.format(doctor_ref="d.id")
-    r = s.execute(text(f"""
+# Врач + рейтинг + специализации одним запросом: ids и названия собираются
+# одним LATERAL-агрегатом по связке doctor_specializations/specializations.
+_DOCTOR_WITH_SPECS_SQL_TMPL = """
+    select
+        d.*,
+        coalesce(rs.rating, 0) as rating,
+        sp.specialization_ids,
+        sp.specialization_names
+    from doctors d
+    left join doctor_rating_stats rs on rs.doctor_id = d.id
+    cross join lateral (
         select
-            d.*,
-            {rating_expr} as rating,
-            coalesce(
-                array(
-                    select ds.specialization_id
-                    from doctor_specializations ds
-                    where ds.doctor_id = d.id
-                    order by ds.specialization_id
-                ),
-                array[]::int[]
-            ) as specialization_ids
-        from doctors d
-        where d.id = :id
-        limit 1
-    """), {"id": doctor_id}).mappings().first()
+            coalesce(array_agg(ds.specialization_id order by ds.specialization_id), array[]::int[])
+                as specialization_ids,
+            coalesce(array_agg(spec.name order by spec.name), array[]::varchar[])
+                as specialization_names
+        from doctor_specializations ds
+        join specializations spec on spec.id = ds.specialization_id
+        where ds.doctor_id = d.id
+    ) sp
+    where {where}
+"""
+
+
+_DOCTOR_WITH_SPECS_BY_ID = statement(
+    "doctors_with_specs_by_id", _DOCTOR_WITH_SPECS_SQL_TMPL.format(where="d.id = :id"))
+_DOCTOR_WITH_SPECS_BY_USER = statement(
+    "doctors_with_specs_by_user", _DOCTOR_WITH_SPECS_SQL_TMPL.format(where="d.user_id = :uid"))
+_DOCTORS_WITH_SPECS_BATCH = {
+    by: statement(f"doctors_with_specs_batch_by_{by}",
+                  _DOCTOR_WITH_SPECS_SQL_TMPL.format(where=f"d.{by} = any(:ids)"), {"ids": "bigint[]"})
+    for by in ("id", "user_id")
+}
+
+
+def _get_doctor_with_specs_by_id(s: Session, doctor_id: int) -> Optional[Dict]:
+    r = execute(s, _DOCTOR_WITH_SPECS_BY_ID, {"id": doctor_id}).mappings().first()
     return dict(r) if r else None
 
 
 def _get_doctor_with_specs_by_user_id(s: Session, user_id: int) -> Optional[Dict]:
-    rating_expr = _DOCTOR_RATING_EXPR_TMPL.format(doctor_ref="d.id")
-    r = s.execute(text(f"""
-        select
-            d.*,
-            {rating_expr} as rating,
-            coalesce(
-                array(
-                    select ds.specialization_id
-                    from doctor_specializations ds
-                    where ds.doctor_id = d.id
-                    order by ds.specialization_id
-                ),
-                array[]::int[]
-            ) as specialization_ids
-        from doctors d
-        where d.user_id = :uid
-        limit 1
-    """), {"uid": user_id}).mappings().first()
+    r = execute(s, _DOCTOR_WITH_SPECS_BY_USER, {"uid": user_id}).mappings().first()
     return dict(r) if r else None
-        
+
+
+def get_doctors_batch(s: Session, ids: List[int], by: str = "id") -> Tuple[List[Dict], List[int]]:
+    """Врачи (с рейтингом и специализациями) по списку doctors.id или user_id."""
+    rows = execute(s, _DOCTORS_WITH_SPECS_BATCH[by], {"ids": _unique_ids(ids)}).mappings().all()
+    return _batch_result(rows, ids, by)
+
 def list_specializations(s: Session, popular_only: Optional[bool] = None) -> List[Dict]:
     if popular_only:
         rows = s.execute(text("""
@@ -513,6 +611,7 @@ def create_doctor(s: Session, body) -> Dict:
     doctor = _get_doctor_with_specs_by_id(s, doctor_id)
 
     s.commit()
+    _invalidate_search_cache(s, doctor_id)
     return doctor
 
 def get_doctor_by_user_id(s: Session, user_id: int) -> Optional[Dict]:
@@ -550,134 +649,363 @@ def create_slot(s: Session, body) -> Dict:
         returning *
     """), {"did": body.doctor_id, "st": body.start_time, "et": body.end_time}).mappings().first()
     s.commit()
+    _invalidate_search_cache(s, r["doctor_id"], day=r["start_time"].date())
     return dict(r)
 
+_SLOTS_BY_DOCTOR = statement("slots_by_doctor", """
+    select *
+    from appointment_slots
+    where doctor_id = :d
+    order by start_time
+""")
+_SLOTS_BY_DOCTOR_DAY = statement("slots_by_doctor_day", """
+    select *
+    from appointment_slots
+    where doctor_id = :d
+      and start_time >= :day_start
+      and start_time < :day_end
+    order by start_time
+""")
+
 def list_slots_for_doctor(
     s: Session,
     doctor_id: int,
     slot_date: Optional[date] = None,
 ) -> List[Dict]:
     """
-    Все слоты врача, опционально отфильтрованные по дате (DATE(start_time)).
+    Все слоты врача, опционально отфильтрованные по дате.
+    Дата — полуинтервал [day, day + 1), чтобы работал индекс по start_time.
     """
     if slot_date is None:
-        rows = s.execute(
-            text("""
-                select *
-                from appointment_slots
-                where doctor_id = :d
-                order by start_time
-            """),
-            {"d": doctor_id},
-        ).mappings().all()
+        rows = execute(s, _SLOTS_BY_DOCTOR, {"d": doctor_id}).mappings().all()
     else:
-        rows = s.execute(
-            text("""
-                select *
-                from appointment_slots
-                where doctor_id = :d
-                  and date(start_time) = :dt
-                order by start_time
-            """),
-            {"d": doctor_id, "dt": slot_date},
+        rows = execute(
+            s, _SLOTS_BY_DOCTOR_DAY,
+            {"d": doctor_id, "day_start": slot_date, "day_end": slot_date + timedelta(days=1)},
         ).mappings().all()
 
     return [dict(r) for r in rows]
 
-# ===== Appointments =====
-def book_appointment(s: Session, body) -> Optional[Dict]:
-    # простая защита: слот свободен?
-    slot = s.execute(
-        text("select is_booked from appointment_slots where id=:id"),
-        {"id": body.slot_id},
-    ).first()
-    if not slot or slot[0]:
-        # нет такого слота или уже занят
-        return None
+# ===== Doctor schedule templates =====
+def get_doctor_schedule(s: Session, doctor_id: int) -> Dict:
+    """Недельные шаблоны врача и исключения с сегодняшнего дня."""
+    templates = s.execute(text("""
+        select * from doctor_schedule_templates
+        where doctor_id = :d
+        order by weekday, start_time
+    """), {"d": doctor_id}).mappings().all()
+    exceptions = s.execute(text("""
+        select * from doctor_schedule_exceptions
+        where doctor_id = :d and day >= current_date
+        order by day
+    """), {"d": doctor_id}).mappings().all()
+    return {"templates": [dict(r) for r in templates], "exceptions": [dict(r) for r in exceptions]}
+
+
+def replace_schedule_templates(s: Session, doctor_id: int, templates) -> List[Dict]:
+    """
+    Заменить недельные шаблоны врача целиком (один insert ... select from unnest).
+    Интервалы одного дня недели не должны пересекаться — иначе ValueError.
+    """
+    by_day: Dict[int, List] = {}
+    for t in templates:
+        by_day.setdefault(t.weekday, []).append(t)
+    for weekday, items in by_day.items():
+        items.sort(key=lambda t: t.start_time)
+        for prev, cur in zip(items, items[1:]):
+            if cur.start_time < prev.end_time:
+                raise ValueError(f"templates overlap on weekday {weekday}")
+
+    s.execute(text("delete from doctor_schedule_templates where doctor_id = :d"), {"d": doctor_id})
+    rows = s.execute(text("""
+        insert into doctor_schedule_templates
+            (doctor_id, weekday, start_time, end_time, slot_minutes, break_start, break_end)
+        select :d, t.*
+        from unnest(cast(:weekday as smallint[]), cast(:st as time[]), cast(:et as time[]),
+                    cast(:mins as int[]), cast(:bs as time[]), cast(:be as time[])) as t
+        returning *
+    """), {
+        "d": doctor_id,
+        "weekday": [t.weekday for t in templates],
+        "st": [t.start_time for t in templates],
+        "et": [t.end_time for t in templates],
+        "mins": [t.slot_minutes for t in templates],
+        "bs": [t.break_start for t in templates],
+        "be": [t.break_end for t in templates],
+    }).mappings().all()
+    s.commit()
+    return sorted((dict(r) for r in rows), key=lambda r: (r["weekday"], r["start_time"]))
 
-    canceled = s.execute(
-        text(
-            """
-            select id from appointments
-            where slot_id = :sid and status = 'CANCELED'
-            limit 1
-            """
-        ),
-        {"sid": body.slot_id},
-    ).mappings().first()
 
-    if canceled:
-        r = s.execute(
-            text(
-                """
-                update appointments
-                set client_id = :cid,
-                    comments = :com,
-                    appointment_type_id = :atype,
-                    status = 'BOOKED',
-                    canceled_at = null,
-                    completed_at = null,
-                    updated_at = now()
-                where id = :aid
-                returning *
-                """
-            ),
-            {
-                "aid": canceled["id"],
-                "cid": body.client_id,
-                "com": body.comments,
-                "atype": getattr(body, "appointment_type_id", None),
-            },
-        ).mappings().first()
-    else:
-        r = s.execute(
-            text("""
-                insert into appointments(
-                    slot_id,
-                    client_id,
-                    comments,
-                    appointment_type_id
-                )
-                values (:sid, :cid, :com, :atype)
-                returning *
-            """),
-            {
-                "sid": body.slot_id,
-                "cid": body.client_id,
-                "com": body.comments,
-                "atype": getattr(body, "appointment_type_id", None),
-            },
-        ).mappings().first()
+def upsert_schedule_exception(s: Session, doctor_id: int, day: date, body) -> Dict:
+    r = s.execute(text("""
+        insert into doctor_schedule_exceptions (doctor_id, day, start_time, end_time, slot_minutes, reason)
+        values (:d, :day, :st, :et, :mins, :reason)
+        on conflict (doctor_id, day) do update
+        set start_time = excluded.start_time,
+            end_time = excluded.end_time,
+            slot_minutes = excluded.slot_minutes,
+            reason = excluded.reason
+        returning *
+    """), {"d": doctor_id, "day": day, "st": body.start_time, "et": body.end_time,
+           "mins": body.slot_minutes, "reason": body.reason}).mappings().first()
+    s.commit()
+    return dict(r)
 
-    s.execute(
-        text("update appointment_slots set is_booked=true where id=:id"),
-        {"id": body.slot_id},
+
+def delete_schedule_exception(s: Session, doctor_id: int, day: date) -> bool:
+    res = s.execute(text("delete from doctor_schedule_exceptions where doctor_id = :d and day = :day"),
+                    {"d": doctor_id, "day": day})
+    s.commit()
+    return res.rowcount > 0
+
+
+# Слоты по шаблонам за [date_from, date_to]: дни из generate_series, интервалы
+# шаблонов (перерыв делит интервал на два) или часы исключения, сетка слотов от
+# начала интервала. Прошедшие и пересекающиеся с существующими слоты пропускаются,
+# поэтому повторный вызов ничего не создаёт. Одним insert ... select.
+_GENERATE_SLOTS = text("""
+    with days as (
+        select g::date as day
+        from generate_series(cast(:date_from as date), cast(:date_to as date), interval '1 day') g
+    ),
+    exceptions as (
+        select * from doctor_schedule_exceptions
+        where doctor_id = :d and day between :date_from and :date_to
+    ),
+    intervals as (
+        select days.day, p.from_time, p.to_time, t.slot_minutes
+        from days
+        join doctor_schedule_templates t
+          on t.doctor_id = :d and t.weekday = extract(isodow from days.day)
+        cross join lateral (values (t.start_time, coalesce(t.break_start, t.end_time)),
+                                   (t.break_end, t.end_time)) as p(from_time, to_time)
+        where p.from_time is not null
+          and p.from_time < p.to_time
+          and not exists (select 1 from exceptions e where e.day = days.day)
+        union all
+        select e.day, e.start_time, e.end_time, e.slot_minutes
+        from exceptions e
+        where e.start_time is not null
+    ),
+    candidates as (
+        select g.start_time, g.start_time + make_interval(mins => i.slot_minutes) as end_time
+        from intervals i
+        cross join lateral generate_series(
+            i.day + i.from_time,
+            i.day + i.to_time - make_interval(mins => i.slot_minutes),
+            make_interval(mins => i.slot_minutes)
+        ) as g(start_time)
+        where g.start_time > now()
+    ),
+    inserted as (
+        insert into appointment_slots (doctor_id, start_time, end_time)
+        select :d, c.start_time, c.end_time
+        from candidates c
+        where not exists (
+            select 1 from appointment_slots s
+            where s.doctor_id = :d
+              -- слоты не длиннее суток: нижняя граница сужает скан индекса (doctor_id, start_time)
+              and s.start_time > c.start_time - interval '1 day'
+              and s.start_time < c.end_time
+              and s.end_time > c.start_time
+        )
+        returning 1
     )
+    select (select count(*) from candidates) as candidates,
+           (select count(*) from inserted) as created
+""")
 
+def generate_slots_from_schedule(s: Session, doctor_id: int, date_from: date, date_to: date) -> Dict:
+    """
+    Создать слоты врача по шаблонам и исключениям за [date_from, date_to].
+    Идемпотентно; параллельные вызовы для одного врача сериализуются advisory lock'ом.
+    """
+    if date_to < date_from:
+        raise ValueError("date_to is before date_from")
+    if (date_to - date_from).days >= SCHEDULE_MAX_DAYS:
+        raise ValueError(f"range is longer than {SCHEDULE_MAX_DAYS} days")
+
+    s.execute(text("select pg_advisory_xact_lock(hashtext('appointment_slots'), cast(:d as int))"),
+              {"d": doctor_id})
+    r = s.execute(_GENERATE_SLOTS, {"d": doctor_id, "date_from": date_from, "date_to": date_to}).first()
     s.commit()
-    return dict(r)
+    if r.created:
+        _invalidate_search_cache(s, doctor_id)
+    return {"created": r.created, "skipped": r.candidates - r.created}
+
+# ===== Appointments =====
+# Запись на приём одним выражением: слот переводится в is_booked = true только если
+# он ещё свободен (строка слота блокируется update'ом, конкурент после ожидания
+# перепроверяет условие и получает 0 строк), и в том же выражении создаётся запись
+# или переиспользуется отменённая (appointments.slot_id уникален).
+# Строка результата есть всегда: id is null — не записали, slot_exists отличает
+# «слот занят» от «слота нет».
+_BOOK_APPOINTMENT = statement("appointments_book", """
+    with slot as (
+        update appointment_slots
+        set is_booked = true
+        where id = :sid and is_booked = false
+        returning id, doctor_id, start_time
+    ),
+    booked as (
+        insert into appointments (slot_id, client_id, comments, appointment_type_id)
+        select id, :cid, :com, :atype from slot
+        on conflict (slot_id) do update
+        set client_id = excluded.client_id,
+            comments = excluded.comments,
+            appointment_type_id = excluded.appointment_type_id,
+            status = 'BOOKED',
+            canceled_at = null,
+            completed_at = null,
+            updated_at = now()
+        where appointments.status = 'CANCELED'
+        returning *
+    )
+    select b.*,
+           slot.doctor_id as slot_doctor_id,
+           slot.start_time as slot_start_time,
+           exists (select 1 from appointment_slots where id = :sid) as slot_exists
+    from (select 1) one
+    left join booked b on true
+    left join slot on true
+""", {"sid": "bigint", "cid": "bigint", "com": "text", "atype": "int"})
+
+
+def book_appointment(s: Session, body) -> Dict:
+    """
+    Записать клиента на слот за один запрос к БД. Гонка за один слот безопасна:
+    запись получает ровно одна транзакция, остальные — ValueError("slot_already_booked").
+    Нет слота — ValueError("slot_not_found").
+    """
+    r = dict(execute(s, _BOOK_APPOINTMENT, {
+        "sid": body.slot_id,
+        "cid": body.client_id,
+        "com": body.comments,
+        "atype": getattr(body, "appointment_type_id", None),
+    }).mappings().one())
+    doctor_id, start_time = r.pop("slot_doctor_id"), r.pop("slot_start_time")
+    exists = r.pop("slot_exists")
+    if r["id"] is None:
+        # слот занят (или на нём уже есть активная запись) — ничего не меняем
+        s.rollback()
+        raise ValueError("slot_already_booked" if exists else "slot_not_found")
+
+    s.commit()
+    _invalidate_search_cache(s, doctor_id, day=start_time.date())
+    return r
+
+_APPOINTMENTS_BY_CLIENT = statement(
+    "appointments_by_client", "select * from appointments where client_id = :c order by id desc")
 
 def list_appointments_for_client(s: Session, client_id: int) -> List[Dict]:
-    rows = s.execute(text("select * from appointments where client_id=:c order by id desc"),
-                     {"c": client_id}).mappings().all()
+    rows = execute(s, _APPOINTMENTS_BY_CLIENT, {"c": client_id}).mappings().all()
     return [dict(r) for r in rows]
 
+_AVAILABLE_DATES_BY_DOCTOR = statement("slots_available_dates", """
+    select day
+    from doctor_free_slot_days
+    where doctor_id = :d
+    order by day
+""")
+
 def list_available_dates_for_doctor(s: Session, doctor_id: int) -> List[date]:
     """
-    Список дат, в которые у врача есть хотя бы один свободный слот.
+    Список дат, в которые у врача есть хотя бы один свободный слот
+    (по агрегату doctor_free_slot_days, см. sql/026).
     """
-    rows = s.execute(
-        text("""
-            select distinct date(start_time) as day
-            from appointment_slots
-            where doctor_id = :d
-              and is_booked = false
-            order by day
-        """),
-        {"d": doctor_id},
-    ).all()
+    rows = execute(s, _AVAILABLE_DATES_BY_DOCTOR, {"d": doctor_id}).all()
     return [r[0] for r in rows]
 
+# left join, чтобы врач без свободных слотов в окне дал строку с day = null,
+# а отсутствующий id — ни одной строки (missing)
+_AVAILABILITY_BY_DOCTORS = statement("slots_availability_by_doctors", """
+    select d.id as doctor_id, f.day, f.free_count
+    from doctors d
+    left join doctor_free_slot_days f
+      on f.doctor_id = d.id
+     and f.day between cast(:date_from as date) and cast(:date_to as date)
+    where d.id = any(:ids)
+    order by d.id, f.day
+""", {"ids": "bigint[]", "date_from": "date", "date_to": "date"})
+
+def list_availability_for_doctors(
+    s: Session, ids: List[int], date_from: date, date_to: date,
+) -> Tuple[List[Dict], List[int]]:
+    """
+    Число свободных слотов по дням за [date_from, date_to] для списка врачей одним
+    запросом (диапазон первичного ключа doctor_free_slot_days, только окно дат).
+    """
+    if date_to < date_from:
+        raise ValueError("date_to is before date_from")
+    if (date_to - date_from).days >= AVAILABILITY_MAX_DAYS:
+        raise ValueError(f"range is longer than {AVAILABILITY_MAX_DAYS} days")
+
+    rows = execute(s, _AVAILABILITY_BY_DOCTORS,
+                   {"ids": _unique_ids(ids), "date_from": date_from, "date_to": date_to}).all()
+    by_doctor: Dict[int, Dict] = {}
+    for doctor_id, day, free_count in rows:
+        item = by_doctor.setdefault(doctor_id, {"doctor_id": doctor_id, "days": []})
+        if day is not None:
+            item["days"].append({"day": day, "free_count": free_count})
+    return _batch_result(by_doctor.values(), ids, "doctor_id")
+
+# Ближайший свободный слот каждого подходящего врача — lateral top-1 по
+# idx_slots_availability (doctor_id, is_booked, start_time): на врача одна короткая
+# проба индекса, а не чтение всех его слотов. Отдельное выражение на каждый набор
+# фильтров, чтобы в плане не было условий вида (:x is null or ...).
+_EARLIEST_SLOTS_SQL_TMPL = """
+    select sl.id as slot_id, sl.doctor_id, sl.start_time, sl.end_time, sl.duration,
+           dsi.name, dsi.surname, dsi.patronymic, dsi.profession,
+           dsi.clinic_id, dsi.city, dsi.price, dsi.rating
+    from doctor_search_index dsi
+    cross join lateral (
+        select id, doctor_id, start_time, end_time, duration
+        from appointment_slots
+        where doctor_id = dsi.doctor_id
+          and is_booked = false
+          and start_time > greatest(cast(:after as timestamp), localtimestamp)
+        order by start_time
+        limit 1
+    ) sl
+    where {where}
+    order by sl.start_time, sl.doctor_id
+    limit :lim
+"""
+
+_EARLIEST_SLOTS = {
+    (by_spec, by_city): statement(
+        "slots_earliest" + ("_by_spec" if by_spec else "") + ("_by_city" if by_city else ""),
+        _EARLIEST_SLOTS_SQL_TMPL.format(where=" and ".join(
+            (["dsi.specialization_ids && array[cast(:spec as int)]"] if by_spec else [])
+            + (["dsi.city = :city"] if by_city else [])
+        ) or "true"),
+        {"after": "timestamp", "spec": "int", "city": "varchar", "lim": "int"},
+    )
+    for by_spec in (False, True)
+    for by_city in (False, True)
+}
+
+def list_earliest_slots(
+    s: Session,
+    specialization_id: Optional[int] = None,
+    city: Optional[str] = None,
+    after: Optional[datetime] = None,
+    limit: int = 10,
+) -> List[Dict]:
+    """
+    N ближайших свободных слотов среди врачей специализации/города — по одному
+    (самому раннему) на врача, не раньше after и текущего момента.
+    """
+    stmt = _EARLIEST_SLOTS[(specialization_id is not None, city is not None)]
+    params = {"after": after, "lim": limit}
+    if specialization_id is not None:
+        params["spec"] = specialization_id
+    if city is not None:
+        params["city"] = city
+    rows = execute(s, stmt, params).mappings().all()
+    return [dict(r) for r in rows]
+
 def cancel_appointment(s: Session, appointment_id: int) -> bool:
     """
     Отменить запись:
@@ -717,6 +1045,7 @@ def cancel_appointment(s: Session, appointment_id: int) -> bool:
     )
 
     s.commit()
+    _invalidate_search_cache_for_slot(s, slot_id)
     return True
 
 
@@ -818,9 +1147,9 @@ def upsert_appointment_review(s: Session, appointment_id: int, body) -> Optional
         return None
 
     existing = s.execute(
-        text("select id from appointment_reviews where appointment_id = :aid"),
+        text("select id, rating from appointment_reviews where appointment_id = :aid for update"),
         {"aid": appointment_id},
-    ).first()
+    ).mappings().first()
 
     if existing:
         r = s.execute(
@@ -854,8 +1183,12 @@ def upsert_appointment_review(s: Session, appointment_id: int, body) -> Optional
             },
         ).mappings().first()
 
-    _refresh_doctor_rating(s, appointment["doctor_id"])
+    if not existing:
+        # изменение оценки учитывает триггер на appointment_reviews (sql/018)
+        _bump_doctor_rating(s, appointment["doctor_id"],
+                            appointment_sum=body.rating, appointment_count=1)
     s.commit()
+    _invalidate_search_cache(s, appointment["doctor_id"])
     return dict(r)
 
 
@@ -931,30 +1264,27 @@ def list_pending_reviews(s: Session, client_id: int) -> List[Dict]:
     return [dict(r) for r in rows]
 
 
+_NEXT_APPOINTMENT_FOR_CLIENT = statement("appointments_next_for_client", """
+    select a.id as appointment_id,
+           slots.start_time as slot_start,
+           slots.doctor_id,
+           u.name as doctor_name,
+           u.surname as doctor_surname,
+           u.patronymic as doctor_patronymic,
+           d.profession as doctor_profession
+    from appointments a
+    join appointment_slots slots on slots.id = a.slot_id
+    left join doctors d on d.id = slots.doctor_id
+    left join users u on u.id = d.user_id
+    where a.client_id = :cid
+      and a.status = 'BOOKED'
+      and slots.start_time > now()
+    order by slots.start_time asc
+    limit 1
+""")
+
 def get_next_appointment_for_client(s: Session, client_id: int) -> Optional[Dict]:
-    row = s.execute(
-        text(
-            """
-            select a.id as appointment_id,
-                   slots.start_time as slot_start,
-                   slots.doctor_id,
-                   u.name as doctor_name,
-                   u.surname as doctor_surname,
-                   u.patronymic as doctor_patronymic,
-                   d.profession as doctor_profession
-            from appointments a
-            join appointment_slots slots on slots.id = a.slot_id
-            left join doctors d on d.id = slots.doctor_id
-            left join users u on u.id = d.user_id
-            where a.client_id = :cid
-              and a.status = 'BOOKED'
-              and slots.start_time > now()
-            order by slots.start_time asc
-            limit 1
-            """
-        ),
-        {"cid": client_id},
-    ).mappings().first()
+    row = execute(s, _NEXT_APPOINTMENT_FOR_CLIENT, {"cid": client_id}).mappings().first()
 
     return dict(row) if row else None
 
@@ -968,7 +1298,7 @@ def delete_slot_for_doctor(s: Session, doctor_id: int, slot_id: int) -> bool:
     """
     row = s.execute(
         text("""
-            select doctor_id, is_booked
+            select doctor_id, is_booked, start_time
             from appointment_slots
             where id = :id
         """),
@@ -994,6 +1324,7 @@ def delete_slot_for_doctor(s: Session, doctor_id: int, slot_id: int) -> bool:
         {"id": slot_id},
     )
     s.commit()
+    _invalidate_search_cache(s, doctor_id, day=row[2].date())
     return res.rowcount > 0
 
 # ===== Medical records / documents =====
@@ -1121,26 +1452,170 @@ def add_medical_document(s: Session, body) -> Dict:
     return dict(r)
 
 # ===== Reviews =====
-def _refresh_doctor_rating(s: Session, doctor_id: int) -> float:
+def _bump_doctor_rating(
+    s: Session,
+    doctor_id: int,
+    appointment_sum: float = 0,
+    appointment_count: int = 0,
+    doctor_sum: float = 0,
+    doctor_count: int = 0,
+) -> float:
     """
-    Пересчитывает рейтинг врача на основе всех доступных отзывов.
-    Используем как отзывы после приёмов, так и прямые отзывы о врачах.
+    Инкрементально обновляет агрегат рейтинга врача (doctor_rating_stats) при вставке
+    отзыва и зеркалит итог в doctors.rating (округление как в rebuild_doctor_rating_stats).
+    Вызывается в той же транзакции, что и запись отзыва; изменение и удаление отзывов
+    учитывают триггеры из sql/018.
     """
-    rating_expr = _DOCTOR_RATING_EXPR_TMPL.format(doctor_ref=":did")
-    avg_row = s.execute(
-        text(f"select {rating_expr} as avg_rating"),
-        {"did": doctor_id},
-    ).mappings().first()
-
-    new_rating = (avg_row or {}).get("avg_rating")
-    safe_rating = new_rating if new_rating is not None else 0
+    row = s.execute(
+        text("""
+            insert into doctor_rating_stats(doctor_id,
+                                            appointment_reviews_sum, appointment_reviews_count,
+                                            doctor_reviews_sum, doctor_reviews_count)
+            values (:did, :a_sum, :a_cnt, :d_sum, :d_cnt)
+            on conflict (doctor_id) do update
+            set appointment_reviews_sum   = doctor_rating_stats.appointment_reviews_sum + excluded.appointment_reviews_sum,
+                appointment_reviews_count = doctor_rating_stats.appointment_reviews_count + excluded.appointment_reviews_count,
+                doctor_reviews_sum        = doctor_rating_stats.doctor_reviews_sum + excluded.doctor_reviews_sum,
+                doctor_reviews_count      = doctor_rating_stats.doctor_reviews_count + excluded.doctor_reviews_count,
+                updated_at                = now()
+            returning round(rating::numeric, 2) as rating
+        """),
+        {
+            "did": doctor_id,
+            "a_sum": appointment_sum, "a_cnt": appointment_count,
+            "d_sum": doctor_sum, "d_cnt": doctor_count,
+        },
+    ).first()
+    new_rating = float(row[0]) if row and row[0] is not None else 0.0
 
     s.execute(
         text("update doctors set rating = :rt, updated_at = now() where id = :did"),
-        {"rt": safe_rating, "did": doctor_id},
+        {"rt": new_rating, "did": doctor_id},
     )
 
-    return safe_rating
+    return new_rating
+
+
+def rebuild_doctor_rating_stats(s: Session) -> int:
+    """
+    Полный пересчёт doctor_rating_stats по таблицам отзывов (бэкфилл).
+    Возвращает количество пересчитанных врачей.
+    """
+    n = s.execute(text("select rebuild_doctor_rating_stats()")).scalar()
+    s.commit()
+    return n or 0
+
+
+def rebuild_doctor_search_index(s: Session) -> int:
+    """
+    Полная пересборка doctor_search_index из исходных таблиц.
+    Возвращает количество строк индекса.
+    """
+    n = s.execute(text("select rebuild_doctor_search_index()")).scalar()
+    s.commit()
+    search_cache.clear()
+    return n or 0
+
+
+def rebuild_doctor_free_slot_days(s: Session) -> int:
+    """
+    Полный пересчёт doctor_free_slot_days по appointment_slots.
+    Возвращает количество строк агрегата (пар врач–день со свободными слотами).
+    """
+    n = s.execute(text("select rebuild_doctor_free_slot_days()")).scalar()
+    s.commit()
+    search_cache.clear()
+    return n or 0
+
+
+def check_doctor_free_slot_days(s: Session) -> List[Dict]:
+    """
+    Сверяет doctor_free_slot_days со слотами.
+    Возвращает расходящиеся пары врач–день (пустой список — всё консистентно).
+    """
+    rows = s.execute(text("""
+        with actual as (
+            select doctor_id, date(start_time) as day, count(*)::int as free_count
+            from appointment_slots
+            where is_booked = false
+            group by 1, 2
+        )
+        select coalesce(a.doctor_id, f.doctor_id) as doctor_id,
+               coalesce(a.day, f.day) as day,
+               coalesce(f.free_count, 0) as stored_free_count,
+               coalesce(a.free_count, 0) as free_count
+        from actual a
+        full join doctor_free_slot_days f on f.doctor_id = a.doctor_id and f.day = a.day
+        where a.free_count is distinct from f.free_count
+        order by 1, 2
+    """)).mappings().all()
+    return [dict(r) for r in rows]
+
+
+def _invalidate_search_cache(s: Session, doctor_id: int, day: Optional[date] = None) -> None:
+    """
+    Сбросить закэшированные выдачи поиска, на которые могла повлиять запись по врачу.
+    Вызывается после commit: город и специализации берутся уже обновлёнными из
+    doctor_search_index. day — день изменённого слота (затрагивает только поиск по дате).
+    """
+    if not search_cache.enabled:
+        return
+    r = s.execute(
+        text("select city, specialization_ids from doctor_search_index where doctor_id = :d"),
+        {"d": doctor_id},
+    ).first()
+    city, spec_ids = (r[0], r[1]) if r else (None, [])
+    search_cache.invalidate_doctor(doctor_id, city=city, specialization_ids=spec_ids or [], day=day)
+
+
+def _invalidate_search_cache_for_slot(s: Session, slot_id: int) -> None:
+    r = s.execute(
+        text("select doctor_id, start_time from appointment_slots where id = :id"),
+        {"id": slot_id},
+    ).first()
+    if r:
+        _invalidate_search_cache(s, r[0], day=r[1].date())
+
+
+def check_doctor_rating_stats(s: Session) -> List[Dict]:
+    """
+    Сверяет doctor_rating_stats с фактическими отзывами.
+    Возвращает врачей, у которых агрегат разошёлся (пустой список — всё консистентно).
+    """
+    rows = s.execute(text("""
+        with actual as (
+            select d.id as doctor_id,
+                   coalesce(ar.s, 0) as appointment_reviews_sum,
+                   coalesce(ar.c, 0) as appointment_reviews_count,
+                   coalesce(dr.s, 0) as doctor_reviews_sum,
+                   coalesce(dr.c, 0) as doctor_reviews_count
+            from doctors d
+            left join (
+                select doctor_id, sum(rating) as s, count(rating) as c
+                from appointment_reviews group by doctor_id
+            ) ar on ar.doctor_id = d.id
+            left join (
+                select doctor_id, sum(rating) as s, count(rating) as c
+                from doctor_reviews group by doctor_id
+            ) dr on dr.doctor_id = d.id
+        )
+        select a.doctor_id,
+               a.appointment_reviews_sum, a.appointment_reviews_count,
+               a.doctor_reviews_sum, a.doctor_reviews_count,
+               rs.appointment_reviews_sum as stored_appointment_reviews_sum,
+               rs.appointment_reviews_count as stored_appointment_reviews_count,
+               rs.doctor_reviews_sum as stored_doctor_reviews_sum,
+               rs.doctor_reviews_count as stored_doctor_reviews_count
+        from actual a
+        left join doctor_rating_stats rs on rs.doctor_id = a.doctor_id
+        where rs.doctor_id is null
+           or rs.appointment_reviews_sum <> a.appointment_reviews_sum
+           or rs.appointment_reviews_count <> a.appointment_reviews_count
+           or rs.doctor_reviews_sum <> a.doctor_reviews_sum
+           or rs.doctor_reviews_count <> a.doctor_reviews_count
+        order by a.doctor_id
+    """)).mappings().all()
+    return [dict(r) for r in rows]
 
 
 def create_doctor_review(s: Session, body) -> Optional[Dict]:
@@ -1150,8 +1625,10 @@ def create_doctor_review(s: Session, body) -> Optional[Dict]:
             values (:did,:cid,:rt,:cmt)
             returning *
         """), {"did": body.doctor_id, "cid": body.client_id, "rt": body.rating, "cmt": body.comment}).mappings().first()
-        _refresh_doctor_rating(s, body.doctor_id)
+        if r["rating"] is not None:
+            _bump_doctor_rating(s, body.doctor_id, doctor_sum=r["rating"], doctor_count=1)
         s.commit()
+        _invalidate_search_cache(s, body.doctor_id)
         return dict(r)
     except Exception:
         s.rollback()
@@ -1248,6 +1725,8 @@ def register_user_with_role(s: Session, reg) -> Dict:
             })
 
         s.commit()
+        if reg.role == "DOCTOR":
+            _invalidate_search_cache(s, doc["id"])
         return dict(user)
 
     except Exception:
@@ -1297,6 +1776,10 @@ def patch_client_by_user_id(s: Session, user_id: int, p) -> Optional[Dict]:
 
 
 def patch_doctor_by_user_id(s: Session, user_id: int, p) -> Optional[Dict]:
+    # рейтинг считается только из отзывов (doctor_rating_stats), руками не правится
+    if p.rating is not None:
+        raise ValueError("rating is computed from reviews and cannot be set")
+
     sets = []
     params = {"uid": user_id}
 
@@ -1308,8 +1791,6 @@ def patch_doctor_by_user_id(s: Session, user_id: int, p) -> Optional[Dict]:
         sets.append("info = :info"); params["info"] = p.info
     if p.is_confirmed is not None:
         sets.append("is_confirmed = :conf"); params["conf"] = p.is_confirmed
-    if p.rating is not None:
-        sets.append("rating = :rt"); params["rt"] = p.rating
     if p.experience is not None:
         sets.append("experience = :exp"); params["exp"] = p.experience
     if p.price is not None:
@@ -1351,6 +1832,7 @@ def patch_doctor_by_user_id(s: Session, user_id: int, p) -> Optional[Dict]:
     doctor = _get_doctor_with_specs_by_id(s, doctor_id)
 
     s.commit()
+    _invalidate_search_cache(s, doctor_id)
     return doctor
 
 
@@ -1383,8 +1865,92 @@ def patch_admin_by_user_id(s: Session, user_id: int, p) -> Optional[Dict]:
     s.commit()
     return dict(r) if r else None
 
-def search_doctors(
-    s: Session,
+def encode_search_cursor(row: Dict) -> str:
+    """
+    Непрозрачный курсор keyset-пагинации поиска: последняя (rating, price, id) страницы.
+    """
+    price = row.get("price")
+    payload = [row.get("rating") or 0.0, str(price) if price is not None else None, row["id"]]
+    raw = json.dumps(payload, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def _decode_search_cursor(cursor: str) -> tuple:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        rating, price, doctor_id = json.loads(raw)
+        return (
+            float(rating),
+            Decimal(price) if price is not None else None,
+            int(doctor_id),
+        )
+    except (ValueError, TypeError, InvalidOperation):
+        raise ValueError("invalid cursor")
+
+
+# Текстовый поиск: слова короче SEARCH_MIN_WORD_LEN (предлоги, инициалы) отбрасываются,
+# учитываются первые SEARCH_MAX_WORDS слов.
+SEARCH_MIN_WORD_LEN = 3
+SEARCH_MAX_WORDS = 6
+# Порог word_similarity для нечёткого совпадения слова (опечатки)
+SEARCH_TRGM_THRESHOLD = 0.5
+# Вклад рейтинга (0..5) в итоговый score при q: score = relevance + weight * rating / 5
+SEARCH_RATING_WEIGHT = 0.2
+
+
+def _search_terms(s: Session, q: Optional[str]) -> List[Tuple[str, bool]]:
+    """
+    Слова запроса q -> [(слово, exact)] одним запросом. exact=True — слово есть в словаре
+    search_vector (ищем точно по tsvector), False — не нашлось, вероятно опечатка
+    (ищем по триграммам). Так частые слова не тянут за собой нечёткий OR,
+    из-за которого планировщик уходит в полный перебор. Стоп-слова отбрасываются.
+    """
+    if not q:
+        return []
+    words = [w for w in re.findall(r"\w+", q.lower()) if len(w) >= SEARCH_MIN_WORD_LEN]
+    words = list(dict.fromkeys(words))[:SEARCH_MAX_WORDS]
+    if not words:
+        return []
+    # по подзапросу на слово: с константой планировщик видит частоту слова
+    # и берёт GIN-индекс для редких слов
+    cols = ",\n".join(
+        f"""numnode(plainto_tsquery('russian', :w{i})) = 0 as stop{i},
+            exists (
+                select 1 from doctor_search_index dsi
+                where dsi.search_vector @@ plainto_tsquery('russian', :w{i})
+            ) as exact{i}"""
+        for i in range(len(words))
+    )
+    # порог <% на время транзакции: при 0.6 (по умолчанию) "кардиалог" уже не находит
+    # "кардиолог". Ставится в том же выражении, что и проба слов: для точных слов
+    # <% не используется, а отдельный запрос съел бы бюджет маршрута
+    r = s.execute(
+        text(f"select {cols},\n set_config('pg_trgm.word_similarity_threshold', :t, true)"),
+        {"t": str(SEARCH_TRGM_THRESHOLD), **{f"w{i}": w for i, w in enumerate(words)}},
+    ).mappings().first()
+    return [(w, r[f"exact{i}"]) for i, w in enumerate(words) if not r[f"stop{i}"]]
+
+
+# Радиус гео-поиска по умолчанию, км
+DEFAULT_RADIUS_KM = 10.0
+# Километров в градусе широты (по меридиану)
+_KM_PER_DEGREE = 111.045
+
+
+def _bounding_box(lat: float, lon: float, radius_km: float) -> Tuple[float, float, float, float]:
+    """(lat_min, lon_min, lat_max, lon_max) прямоугольника, описанного вокруг круга radius_km."""
+    dlat = radius_km / _KM_PER_DEGREE
+    dlon = radius_km / (_KM_PER_DEGREE * max(math.cos(math.radians(lat)), 0.01))
+    return (
+        max(lat - dlat, -90.0), max(lon - dlon, -180.0),
+        min(lat + dlat, 90.0), min(lon + dlon, 180.0),
+    )
+
+
+def _doctor_search_filters(
+    q_terms: Optional[List[Tuple[str, bool]]] = None,
+    near: Optional[Tuple[float, float]] = None,
+    radius_km: Optional[float] = None,
     specialization_ids: Optional[List[int]] = None,
     city: Optional[str] = None,
     region: Optional[str] = None,
@@ -1399,98 +1965,92 @@ def search_doctors(
     min_experience: Optional[int] = None,
     max_experience: Optional[int] = None,
     date_filter: Optional[date] = None,
-    limit: int = 50,
-    offset: int = 0,
-) -> List[Dict]:
-    safe_limit = 50 if limit is None or limit <= 0 else limit
-    safe_offset = 0 if offset is None or offset < 0 else offset
-    rating_expr = _DOCTOR_RATING_EXPR_TMPL.format(doctor_ref="d.id")
-    sql = """
-        select
-            d.*,
-            {rating_expr} as rating,
-            u.gender,
-            u.date_of_birth,
-            c.city,
-            c.region,
-            c.metro,
-            coalesce(
-                array(
-                    select s2.name
-                    from doctor_specializations ds2
-                    join specializations s2 on s2.id = ds2.specialization_id
-                    where ds2.doctor_id = d.id
-                    order by s2.name
-                ),
-                array[]::varchar[]
-            ) as specialization_names
-        from doctors d
-        join users u on u.id = d.user_id
-        left join clinics c on c.id = d.clinic_id
-        where 1=1
-    """.format(rating_expr=rating_expr)
-    params = {"limit": safe_limit, "offset": safe_offset}
+) -> Tuple[str, Dict]:
+    """
+    Условия фильтров поиска врачей по doctor_search_index (алиас dsi).
+    Возвращает (sql, params); sql — цепочка " and ...", дописывается после where.
+    Общая для выдачи (search_doctors) и фасетов (search_doctor_facets).
+    """
+    sql = ""
+    params: Dict = {}
+
+    # каждое слово q должно найтись: по tsvector (словоформы) или по триграммам (опечатки)
+    for i, (word, exact) in enumerate(q_terms or []):
+        if exact:
+            sql += f" and dsi.search_vector @@ plainto_tsquery('russian', :q_w{i})"
+        else:
+            sql += f" and :q_w{i} <% dsi.search_text"
+        params[f"q_w{i}"] = word
+
+    # гео: прямоугольник по GiST-индексу, затем точное расстояние
+    if near is not None:
+        lat, lon = near
+        lat_min, lon_min, lat_max, lon_max = _bounding_box(lat, lon, radius_km or DEFAULT_RADIUS_KM)
+        sql += """
+            and dsi.location <@ box(point(:geo_lon_min, :geo_lat_min), point(:geo_lon_max, :geo_lat_max))
+            and distance_km(:geo_lat, :geo_lon, dsi.latitude, dsi.longitude) <= :geo_radius
+        """
+        params.update({
+            "geo_lat": lat, "geo_lon": lon, "geo_radius": radius_km or DEFAULT_RADIUS_KM,
+            "geo_lat_min": lat_min, "geo_lon_min": lon_min,
+            "geo_lat_max": lat_max, "geo_lon_max": lon_max,
+        })
 
     if city is not None:
-        sql += " and c.city = :city"
+        sql += " and dsi.city = :city"
         params["city"] = city
 
     if region is not None:
-        sql += " and c.region = :region"
+        sql += " and dsi.region = :region"
         params["region"] = region
 
     if metro is not None:
-        sql += " and c.metro = :metro"
+        sql += " and dsi.metro = :metro"
         params["metro"] = metro
 
     if online_only:
-        sql += " and d.online_available = true"
+        sql += " and dsi.online_available = true"
 
     if min_price is not None:
-        sql += " and d.price is not null and d.price >= :min_price"
+        sql += " and dsi.price is not null and dsi.price >= :min_price"
         params["min_price"] = min_price
 
     if max_price is not None:
-        sql += " and d.price is not null and d.price <= :max_price"
+        sql += " and dsi.price is not null and dsi.price <= :max_price"
         params["max_price"] = max_price
 
     if min_rating is not None:
-        sql += f" and {rating_expr} >= :min_rating"
+        sql += " and dsi.rating >= :min_rating"
         params["min_rating"] = min_rating
 
     if gender is not None:
-        sql += " and u.gender = :gender"
+        sql += " and dsi.gender = :gender"
         params["gender"] = gender
 
+    # возраст -> диапазон дат рождения (индекс по date_of_birth)
     if min_age is not None:
         sql += """
-            and u.date_of_birth is not null
-            and extract(year from age(now(), u.date_of_birth)) >= :min_age
+            and dsi.date_of_birth <= (current_date - make_interval(years => :min_age))::date
         """
         params["min_age"] = min_age
 
     if max_age is not None:
         sql += """
-            and u.date_of_birth is not null
-            and extract(year from age(now(), u.date_of_birth)) <= :max_age
+            and dsi.date_of_birth > (current_date - make_interval(years => :max_age + 1))::date
         """
         params["max_age"] = max_age
 
     if min_experience is not None:
-        sql += " and d.experience is not null and d.experience >= :min_exp"
+        sql += " and dsi.experience is not null and dsi.experience >= :min_exp"
         params["min_exp"] = min_experience
 
     if max_experience is not None:
-        sql += " and d.experience is not null and d.experience <= :max_exp"
+        sql += " and dsi.experience is not null and dsi.experience <= :max_exp"
         params["max_exp"] = max_experience
 
     if specialization_ids:
         sql += """
-            and exists (
-                select 1 from doctor_specializations ds
-                where ds.doctor_id = d.id
-                  and ds.specialization_id = any(:spec_ids)
-            )
+            and dsi.specialization_ids && cast(:spec_ids as int[])
         """
         params["spec_ids"] = specialization_ids
 
@@ -1498,16 +2058,170 @@ def search_doctors(
         sql += """
             and exists (
                 select 1
-                from appointment_slots s2
-                where s2.doctor_id = d.id
-                  and s2.is_booked = false
-                  and date(s2.start_time) = :slot_date
+                from doctor_free_slot_days f
+                where f.doctor_id = dsi.doctor_id
+                  and f.day = :slot_day
             )
         """
-        params["slot_date"] = date_filter
+        params["slot_day"] = date_filter
+
+    return sql, params
+
+
+def search_doctors(
+    s: Session,
+    q: Optional[str] = None,
+    near: Optional[Tuple[float, float]] = None,
+    radius_km: Optional[float] = None,
+    specialization_ids: Optional[List[int]] = None,
+    city: Optional[str] = None,
+    region: Optional[str] = None,
+    metro: Optional[str] = None,
+    online_only: bool = False,
+    min_price: Optional[float] = None,
+    max_price: Optional[float] = None,
+    min_rating: Optional[float] = None,
+    gender: Optional[str] = None,
+    min_age: Optional[int] = None,
+    max_age: Optional[int] = None,
+    min_experience: Optional[int] = None,
+    max_experience: Optional[int] = None,
+    date_filter: Optional[date] = None,
+    limit: int = 50,
+    offset: int = 0,
+    cursor: Optional[str] = None,
+    sort: Optional[str] = None,
+) -> List[Dict]:
+    """
+    Поиск врачей. Порядок: rating desc, price asc nulls last, id.
+    Если передан cursor (см. encode_search_cursor) — keyset-пагинация от последней
+    строки предыдущей страницы, offset при этом игнорируется.
+
+    q — текстовый запрос по ФИО, профессии, специализациям и описанию
+    (словоформы + опечатки). С q выдача сортируется по релевантности
+    (с учётом рейтинга), курсор вместе с q не поддерживается.
+
+    near=(lat, lon) — только врачи клиник в радиусе radius_km, в ответе distance_km;
+    sort="distance" — сортировка по расстоянию (нужен near, без курсора).
+    """
+    if sort not in (None, "distance"):
+        raise ValueError("unsupported sort")
+    if sort == "distance" and near is None:
+        raise ValueError("sort=distance requires near")
+    if sort == "distance" and cursor:
+        raise ValueError("cursor is not supported together with sort=distance")
+    terms = _search_terms(s, q)
+    if terms and cursor:
+        raise ValueError("cursor is not supported together with q")
+    safe_limit = 50 if limit is None or limit <= 0 else limit
+    safe_offset = 0 if offset is None or offset < 0 else offset
+    after = _decode_search_cursor(cursor) if cursor else None
+    if after is not None:
+        safe_offset = 0
+
+    if terms:
+        # средняя по словам релевантность: ts_rank для точных слов, сходство триграмм для опечаток
+        rank_sql = " + ".join(
+            f"ts_rank(dsi.search_vector, plainto_tsquery('russian', :q_w{i}))" if exact
+            else f"word_similarity(:q_w{i}, dsi.search_text)"
+            for i, (_, exact) in enumerate(terms)
+        )
+        rank_sql = f"({rank_sql}) / {len(terms)}"
+    else:
+        rank_sql = "null::float"
+
+    if near is not None:
+        distance_sql = "distance_km(:geo_lat, :geo_lon, dsi.latitude, dsi.longitude)"
+    else:
+        distance_sql = "null::float"
+
+    sql = f"""
+        select
+            dsi.doctor_id as id,
+            dsi.user_id,
+            dsi.clinic_id,
+            dsi.profession,
+            dsi.info,
+            dsi.is_confirmed,
+            dsi.rating,
+            dsi.experience,
+            dsi.price,
+            dsi.online_available,
+            dsi.gender,
+            dsi.date_of_birth,
+            dsi.city,
+            dsi.region,
+            dsi.metro,
+            dsi.specialization_names,
+            dsi.name,
+            dsi.surname,
+            dsi.patronymic,
+            dsi.latitude,
+            dsi.longitude,
+            {rank_sql} as search_rank,
+            {distance_sql} as distance_km
+        from doctor_search_index dsi
+        where 1=1
+    """
+    where_sql, params = _doctor_search_filters(
+        q_terms=terms,
+        near=near,
+        radius_km=radius_km,
+        specialization_ids=specialization_ids,
+        city=city,
+        region=region,
+        metro=metro,
+        online_only=online_only,
+        min_price=min_price,
+        max_price=max_price,
+        min_rating=min_rating,
+        gender=gender,
+        min_age=min_age,
+        max_age=max_age,
+        min_experience=min_experience,
+        max_experience=max_experience,
+        date_filter=date_filter,
+    )
+    sql += where_sql
+    params.update({"limit": safe_limit, "offset": safe_offset})
+
+    if after is not None:
+        # (rating desc, price asc nulls last, id asc) — строки строго после курсора.
+        # dsi.rating <= :c_rating — граница для Index Cond по idx_dsi_order: скан
+        # начинается с позиции курсора, а не отфильтровывает все предыдущие страницы
+        c_rating, c_price, c_id = after
+        sql += " and dsi.rating <= :c_rating"
+        if c_price is None:
+            sql += """
+                and (dsi.rating < :c_rating
+                     or (dsi.rating = :c_rating and dsi.price is null and dsi.doctor_id > :c_id))
+            """
+        else:
+            sql += """
+                and (dsi.rating < :c_rating
+                     or (dsi.rating = :c_rating
+                         and (dsi.price > :c_price
+                              or dsi.price is null
+                              or (dsi.price = :c_price and dsi.doctor_id > :c_id))))
+            """
+            params["c_price"] = c_price
+        params["c_rating"] = c_rating
+        params["c_id"] = c_id
 
-    sql += f"""
-            order by {rating_expr} desc, d.price asc nulls last, d.id
+    if sort == "distance":
+        sql += f"""
+            order by {distance_sql}, dsi.doctor_id
+            limit :limit offset :offset
+        """
+    elif terms:
+        sql += f"""
+            order by {rank_sql} + {SEARCH_RATING_WEIGHT} * dsi.rating / 5 desc,
+                     dsi.rating desc, dsi.price asc nulls last, dsi.doctor_id
+            limit :limit offset :offset
+        """
+    else:
+        sql += """
+            order by dsi.rating desc, dsi.price asc nulls last, dsi.doctor_id
             limit :limit offset :offset
         """
 
@@ -1515,6 +2229,109 @@ def search_doctors(
     return [dict(r) for r in rows]
 
 
+# Границы ценовых корзин фасета: [None, 1000), [1000, 2000), ..., [5000, None)
+PRICE_FACET_BOUNDS = [1000, 2000, 3000, 5000]
+
+
+def search_doctor_facets(s: Session, q: Optional[str] = None, **filters) -> Dict:
+    """
+    Фасеты поиска врачей для текущего набора фильтров (те же аргументы,
+    что у search_doctors, без пагинации): количество врачей по городу, метро,
+    специализации, полу, ценовой корзине и онлайн-приёму.
+
+    Один запрос: отфильтрованная выборка из doctor_search_index считается один раз,
+    по ней — GROUPING SETS (хэш-агрегация) по всем скалярным измерениям
+    и отдельный group by по unnest(specialization_ids).
+    """
+    where_sql, params = _doctor_search_filters(q_terms=_search_terms(s, q), **filters)
+    params["price_bounds"] = PRICE_FACET_BOUNDS
+
+    rows = s.execute(text(f"""
+        with base as (
+            select
+                dsi.doctor_id,
+                dsi.city,
+                dsi.metro,
+                dsi.gender,
+                dsi.online_available,
+                case when dsi.price is not null
+                     then width_bucket(dsi.price, cast(:price_bounds as numeric[]))
+                end as price_bucket,
+                dsi.specialization_ids
+            from doctor_search_index dsi
+            where 1=1 {where_sql}
+        ),
+        agg as (
+            select
+                case
+                    when grouping(b.city) = 0 then 'city'
+                    when grouping(b.metro) = 0 then 'metro'
+                    when grouping(b.gender) = 0 then 'gender'
+                    when grouping(b.price_bucket) = 0 then 'price'
+                    when grouping(b.online_available) = 0 then 'online'
+                    else 'total'
+                end as facet,
+                b.city, b.metro, null::int as specialization_id, b.gender,
+                b.price_bucket, b.online_available,
+                count(*) as cnt
+            from base b
+            group by grouping sets (
+                (b.city), (b.metro), (b.gender),
+                (b.price_bucket), (b.online_available), ()
+            )
+            union all
+            -- id специализаций у врача уникальны, поэтому count(*) по unnest = число врачей
+            select
+                'specialization', null, null, spec.id, null, null, null,
+                count(*)
+            from base b
+            cross join lateral unnest(b.specialization_ids) as spec(id)
+            group by spec.id
+        )
+        select agg.*, sp.name as specialization_name
+        from agg
+        left join specializations sp on sp.id = agg.specialization_id
+        order by agg.cnt desc
+    """), params).mappings().all()
+
+    result = {
+        "total": 0,
+        "cities": [],
+        "metros": [],
+        "specializations": [],
+        "genders": [],
+        "price_buckets": [],
+        "online_available": [],
+    }
+    for r in rows:
+        facet, cnt = r["facet"], r["cnt"]
+        if facet == "total":
+            result["total"] = cnt
+        elif facet == "city" and r["city"] is not None:
+            result["cities"].append({"value": r["city"], "count": cnt})
+        elif facet == "metro" and r["metro"] is not None:
+            result["metros"].append({"value": r["metro"], "count": cnt})
+        elif facet == "gender" and r["gender"] is not None:
+            result["genders"].append({"value": r["gender"], "count": cnt})
+        elif facet == "online":
+            result["online_available"].append({"value": r["online_available"], "count": cnt})
+        elif facet == "specialization" and r["specialization_id"] is not None:
+            result["specializations"].append({
+                "id": r["specialization_id"],
+                "name": r["specialization_name"],
+                "count": cnt,
+            })
+        elif facet == "price" and r["price_bucket"] is not None:
+            b = r["price_bucket"]
+            result["price_buckets"].append({
+                "min_price": PRICE_FACET_BOUNDS[b - 1] if b > 0 else None,
+                "max_price": PRICE_FACET_BOUNDS[b] if b < len(PRICE_FACET_BOUNDS) else None,
+                "count": cnt,
+            })
+    result["price_buckets"].sort(key=lambda x: x["min_price"] or 0)
+    return result
+
+
 def list_medical_records_for_client(s: Session, client_id: int) -> List[Dict]:
     rows = s.execute(
         text(
@@ -1529,19 +2346,16 @@ def list_medical_records_for_client(s: Session, client_id: int) -> List[Dict]:
     ).mappings().all()
     return [dict(r) for r in rows]
 
+_APPOINTMENTS_BY_DOCTOR = statement("appointments_by_doctor", """
+    select a.*
+    from appointments a
+    join appointment_slots s2 on a.slot_id = s2.id
+    where s2.doctor_id = :d
+    order by a.id desc
+""")
+
 def list_appointments_for_doctor(s: Session, doctor_id: int) -> List[Dict]:
-    rows = s.execute(
-        text(
-            """
-            select a.*
-            from appointments a
-            join appointment_slots s2 on a.slot_id = s2.id
-            where s2.doctor_id = :d
-            order by a.id desc
-            """
-        ),
-        {"d": doctor_id},
-    ).mappings().all()
+    rows = execute(s, _APPOINTMENTS_BY_DOCTOR, {"d": doctor_id}).mappings().all()
     return [dict(r) for r in rows]
 
 
@@ -1637,6 +2451,15 @@ def update_chat_session_messages(s, session_id: str, messages: list):
     s.commit()
 
 
+_CHAT_HISTORY = statement("chat_history", """
+    select id, user_id, session_id, messages, created_at, updated_at
+    from chat_sessions
+    where user_id = :uid
+    order by updated_at desc
+    limit :lim
+""")
+
+
 def get_chat_history(s, user_id: int, limit: int = 50):
     """
     Get chat history for user
@@ -1649,16 +2472,7 @@ def get_chat_history(s, user_id: int, limit: int = 50):
     Returns:
         List of session dicts ordered by updated_at DESC
     """
-    rows = s.execute(
-        text("""
-            select id, user_id, session_id, messages, created_at, updated_at
-            from chat_sessions
-            where user_id = :uid
-            order by updated_at desc
-            limit :lim
-        """),
-        {"uid": user_id, "lim": limit}
-    ).mappings().all()
+    rows = execute(s, _CHAT_HISTORY, {"uid": user_id, "lim": limit}).mappings().all()
     
     # Convert UUID to string for JSON serialization
     result = []
@@ -0,0 +1,95 @@
+"""
+Быстрая сериализация больших списков из БД.
+
+Обычный путь FastAPI для списка строк: dict(r) -> валидация каждой строки по
+response_model (Pydantic) -> сериализация -> json.dumps. Строки из нашего же SQL
+уже нужной формы, поэтому для длинных списков json_rows() оставляет от строки
+только поля модели и сразу пишет JSON-байты через orjson (JSONResponse в обход
+валидации). response_model в декораторе остаётся — OpenAPI-схема не меняется.
+
+FAST_JSON=false (или отсутствие orjson) возвращает обычный путь с валидацией.
+Вложенные модели (review в истории приёмов) собираются в dict вызывающим кодом.
+
+ndjson_chunks() — то же для потоковой выгрузки: строка JSON на запись, строки
+склеиваются в куски по NDJSON_CHUNK_BYTES.
+"""
+import os
+from decimal import Decimal
+from functools import lru_cache
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple, Type, Union
+
+from fastapi import Response
+from pydantic import BaseModel
+
+try:
+    import orjson
+except ImportError:  # orjson в requirements.txt, но без него работает обычный путь
+    orjson = None
+
+FAST_JSON = os.getenv("FAST_JSON", "true").lower() == "true" and orjson is not None
+NDJSON_CHUNK_BYTES = 64 * 1024
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+
+def _default(value: Any):
+    if isinstance(value, Decimal):
+        return float(value)
+    raise TypeError(f"Type is not JSON serializable: {type(value).__name__}")
+
+
+class ORJSONResponse(Response):
+    """JSON-ответ через orjson: datetime/date/UUID нативно, UTC как 'Z' — как у Pydantic."""
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        return orjson.dumps(content, default=_default, option=orjson.OPT_UTC_Z)
+
+
+@lru_cache(maxsize=None)
+def _fields(model: Type[BaseModel]) -> Tuple[Tuple[str, Any], ...]:
+    """(имя, значение по умолчанию) полей модели; для обязательных — None."""
+    return tuple(
+        (name, None if f.is_required() else f.get_default(call_default_factory=True))
+        for name, f in model.model_fields.items()
+    )
+
+
+def project(row: Dict, model: Type[BaseModel]) -> Dict:
+    """Только поля модели (лишние колонки вроде password_hash наружу не уходят)."""
+    return {name: row.get(name, default) for name, default in _fields(model)}
+
+
+def json_rows(rows: Iterable[Dict], model: Type[BaseModel],
+              response: Optional[Response] = None) -> Union[Response, List[Dict]]:
+    """
+    Ответ для списка доверенных строк: ORJSONResponse без валидации (FAST_JSON)
+    или сам список — тогда его проверит response_model эндпоинта. response —
+    параметр эндпоинта (Response), заголовки из него переносятся в ORJSONResponse.
+    """
+    if not FAST_JSON:
+        return list(rows)
+    out = ORJSONResponse([project(r, model) for r in rows])
+    if response is not None:
+        for key, value in response.headers.items():
+            out.headers.append(key, value)
+    return out
+
+
+def _ndjson_line(row: Dict, model: Type[BaseModel]) -> bytes:
+    if FAST_JSON:
+        return orjson.dumps(project(row, model), default=_default, option=orjson.OPT_UTC_Z) + b"\n"
+    return model.model_validate(row).model_dump_json().encode() + b"\n"
+
+
+def ndjson_chunks(rows: Iterable[Dict], model: Type[BaseModel]) -> Iterator[bytes]:
+    """NDJSON по строкам rows (поля model), куски примерно по NDJSON_CHUNK_BYTES."""
+    buf, size = [], 0
+    for row in rows:
+        line = _ndjson_line(row, model)
+        buf.append(line)
+        size += len(line)
+        if size >= NDJSON_CHUNK_BYTES:
+            yield b"".join(buf)
+            buf, size = [], 0
+    if buf:
+        yield b"".join(buf)
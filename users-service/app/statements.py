@@ -0,0 +1,92 @@
+"""
+Реестр скомпилированных SQL-выражений репозитория.
+
+Горячие запросы (вход, профиль, слоты врача, запись на приём) объявляются один раз
+при импорте модуля через statement(...) и выполняются через execute(...):
+  - text() строится один раз, а не на каждый вызов;
+  - на соединении psycopg2 выражение один раз подготавливается на сервере
+    (PREPARE <name>), дальше идёт только EXECUTE <name>(...) — Postgres не разбирает
+    и не планирует SQL заново. Подготовленные имена живут в connection.info и
+    пропадают вместе с соединением (pool_recycle, переподключение).
+
+DB_PREPARED_STATEMENTS=false выключает PREPARE (например, за pgbouncer в режиме
+transaction) — выражения тогда выполняются обычным запросом. asyncpg подготавливает
+выражения сам, для него PREPARE тоже не делается.
+
+После миграций, меняющих колонки таблиц из подготовленных `select *`, сервис нужно
+перезапустить (run-server.sh так и делает) — иначе Postgres ответит
+"cached plan must not change result type".
+"""
+import os
+import re
+from typing import Dict, List, Optional
+
+from sqlalchemy import text
+from sqlalchemy.engine import Result
+from sqlalchemy.orm import Session
+
+PREPARED_STATEMENTS = os.getenv("DB_PREPARED_STATEMENTS", "true").lower() == "true"
+
+# :name, но не ::cast и не 10:00 внутри литералов
+_BIND_RE = re.compile(r"(?<![:\w]):(\w+)")
+
+
+class Statement:
+    """SQL с именованными параметрами (:name) и его серверный вариант PREPARE/EXECUTE."""
+
+    def __init__(self, name: str, sql: str, types: Optional[Dict[str, str]] = None):
+        if "%" in sql:
+            raise ValueError(f"{name}: '%' is not allowed in prepared SQL")
+        self.name = name
+        self.sql = sql
+        self.clause = text(sql)
+
+        params: List[str] = []
+        for m in _BIND_RE.finditer(sql):
+            if m.group(1) not in params:
+                params.append(m.group(1))
+        self.params = params
+
+        position = {p: i + 1 for i, p in enumerate(params)}
+        body = _BIND_RE.sub(lambda m: f"${position[m.group(1)]}", sql)
+        # тип не указан -> unknown: Postgres выведет его из контекста, как для обычного запроса
+        signature = ", ".join((types or {}).get(p, "unknown") for p in params)
+        self.prepare_sql = f"prepare {name}({signature}) as {body}" if params else f"prepare {name} as {body}"
+        args = ", ".join(f":{p}" for p in params)
+        self.execute_clause = text(f"execute {name}({args})" if params else f"execute {name}")
+
+    def __repr__(self) -> str:
+        return f"Statement({self.name!r})"
+
+
+REGISTRY: Dict[str, Statement] = {}
+
+
+def statement(name: str, sql: str, types: Optional[Dict[str, str]] = None) -> Statement:
+    """Объявить выражение в реестре (имя уникально, оно же имя PREPARE на сервере)."""
+    if name in REGISTRY:
+        raise ValueError(f"statement {name!r} is already registered")
+    stmt = Statement(name, sql, types)
+    REGISTRY[name] = stmt
+    return stmt
+
+
+def execute(s: Session, stmt: Statement, params: Optional[Dict] = None) -> Result:
+    """
+    Выполнить выражение из реестра в сессии s: EXECUTE подготовленного выражения
+    (PREPARE при первом использовании на этом соединении) или обычный запрос.
+    """
+    params = params or {}
+    if not PREPARED_STATEMENTS:
+        return s.execute(stmt.clause, params)
+
+    conn = s.connection()
+    if conn.dialect.driver != "psycopg2":
+        return s.execute(stmt.clause, params)
+
+    prepared = conn.info.setdefault("prepared_statements", set())
+    if stmt.name not in prepared:
+        # PREPARE не транзакционный: переживает rollback текущей транзакции
+        conn.exec_driver_sql(stmt.prepare_sql)
+        prepared.add(stmt.name)
+    return s.execute(stmt.execute_clause, params)
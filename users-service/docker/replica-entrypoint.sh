@@ -0,0 +1,34 @@
+#!/bin/bash
+# Реплика только для чтения (hot standby) для профиля replica в docker-compose.yml.
+# При пустом томе снимает базовую копию с primary (сервис db) и запускается
+# как standby с потоковой репликацией через слот users_replica.
+set -e
+
+PRIMARY_HOST="${PRIMARY_HOST:-db}"
+SLOT="${REPLICATION_SLOT:-users_replica}"
+export PGPASSWORD="$POSTGRES_PASSWORD"
+
+until pg_isready -h "$PRIMARY_HOST" -U "$POSTGRES_USER" -d "$POSTGRES_DB" > /dev/null 2>&1; do
+    echo "replica: жду primary $PRIMARY_HOST..."
+    sleep 1
+done
+
+if [ ! -s "$PGDATA/PG_VERSION" ]; then
+    echo "replica: базовая копия с $PRIMARY_HOST"
+    psql -h "$PRIMARY_HOST" -U "$POSTGRES_USER" -d "$POSTGRES_DB" -v ON_ERROR_STOP=1 -c \
+        "select pg_create_physical_replication_slot('$SLOT')
+         where not exists (select 1 from pg_replication_slots where slot_name = '$SLOT')"
+
+    mkdir -p "$PGDATA"
+    chown postgres:postgres "$PGDATA"
+    chmod 700 "$PGDATA"
+    gosu postgres pg_basebackup -h "$PRIMARY_HOST" -U "$POSTGRES_USER" -D "$PGDATA" \
+        -X stream -S "$SLOT" -R -c fast
+    cat >> "$PGDATA/postgresql.auto.conf" <<CONF
+primary_conninfo = 'host=$PRIMARY_HOST port=5432 user=$POSTGRES_USER password=$POSTGRES_PASSWORD application_name=$SLOT'
+primary_slot_name = '$SLOT'
+hot_standby = on
+CONF
+fi
+
+exec gosu postgres postgres
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк пути доступа к БД: sync (psycopg2 в threadpool) против async (asyncpg, ASYNC_DB=true).
+
+Для каждого режима поднимает uvicorn с приложением на свободном порту, гоняет
+конкурентные GET-запросы к горячим чтениям (поиск, слоты, профиль, записи)
+и печатает req/s и задержки. Кэш выдачи поиска выключается (SEARCH_CACHE_SIZE=0),
+чтобы сравнивались именно походы в БД.
+
+Запуск из корня users-service (нужна локальная БД с данными и
+pip install -r requirements-dev.txt для httpx):
+    python scripts/bench_async_db.py
+    python scripts/bench_async_db.py --concurrency 50 200 --requests 5000
+"""
+import argparse
+import asyncio
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+
+import httpx
+
+ROOT = os.path.join(os.path.dirname(__file__), "..")
+
+PATHS = [
+    "/doctors/search?limit=20",
+    "/doctors/search?limit=20&offset=20",
+    "/doctors/search?q=кардиолог&limit=20",
+    "/doctors/1/slots",
+    "/doctors/1/available-dates",
+    "/users/1/profile",
+    "/clients/1/appointments",
+]
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(async_db: bool, port: int) -> subprocess.Popen:
+    env = dict(os.environ, ASYNC_DB="true" if async_db else "false",
+               SEARCH_CACHE_SIZE="0", SPECIALIZATIONS_LISTEN="false")
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(port), "--log-level", "warning"],
+        cwd=ROOT, env=env,
+    )
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            if httpx.get(f"http://127.0.0.1:{port}/health").status_code == 200:
+                return proc
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    proc.terminate()
+    raise RuntimeError("uvicorn не поднялся за 30 секунд")
+
+
+async def load(base_url: str, concurrency: int, total: int):
+    latencies = []
+    errors = 0
+    counter = iter(range(total))
+
+    async def worker(client: httpx.AsyncClient):
+        nonlocal errors
+        for i in counter:
+            t0 = time.perf_counter()
+            r = await client.get(PATHS[i % len(PATHS)])
+            latencies.append(time.perf_counter() - t0)
+            if r.status_code >= 500:
+                errors += 1
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=60) as client:
+        for path in PATHS:  # прогрев пулов
+            await client.get(path)
+        t0 = time.perf_counter()
+        await asyncio.gather(*(worker(client) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - t0
+    return elapsed, latencies, errors
+
+
+def report(label: str, elapsed: float, latencies: list, errors: int) -> None:
+    latencies.sort()
+    p = lambda q: latencies[min(len(latencies) - 1, int(q * len(latencies)))] * 1000  # noqa: E731
+    print(f"  {label:<6} {len(latencies) / elapsed:>8.1f} req/s  "
+          f"p50={p(0.50):>7.1f} ms  p95={p(0.95):>7.1f} ms  p99={p(0.99):>7.1f} ms  "
+          f"mean={statistics.mean(latencies) * 1000:>7.1f} ms  errors={errors}")
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[10, 50, 100])
+    parser.add_argument("--requests", type=int, default=2000, help="запросов на каждый прогон")
+    args = parser.parse_args()
+
+    for async_db in (False, True):
+        label = "async" if async_db else "sync"
+        port = free_port()
+        proc = start_server(async_db, port)
+        try:
+            print(f"\n=== {label} (ASYNC_DB={'true' if async_db else 'false'}) ===")
+            for c in args.concurrency:
+                elapsed, latencies, errors = asyncio.run(load(f"http://127.0.0.1:{port}", c, args.requests))
+                report(f"c={c}", elapsed, latencies, errors)
+        finally:
+            proc.terminate()
+            proc.wait()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
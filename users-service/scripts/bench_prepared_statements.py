@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+Микробенчмарк выражений из реестра app/statements.py: стоимость одного вызова
+
+  text()  — text(sql) на каждый вызов (как было в репозитории);
+  clause  — text() скомпилирован один раз при импорте, Postgres разбирает SQL каждый раз;
+  prepare — PREPARE один раз на соединение, дальше EXECUTE <name>(...).
+
+Все варианты выполняются на одном соединении, в одной транзакции (только чтение),
+поэтому разница — это сборка запроса на клиенте и parse/plan на сервере.
+
+Запуск из корня users-service (нужна локальная БД с тестовыми данными):
+    python scripts/bench_prepared_statements.py
+    python scripts/bench_prepared_statements.py -n 5000
+"""
+import argparse
+import os
+import sys
+import time
+from datetime import date
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from app.db import engine  # noqa: E402
+from app import repository as repo  # noqa: E402
+from app.statements import REGISTRY, execute  # noqa: E402
+
+
+def sample_params(s: Session) -> dict:
+    """Параметры для выражений — по существующим строкам тестовых данных."""
+    user = s.execute(text("select id, email, login from users order by id limit 1")).mappings().first()
+    doctor = s.execute(text("select id, user_id from doctors order by id limit 1")).mappings().first()
+    client = s.execute(text("select id, user_id from clients order by id limit 1")).mappings().first()
+    if not (user and doctor and client):
+        raise SystemExit("нет тестовых данных: примените sql/016_test_data.sql")
+    day = date.today()
+    return {
+        "users_by_email": {"e": user["email"]},
+        "users_by_login": {"l": user["login"]},
+        "users_exists_by_email": {"e": user["email"]},
+        "users_exists_by_login": {"l": user["login"]},
+        "users_exists": {"id": user["id"]},
+        "users_avatar": {"id": user["id"]},
+        "users_profile": {"id": user["id"]},
+        "users_auth": {"v": user["login"]},
+        "clients_by_user": {"u": client["user_id"]},
+        "clients_by_id": {"cid": client["id"]},
+        "doctors_with_specs_by_id": {"id": doctor["id"]},
+        "doctors_with_specs_by_user": {"uid": doctor["user_id"]},
+        "slots_by_doctor": {"d": doctor["id"]},
+        "slots_by_doctor_day": {"d": doctor["id"], "day_start": day, "day_end": day},
+        "appointments_by_client": {"c": client["id"]},
+        "slots_available_dates": {"d": doctor["id"]},
+        "appointments_next_for_client": {"cid": client["id"]},
+        "appointments_by_doctor": {"d": doctor["id"]},
+        "chat_history": {"uid": user["id"], "lim": 10},
+    }
+
+
+def timed(n: int, call) -> float:
+    call()  # прогрев (и PREPARE для варианта prepare)
+    t0 = time.perf_counter()
+    for _ in range(n):
+        call()
+    return (time.perf_counter() - t0) / n * 1e6
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", type=int, default=2000, help="вызовов на выражение и вариант")
+    args = parser.parse_args()
+
+    assert repo  # реестр заполняется при импорте репозитория
+    with engine.connect() as conn:
+        s = Session(bind=conn)
+        params = sample_params(s)
+        print(f"{'statement':<30} {'text() µs':>10} {'clause µs':>10} {'prepare µs':>11} {'saved':>7}")
+        total_text = total_prepared = 0.0
+        for name, p in params.items():
+            stmt = REGISTRY[name]
+            t_text = timed(args.n, lambda: s.execute(text(stmt.sql), p).all())
+            t_clause = timed(args.n, lambda: s.execute(stmt.clause, p).all())
+            t_prep = timed(args.n, lambda: execute(s, stmt, p).all())
+            total_text += t_text
+            total_prepared += t_prep
+            print(f"{name:<30} {t_text:>10.1f} {t_clause:>10.1f} {t_prep:>11.1f} "
+                  f"{(1 - t_prep / t_text) * 100:>6.1f}%")
+        s.rollback()
+        print(f"\nв среднем: {total_text / len(params):.1f} µs -> {total_prepared / len(params):.1f} µs "
+              f"({(1 - total_prepared / total_text) * 100:.1f}% на вызов)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк сериализации больших списков: обычный путь FastAPI (response_model,
+валидация каждой строки Pydantic) против json_rows() из app/serialization.py
+(поля модели + orjson, без валидации).
+
+БД не нужна: строки синтетические, той же формы, что отдаёт репозиторий
+(list_users, list_appointments_for_doctor, история приёмов с отзывами).
+Для каждого набора поднимается маленькое FastAPI-приложение с двумя маршрутами,
+запросы идут через TestClient — в замер входит весь путь ответа, кроме сети.
+
+Запуск из корня users-service:
+    python scripts/bench_serialization.py
+    python scripts/bench_serialization.py --rows 1000 10000 50000 --repeat 10
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+from datetime import date, datetime, timedelta, timezone
+from typing import List
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+os.environ["FAST_JSON"] = "true"
+from app.main import _review_summary  # noqa: E402
+from app.models import AppointmentOut, AppointmentReviewSummary, UserOut  # noqa: E402
+from app.serialization import FAST_JSON, json_rows  # noqa: E402
+
+TZ = timezone(timedelta(hours=3))
+T0 = datetime(2025, 1, 1, 9, 0, tzinfo=TZ)
+
+
+def user_rows(n: int) -> List[dict]:
+    return [{
+        "id": i, "email": f"user{i}@example.com", "login": f"user{i}", "role": "CLIENT",
+        "patronymic": "Иванович", "phone_number": "+79990000000", "clinic_id": None,
+        "name": "Иван", "surname": f"Иванов{i}", "date_of_birth": date(1990, 1, 1) + timedelta(days=i % 9000),
+        "avatar": None, "gender": "MALE", "is_active": True, "email_verified_at": T0,
+        "password_changed_at": T0, "created_at": T0 + timedelta(minutes=i), "updated_at": T0 + timedelta(minutes=i),
+    } for i in range(1, n + 1)]
+
+
+def appointment_rows(n: int) -> List[dict]:
+    return [{
+        "id": i, "slot_id": i, "client_id": i % 500 + 1, "status": "BOOKED", "comments": "повторный приём",
+        "created_at": T0 + timedelta(minutes=i), "updated_at": T0 + timedelta(minutes=i),
+        "canceled_at": None, "completed_at": None, "appointment_type_id": None,
+    } for i in range(1, n + 1)]
+
+
+def history_rows(n: int) -> List[dict]:
+    rows = []
+    for i in range(1, n + 1):
+        reviewed = i % 2 == 0
+        rows.append({
+            "appointment_id": i, "status": "COMPLETED",
+            "slot_start": T0 + timedelta(hours=i), "slot_end": T0 + timedelta(hours=i, minutes=30),
+            "doctor_id": i % 50 + 1, "doctor_name": "Пётр", "doctor_surname": "Петров", "doctor_profession": "Терапевт",
+            "review_id": i if reviewed else None, "review_appointment_id": i if reviewed else None,
+            "review_doctor_id": i % 50 + 1 if reviewed else None, "review_client_id": 1 if reviewed else None,
+            "rating": 5 if reviewed else None, "comment": "Спасибо" if reviewed else None,
+            "review_created_at": T0 if reviewed else None, "review_updated_at": T0 if reviewed else None,
+        })
+    return rows
+
+
+DATASETS = [
+    ("users", UserOut, user_rows, None),
+    ("appointments", AppointmentOut, appointment_rows, None),
+    ("history", AppointmentReviewSummary, history_rows, _review_summary),
+]
+
+
+def build_app(rows: List[dict], model, shape) -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/pydantic", response_model=List[model])
+    def slow():
+        return [shape(r) for r in rows] if shape else [dict(r) for r in rows]
+
+    @app.get("/fast", response_model=List[model])
+    def fast():
+        return json_rows(map(shape, rows) if shape else rows, model)
+
+    return app
+
+
+def timed(client: TestClient, path: str, repeat: int):
+    client.get(path)  # прогрев
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        r = client.get(path)
+        times.append(time.perf_counter() - t0)
+    return statistics.median(times) * 1000, r.content
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, nargs="+", default=[1000, 10000])
+    parser.add_argument("--repeat", type=int, default=5, help="запросов на вариант (берётся медиана)")
+    args = parser.parse_args()
+    if not FAST_JSON:
+        raise SystemExit("orjson не установлен: pip install -r requirements.txt")
+
+    print(f"{'dataset':<14} {'rows':>6} {'pydantic ms':>12} {'fast ms':>9} {'speedup':>8} {'same JSON':>10}")
+    for name, model, make_rows, shape in DATASETS:
+        for n in args.rows:
+            with TestClient(build_app(make_rows(n), model, shape)) as client:
+                t_slow, body_slow = timed(client, "/pydantic", args.repeat)
+                t_fast, body_fast = timed(client, "/fast", args.repeat)
+            same = json.loads(body_slow) == json.loads(body_fast)
+            print(f"{name:<14} {n:>6} {t_slow:>12.1f} {t_fast:>9.1f} {t_slow / t_fast:>7.1f}x {str(same):>10}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
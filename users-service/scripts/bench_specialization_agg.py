@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк сборки specialization_names: коррелированный array(select ...) на строку
+против сгруппированного join / LATERAL-агрегата.
+
+Для 50 / 500 / 5000 врачей (досеиваются синтетические в транзакции, которая
+в конце откатывается — БД не меняется) печатает стоимость плана (EXPLAIN)
+и, с --analyze, фактическое время выполнения.
+
+Запуск из корня users-service:
+    python scripts/bench_specialization_agg.py
+    python scripts/bench_specialization_agg.py --analyze --sizes 50 500 5000 20000
+"""
+import argparse
+import json
+import os
+import sys
+
+from sqlalchemy import text
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from app.db import engine  # noqa: E402
+
+
+# Страница поиска в старом виде: названия специализаций — подзапрос на каждую строку
+PAGE_CORRELATED = """
+    select d.*, rs.rating, u.gender, c.city,
+           array(
+               select s2.name
+               from doctor_specializations ds2
+               join specializations s2 on s2.id = ds2.specialization_id
+               where ds2.doctor_id = d.id
+               order by s2.name
+           ) as specialization_names
+    from doctors d
+    join users u on u.id = d.user_id
+    join doctor_rating_stats rs on rs.doctor_id = d.id
+    left join clinics c on c.id = d.clinic_id
+    order by rs.rating desc, d.price asc nulls last, d.id
+    limit 20
+"""
+
+# Та же страница: названия собираются одним сгруппированным join'ом
+PAGE_GROUPED = """
+    select d.*, rs.rating, u.gender, c.city,
+           coalesce(sp.names, array[]::varchar[]) as specialization_names
+    from doctors d
+    join users u on u.id = d.user_id
+    join doctor_rating_stats rs on rs.doctor_id = d.id
+    left join clinics c on c.id = d.clinic_id
+    left join (
+        select ds.doctor_id, array_agg(s.name order by s.name)::varchar[] as names
+        from doctor_specializations ds
+        join specializations s on s.id = ds.specialization_id
+        group by ds.doctor_id
+    ) sp on sp.doctor_id = d.id
+    order by rs.rating desc, d.price asc nulls last, d.id
+    limit 20
+"""
+
+# Сначала страница, затем один сгруппированный join только по её врачам
+PAGE_GROUPED_AFTER_LIMIT = """
+    with page as (
+        select d.id, d.user_id, d.profession, d.price, rs.rating, u.gender, c.city
+        from doctors d
+        join users u on u.id = d.user_id
+        join doctor_rating_stats rs on rs.doctor_id = d.id
+        left join clinics c on c.id = d.clinic_id
+        order by rs.rating desc, d.price asc nulls last, d.id
+        limit 20
+    )
+    select page.*, coalesce(sp.names, array[]::varchar[]) as specialization_names
+    from page
+    left join (
+        select ds.doctor_id, array_agg(s.name order by s.name)::varchar[] as names
+        from doctor_specializations ds
+        join specializations s on s.id = ds.specialization_id
+        where ds.doctor_id in (select id from page)
+        group by ds.doctor_id
+    ) sp on sp.doctor_id = page.id
+    order by page.rating desc, page.price asc nulls last, page.id
+"""
+
+# Текущий поиск: названия уже лежат в doctor_search_index
+PAGE_SEARCH_INDEX = """
+    select dsi.*
+    from doctor_search_index dsi
+    order by dsi.rating desc, dsi.price asc nulls last, dsi.doctor_id
+    limit 20
+"""
+
+# Полная выборка (пересборка read-модели): старый и новый вид источника
+FULL_CORRELATED = """
+    select d.id,
+           array(select ds.specialization_id from doctor_specializations ds
+                 where ds.doctor_id = d.id order by ds.specialization_id) as ids,
+           array(select s.name from doctor_specializations ds
+                 join specializations s on s.id = ds.specialization_id
+                 where ds.doctor_id = d.id order by s.name) as names
+    from doctors d
+"""
+
+FULL_GROUPED = "select * from doctor_search_source"
+
+# Профиль врача: LATERAL-агрегат по одному врачу
+PROFILE_LATERAL = """
+    select d.*, sp.ids, sp.names
+    from doctors d
+    cross join lateral (
+        select array_agg(ds.specialization_id order by ds.specialization_id) as ids,
+               array_agg(s.name order by s.name) as names
+        from doctor_specializations ds
+        join specializations s on s.id = ds.specialization_id
+        where ds.doctor_id = d.id
+    ) sp
+    where d.id = (select max(id) from doctors)
+"""
+
+QUERIES = [
+    ("page: correlated", PAGE_CORRELATED),
+    ("page: grouped join", PAGE_GROUPED),
+    ("page: grouped after limit", PAGE_GROUPED_AFTER_LIMIT),
+    ("page: doctor_search_index", PAGE_SEARCH_INDEX),
+    ("full: correlated", FULL_CORRELATED),
+    ("full: grouped (view)", FULL_GROUPED),
+    ("profile: lateral", PROFILE_LATERAL),
+]
+
+SEED_SQL = """
+    with new_users as (
+        insert into users(email, login, password_hash, role, name, surname, gender, date_of_birth)
+        select 'bench_' || g || '@bench.local', 'bench_' || g, 'x', 'DOCTOR',
+               'Бенч', 'Врач' || g,
+               case when g % 2 = 0 then 'MALE' else 'FEMALE' end,
+               date '1960-01-01' + (g % 12000)
+        from generate_series(:start, :stop) g
+        returning id
+    ),
+    new_doctors as (
+        insert into doctors(user_id, clinic_id, profession, experience, price, online_available)
+        select u.id,
+               (select id from clinics order by id offset (u.id % greatest((select count(*) from clinics), 1)) limit 1),
+               'Врач', (u.id % 40)::int, 1000 + (u.id % 50) * 100, u.id % 3 = 0
+        from new_users u
+        returning id
+    )
+    insert into doctor_specializations(doctor_id, specialization_id)
+    select distinct d.id, sp.id
+    from new_doctors d
+    cross join lateral (
+        select id from specializations
+        order by md5(d.id::text || id::text)
+        limit 1 + (d.id % 3)::int
+    ) sp
+"""
+
+
+def explain(conn, sql: str, analyze: bool) -> str:
+    opts = "format json, analyze, buffers" if analyze else "format json"
+    plan = conn.execute(text(f"explain ({opts}) {sql}")).scalar()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    top = plan[0]
+    cost = top["Plan"]["Total Cost"]
+    out = f"cost={cost:>10.1f}"
+    if analyze:
+        out += f"  time={top['Execution Time']:>9.2f} ms"
+    return out
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[50, 500, 5000])
+    parser.add_argument("--analyze", action="store_true", help="EXPLAIN ANALYZE (реальное выполнение)")
+    args = parser.parse_args()
+
+    conn = engine.connect()
+    trans = conn.begin()
+    try:
+        seeded = 0
+        for size in sorted(args.sizes):
+            existing = conn.execute(text("select count(*) from doctors")).scalar()
+            need = size - existing
+            if need > 0:
+                conn.execute(text(SEED_SQL), {"start": seeded + 1, "stop": seeded + need})
+                seeded += need
+            conn.execute(text("analyze doctors; analyze users; analyze doctor_specializations; "
+                              "analyze doctor_rating_stats; analyze doctor_search_index"))
+            total = conn.execute(text("select count(*) from doctors")).scalar()
+
+            print(f"\n=== {total} врачей ===")
+            for name, sql in QUERIES:
+                print(f"  {name:<28} {explain(conn, sql, args.analyze)}")
+    finally:
+        trans.rollback()
+        conn.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
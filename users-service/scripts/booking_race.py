@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+"""
+Гонка за один слот: сотни одновременных записей на один и тот же свободный слот.
+
+Для каждого из --slots новых слотов (день далеко в будущем у первого врача) две фазы:
+  free   — слот свободен, записи ещё не было (ветка insert);
+  rebook — запись победителя отменена, слот снова свободен (ветка переиспользования
+           отменённой записи, appointments.slot_id уникален).
+В каждой фазе --attempts попыток записи разными клиентами в --workers потоков,
+потоки стартуют одновременно (Barrier). После фазы в БД проверяется: ровно одна
+запись BOOKED, слот is_booked, остальные попытки получили «слот занят» (409).
+
+По умолчанию попытки идут напрямую через repo.book_appointment (своё соединение на
+поток); с --base-url — POST /appointments в работающий сервис.
+
+Запуск из корня users-service (нужна локальная БД с тестовыми данными и
+pip install -r requirements-dev.txt для httpx):
+    python scripts/booking_race.py
+    python scripts/booking_race.py --slots 10 --attempts 500 --workers 80
+    python scripts/booking_race.py --base-url http://127.0.0.1:8001
+
+Код выхода 1, если на слот записалось не ровно одно обращение или были ошибки.
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+from typing import Callable, List
+
+import httpx
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import sessionmaker
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from app import repository as repo  # noqa: E402
+from app.db import DATABASE_URL  # noqa: E402
+from app.models import AppointmentIn  # noqa: E402
+
+
+def repo_attempt(Session) -> Callable[[int, int], str]:
+    def attempt(slot_id: int, client_id: int) -> str:
+        s = Session()
+        try:
+            repo.book_appointment(s, AppointmentIn(slot_id=slot_id, client_id=client_id))
+            return "201"
+        except ValueError as ve:
+            return "404" if str(ve) == "slot_not_found" else "409"
+        except Exception as e:
+            return type(e).__name__
+        finally:
+            s.close()
+    return attempt
+
+
+def api_attempt(client: httpx.Client) -> Callable[[int, int], str]:
+    def attempt(slot_id: int, client_id: int) -> str:
+        try:
+            return str(client.post("/appointments", json={"slot_id": slot_id, "client_id": client_id}).status_code)
+        except httpx.HTTPError as e:
+            return type(e).__name__
+    return attempt
+
+
+def race(attempt, slot_id: int, clients: List[int], attempts: int, workers: int) -> Counter:
+    """attempts попыток записи на slot_id в workers потоков, старт одновременный."""
+    barrier = threading.Barrier(workers)
+    shares = [range(w, attempts, workers) for w in range(workers)]
+
+    def worker(share) -> Counter:
+        out = Counter()
+        barrier.wait()
+        for i in share:
+            out[attempt(slot_id, clients[i % len(clients)])] += 1
+        return out
+
+    total = Counter()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for c in pool.map(worker, shares):
+            total += c
+    return total
+
+
+def check(conn, slot_id: int, outcomes: Counter) -> List[str]:
+    """Нарушения инварианта «ровно одна запись на слот»; пустой список — всё в порядке."""
+    booked, is_booked = conn.execute(text("""
+        select (select count(*) from appointments where slot_id = :s and status = 'BOOKED'),
+               (select is_booked from appointment_slots where id = :s)
+    """), {"s": slot_id}).first()
+    problems = []
+    if outcomes["201"] != 1:
+        problems.append(f"успешных записей {outcomes['201']}, ожидалась 1")
+    if booked != 1:
+        problems.append(f"в БД {booked} записей BOOKED")
+    if not is_booked:
+        problems.append("слот не помечен занятым")
+    unexpected = {k: v for k, v in outcomes.items() if k not in ("201", "409")}
+    if unexpected:
+        problems.append(f"неожиданные ответы {unexpected}")
+    return problems
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--slots", type=int, default=5, help="сколько слотов разыграть")
+    parser.add_argument("--attempts", type=int, default=300, help="попыток записи на слот в каждой фазе")
+    parser.add_argument("--workers", type=int, default=50, help="параллельных потоков")
+    parser.add_argument("--base-url", default=None, help="гонять через HTTP API, а не через репозиторий")
+    args = parser.parse_args()
+
+    engine = create_engine(DATABASE_URL, pool_size=args.workers, max_overflow=0)
+    Session = sessionmaker(bind=engine, autoflush=False, autocommit=False)
+    http = None
+    if args.base_url:
+        http = httpx.Client(base_url=args.base_url, timeout=30,
+                            limits=httpx.Limits(max_connections=args.workers))
+        attempt = api_attempt(http)
+    else:
+        attempt = repo_attempt(Session)
+
+    with engine.begin() as conn:
+        doctor_id = conn.execute(text("select min(id) from doctors")).scalar()
+        clients = [r[0] for r in conn.execute(text("select id from clients order by id limit 100"))]
+        if doctor_id is None or not clients:
+            raise SystemExit("нет тестовых данных: примените sql/016_test_data.sql")
+        # день далеко в будущем, чтобы не пересекаться с расписанием и прошлыми прогонами
+        start = datetime.combine(date.today() + timedelta(days=700), datetime.min.time())
+        slots = [conn.execute(text("""
+            insert into appointment_slots (doctor_id, start_time, end_time)
+            values (:d, :st, :st + interval '30 minutes') returning id
+        """), {"d": doctor_id, "st": start + timedelta(minutes=30 * i)}).scalar() for i in range(args.slots)]
+
+    print(f"🏁 {args.slots} слот(ов) × {args.attempts} попыток в {args.workers} потоков "
+          f"({'API ' + args.base_url if http else 'репозиторий'})")
+    failed = 0
+    try:
+        for slot_id in slots:
+            for phase in ("free", "rebook"):
+                if phase == "rebook":
+                    with engine.begin() as conn:
+                        winner = conn.execute(text(
+                            "select id from appointments where slot_id = :s and status = 'BOOKED'"), {"s": slot_id}
+                        ).scalar()
+                    s = Session()
+                    try:
+                        repo.cancel_appointment(s, winner)
+                    finally:
+                        s.close()
+                t0 = time.perf_counter()
+                outcomes = race(attempt, slot_id, clients, args.attempts, args.workers)
+                took = (time.perf_counter() - t0) * 1000
+                with engine.connect() as conn:
+                    problems = check(conn, slot_id, outcomes)
+                status = "✅" if not problems else "❌"
+                print(f"{status} slot {slot_id} {phase:<6} {dict(outcomes)}  {took:.0f} мс"
+                      + (f"  — {'; '.join(problems)}" if problems else ""))
+                failed += bool(problems)
+                if problems and phase == "free":
+                    break
+    finally:
+        with engine.begin() as conn:
+            conn.execute(text("delete from appointment_slots where id = any(:ids)"), {"ids": slots})
+        if http:
+            http.close()
+        engine.dispose()
+
+    if failed:
+        print(f"\n{failed} фаз(ы) нарушили «одна запись на слот»")
+        return 1
+    print("\nГонок нет: на каждый слот ровно одна запись")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+Проверка бюджетов запросов к БД: каждый GET-маршрут с @query_budget(n) вызывается
+через TestClient с DB_QUERY_BUDGET_STRICT=true и id существующих строк (и с
+параметрами из ROUTE_PARAMS — ветками, которые добавляют запросы). Превышение
+бюджета приходит как 500 с "query budget exceeded", число запросов — из X-DB-Queries.
+Изменяющие маршруты с бюджетом скрипт не вызывает (только перечисляет).
+
+Запуск из корня users-service (нужна локальная БД с тестовыми данными):
+    python scripts/check_query_budgets.py
+
+Код выхода 1, если хотя бы один маршрут превысил бюджет или упал.
+"""
+import os
+import re
+import sys
+
+os.environ["DB_QUERY_BUDGET_STRICT"] = "true"
+os.environ.setdefault("SPECIALIZATIONS_LISTEN", "false")
+os.environ.setdefault("SEARCH_CACHE_SIZE", "0")  # попадание в кэш дало бы 0 запросов
+
+from fastapi.routing import APIRoute  # noqa: E402
+from fastapi.testclient import TestClient  # noqa: E402
+from sqlalchemy import text  # noqa: E402
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from app.db import engine  # noqa: E402
+from app.instrumentation import budget_of  # noqa: E402
+from app.main import app  # noqa: E402
+
+SAMPLE_SQL = {
+    "user_id": "select min(id) from users",
+    "client_id": "select min(id) from clients",
+    "doctor_id": "select min(id) from doctors",
+}
+
+# дополнительные вызовы маршрута с параметрами, кроме вызова без параметров
+ROUTE_PARAMS = {
+    "/doctors/search": [{"q": "Кардиолог"}, {"q": "кардиалог Иванова"}],
+    "/doctors/search/facets": [{"q": "Кардиолог"}, {"q": "кардиалог Иванова"}],
+}
+
+
+def main() -> int:
+    with engine.connect() as conn:
+        samples = {k: conn.execute(text(sql)).scalar() for k, sql in SAMPLE_SQL.items()}
+
+    failed = 0
+    with TestClient(app) as client:
+        for route in app.routes:
+            if not isinstance(route, APIRoute):
+                continue
+            budget = budget_of(route.endpoint)
+            if budget is None:
+                continue
+            if "GET" not in route.methods:
+                print(f"·  {','.join(sorted(route.methods))} {route.path}: бюджет {budget} (не вызывается)")
+                continue
+            params = re.findall(r"{(\w+)}", route.path)
+            if any(samples.get(p) is None for p in params):
+                print(f"·  GET {route.path}: нет данных для {params}")
+                continue
+            path = route.path.format(**{p: samples[p] for p in params})
+            for query in [{}] + ROUTE_PARAMS.get(route.path, []):
+                r = client.get(path, params=query)
+                shown = path + ("?" + "&".join(f"{k}={v}" for k, v in query.items()) if query else "")
+                queries = r.headers.get("X-DB-Queries", "?")
+                if r.status_code >= 500:
+                    failed += 1
+                    print(f"❌ GET {shown}: {queries} > {budget} ({r.json().get('detail', r.status_code)})")
+                else:
+                    print(f"✅ GET {shown}: {queries} из {budget}")
+
+    if failed:
+        print(f"\n{failed} маршрут(ов) превысили бюджет")
+        return 1
+    print("\nВсе маршруты укладываются в бюджет")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+"""
+Проверка планов горячих запросов репозитория: ни один не должен уходить в Seq Scan.
+
+Скрипт досеивает синтетические данные (врачи, слоты) в транзакции, вызывает
+функции app.repository, перехватывает их SQL через события SQLAlchemy и
+прогоняет EXPLAIN с enable_seqscan = off. Если для запроса нет пригодного
+индекса, планировщик всё равно выберет Seq Scan. Кроме того, для каждого запроса
+задано, какие колонки обязаны попасть в условие индекса: фильтр вида
+date(start_time) = :dt не даёт Seq Scan (хватает префикса doctor_id), но
+остаётся в Filter — это тоже регрессия. В конце транзакция откатывается.
+
+Запуск из корня users-service (нужна локальная БД с применёнными миграциями):
+    python scripts/check_query_plans.py
+    python scripts/check_query_plans.py -v   # печатать планы
+
+Код выхода 1, если хотя бы один запрос регрессировал.
+"""
+import argparse
+import json
+import os
+import re
+import sys
+from datetime import date, timedelta
+
+from sqlalchemy import event, text
+from sqlalchemy.orm import Session
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from app.db import engine  # noqa: E402
+from app import repository as repo  # noqa: E402
+
+SEED_DOCTORS = 100
+SEED_DAYS = 120
+SLOTS_PER_DAY = 12
+
+SEED_CLINICS = 20
+
+SEED_SQL = """
+    with new_clinics as (
+        insert into clinics(name, city, latitude, longitude)
+        select 'План-клиника ' || g, 'Санкт-Петербург',
+               59.80 + (g * 7 % 40) * 0.01, 30.10 + (g * 11 % 50) * 0.01
+        from generate_series(1, :clinics) g
+        returning id
+    ),
+    new_users as (
+        insert into users(email, login, password_hash, role, name, surname, gender, date_of_birth)
+        select 'plan_' || g || '@plans.local', 'plan_' || g, 'x', 'DOCTOR',
+               'План', 'Врач' || g,
+               case when g % 2 = 0 then 'MALE' else 'FEMALE' end,
+               date '1960-01-01' + (g * 37 % 15000)
+        from generate_series(1, :n) g
+        returning id
+    ),
+    new_doctors as (
+        insert into doctors(user_id, clinic_id, profession, experience, price, online_available)
+        select u.id,
+               (select min(id) from new_clinics) + (u.id % :clinics),
+               'Врач', (u.id % 40)::int, 1000 + (u.id % 50) * 100, u.id % 3 = 0
+        from new_users u
+        returning id
+    ),
+    new_specs as (
+        insert into doctor_specializations(doctor_id, specialization_id)
+        select d.id, (select min(id) from specializations) + (d.id % 5)::int
+        from new_doctors d
+    )
+    insert into appointment_slots(doctor_id, start_time, end_time, is_booked)
+    select d.id,
+           current_date + day + make_interval(hours => 9 + h),
+           current_date + day + make_interval(hours => 10 + h),
+           (d.id + day + h) % 4 = 0
+    from new_doctors d
+    cross join generate_series(0, :days - 1) day
+    cross join generate_series(0, :per_day - 1) h
+"""
+
+
+def cases(s: Session, doctor_id: int, day: date, spec_id: int):
+    """
+    (название, вызов, колонки) — каждый вызов исполняет ровно те запросы, что и API;
+    каждая из перечисленных колонок должна попасть в Index Cond, а не в Filter
+    (колонка может быть с оператором: "rating <=" — нужна именно граница диапазона).
+    """
+    return [
+        ("list_users(role, after_id, limit)",
+         lambda: repo.list_users(s, role="ADMIN", after_id=0, limit=50),
+         ["role"]),
+        ("list_slots_for_doctor(date)",
+         lambda: repo.list_slots_for_doctor(s, doctor_id, slot_date=day),
+         ["start_time"]),
+        ("list_available_dates_for_doctor",
+         lambda: repo.list_available_dates_for_doctor(s, doctor_id),
+         ["doctor_id"]),
+        ("list_availability_for_doctors(окно дат)",
+         lambda: repo.list_availability_for_doctors(s, [doctor_id, doctor_id - 1], day, day + timedelta(days=13)),
+         ["day"]),
+        ("list_earliest_slots(specialization_id, city)",
+         lambda: repo.list_earliest_slots(s, specialization_id=spec_id, city="Санкт-Петербург", limit=10),
+         ["start_time", "city|specialization_ids"]),
+        ("search_doctors(date_filter)",
+         lambda: repo.search_doctors(s, date_filter=day),
+         ["day"]),
+        ("search_doctors(cursor)",
+         lambda: repo.search_doctors(s, cursor=repo.encode_search_cursor({"rating": 0.0, "price": 3000, "id": doctor_id})),
+         ["rating <="]),
+        ("search_doctors(min_age, max_age)",
+         lambda: repo.search_doctors(s, min_age=30, max_age=45),
+         ["date_of_birth"]),
+        ("search_doctors(specialization_ids)",
+         lambda: repo.search_doctors(s, specialization_ids=[spec_id]),
+         ["specialization_ids"]),
+        ("search_doctors(min_price, min_experience)",
+         lambda: repo.search_doctors(s, min_price=3000, min_experience=20),
+         ["price|experience"]),
+        ("search_doctors(q)",
+         lambda: repo.search_doctors(s, q="Врач17"),
+         ["search_vector"]),
+        ("search_doctors(q с опечаткой)",
+         lambda: repo.search_doctors(s, q="Врач17З"),
+         ["search_text"]),
+        ("search_doctors(near, date_filter, specialization_ids)",
+         lambda: repo.search_doctors(s, near=(59.95, 30.30), radius_km=5, date_filter=day,
+                                     specialization_ids=[spec_id], sort="distance"),
+         ["location", "day"]),
+    ]
+
+
+def walk(plan: dict):
+    yield plan
+    for child in plan.get("Plans", []):
+        yield from walk(child)
+
+
+def check_plans(roots: list, columns: list) -> list:
+    """
+    Список проблем планов одного вызова: Seq Scan в любом запросе и колонки,
+    не попавшие в условие индекса ни одного из запросов.
+    """
+    problems = []
+    index_conds = []
+    for root in roots:
+        for node in walk(root):
+            if node.get("Node Type") == "Seq Scan":
+                problems.append(f"Seq Scan по {node.get('Relation Name')}")
+            for key in ("Index Cond", "Recheck Cond"):
+                if key in node:
+                    index_conds.append(node[key])
+    for col in columns:
+        if not any(re.search(rf"(?<!\w)({col})(?!\w)", cond) for cond in index_conds):
+            problems.append(f"{col} не в Index Cond")
+    return problems
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-v", "--verbose", action="store_true", help="печатать планы")
+    args = parser.parse_args()
+
+    conn = engine.connect()
+    trans = conn.begin()
+    captured = []
+
+    def capture(_conn, _cursor, statement, parameters, _context, _executemany):
+        # только чтения из таблиц (без savepoint'ов и select set_config(...))
+        # и вызовы подготовленных выражений из app/statements.py (explain execute ...)
+        sql = statement.lstrip().lower()
+        if (sql.startswith("select") and " from " in sql) or sql.startswith("execute "):
+            captured.append((statement, parameters))
+
+    try:
+        conn.execute(text(SEED_SQL), {"n": SEED_DOCTORS, "clinics": SEED_CLINICS,
+                                       "days": SEED_DAYS, "per_day": SLOTS_PER_DAY})
+        conn.execute(text("analyze clinics; analyze users; analyze doctors; analyze doctor_specializations; "
+                          "analyze appointment_slots; analyze doctor_search_index; analyze doctor_free_slot_days"))
+        doctor_id = conn.execute(text("select max(id) from doctors")).scalar()
+        spec_id = conn.execute(text("select min(id) from specializations")).scalar()
+        day = date.today() + timedelta(days=3)
+
+        s = Session(bind=conn, join_transaction_mode="create_savepoint")
+        failed = 0
+        for name, call, columns in cases(s, doctor_id, day, spec_id):
+            captured.clear()
+            event.listen(conn, "before_cursor_execute", capture)
+            try:
+                call()
+            finally:
+                event.remove(conn, "before_cursor_execute", capture)
+
+            conn.exec_driver_sql("set local enable_seqscan = off")
+            roots = []
+            for statement, parameters in captured:
+                plan = conn.exec_driver_sql("explain (format json) " + statement, parameters).scalar()
+                if isinstance(plan, str):
+                    plan = json.loads(plan)
+                roots.append(plan[0]["Plan"])
+                if args.verbose:
+                    print(json.dumps(plan[0]["Plan"], ensure_ascii=False, indent=2))
+            conn.exec_driver_sql("set local enable_seqscan = on")
+            problems = check_plans(roots, columns)
+
+            if problems:
+                failed += 1
+                print(f"❌ {name}: {'; '.join(problems)}")
+            else:
+                print(f"✅ {name}")
+        s.close()
+    finally:
+        trans.rollback()
+        conn.close()
+
+    if failed:
+        print(f"\n{failed} запрос(ов) не используют индексы")
+        return 1
+    print("\nВсе запросы используют индексы")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
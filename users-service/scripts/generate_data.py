@@ -0,0 +1,560 @@
+#!/usr/bin/env python3
+"""
+Генератор синтетических данных большого объёма: клиники, клиенты, врачи со
+специализациями, слоты, записи, отзывы и чат-сессии с длинной историей.
+sql/016_test_data.sql даёт 46 пользователей — на таком объёме не видно ни
+проблем поиска врачей, ни списков пациентов, ни запросов по слотам.
+
+Строки генерируются потоком и грузятся через COPY (psycopg2 copy_expert) в одной
+транзакции с session_replication_role = replica: триггеры (updated_at, поисковый
+индекс, агрегаты рейтинга и свободных дней) и проверки внешних ключей на время
+загрузки выключены.
+После загрузки:
+  - вторичные индексы больших таблиц (BULK_TABLES), снятые перед загрузкой,
+    строятся заново — один проход сортировки вместо вставки в каждый индекс;
+  - rebuild_doctor_rating_stats(), rebuild_doctor_search_index() и
+    rebuild_doctor_free_slot_days();
+  - setval() последовательностей на max(id);
+  - VACUUM ANALYZE загруженных таблиц.
+
+Распределения:
+  - популярные специализации (specializations.is_popular) встречаются в 4 раза чаще;
+  - клиники и клиенты выбираются со смещением (крупные клиники, частые пациенты);
+  - у врача «популярность» (доля занятых слотов) и «качество» (средняя оценка),
+    оценки смещены к 4–5;
+  - расписание: FUTURE_SHARE слотов врача — вперёд от сегодня, остальное — история;
+    прошедшие слоты заняты заметно чаще будущих, будущие тем реже, чем дальше;
+  - прошедшие записи — COMPLETED / NO_SHOW / CANCELED (слот отменённой свободен),
+    будущие — BOOKED; отзывы только к COMPLETED.
+
+Id выдаются после текущего max(id), поэтому генератор можно запускать поверх
+существующих данных. Пароль у всех сгенерированных пользователей один
+(--password), почта gen<id>@example.com.
+
+Нужна роль с правом менять session_replication_role (суперпользователь).
+
+Запуск из корня users-service:
+    python scripts/generate_data.py --preset small
+    python scripts/generate_data.py --preset large          # 200k клиентов, 20k врачей, 20M слотов
+    python scripts/generate_data.py --preset small --slots 1000000 --chat-sessions 0
+"""
+import argparse
+import csv
+import io
+import json
+import math
+import os
+import random
+import sys
+import tempfile
+import time
+import uuid
+from datetime import date, datetime, timedelta
+from typing import Dict, Iterable, List, Sequence, Tuple
+
+from passlib.hash import bcrypt
+from sqlalchemy import text
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from app.db import engine  # noqa: E402
+
+PRESETS = {
+    "small": dict(clinics=10, clients=2_000, doctors=200, slots=200_000, appointments=50_000,
+                  reviews=20_000, doctor_reviews=2_000, chat_sessions=200, chat_messages=100),
+    "medium": dict(clinics=30, clients=50_000, doctors=5_000, slots=3_000_000, appointments=750_000,
+                   reviews=300_000, doctor_reviews=30_000, chat_sessions=2_000, chat_messages=200),
+    "large": dict(clinics=50, clients=200_000, doctors=20_000, slots=20_000_000, appointments=5_000_000,
+                  reviews=2_000_000, doctor_reviews=200_000, chat_sessions=10_000, chat_messages=200),
+}
+
+FUTURE_SHARE = 0.2         # доля слотов врача в будущем, остальное — история
+POPULAR_WEIGHT = 4         # во сколько раз чаще популярные специализации
+FUTURE_DECAY_DAYS = 10     # будущий слот на d дней вперёд занят с весом exp(-d / 10)
+COPY_CHUNK_BYTES = 256 * 1024
+
+# (город, регион, широта, долгота, вес, станции метро)
+CITIES = [
+    ("Санкт-Петербург", "Ленинградская область", 59.9343, 30.3351, 5,
+     ["Площадь Восстания", "Маяковская", "Технологический институт", "Невский проспект",
+      "Петроградская", "Василеостровская", "Московская", "Приморская", "Чёрная речка", "Ладожская"]),
+    ("Москва", "Московская область", 55.7558, 37.6173, 4,
+     ["Тверская", "Арбатская", "Курская", "Белорусская", "Таганская", "Сокол",
+      "Профсоюзная", "Новослободская", "Полежаевская", "Бауманская"]),
+    ("Казань", "Республика Татарстан", 55.7961, 49.1064, 1, ["Кремлёвская", "Площадь Тукая", "Суконная слобода"]),
+    ("Новосибирск", "Новосибирская область", 55.0084, 82.9357, 1, ["Красный проспект", "Площадь Ленина"]),
+    ("Екатеринбург", "Свердловская область", 56.8389, 60.6057, 1, ["Площадь 1905 года", "Динамо", "Геологическая"]),
+]
+CLINIC_WORDS = ["Здоровье", "МедСервис", "ПроМед", "Семейный доктор", "Медицина", "Авиценна",
+                "Доктор рядом", "Медлайн", "Альфа-Мед"]
+STREETS = ["ул. Ленина", "Невский пр.", "ул. Садовая", "пр. Мира", "ул. Гагарина", "ул. Пушкина",
+           "Московский пр.", "ул. Советская", "наб. реки Фонтанки", "ул. Лесная"]
+
+MALE_NAMES = ["Александр", "Дмитрий", "Максим", "Сергей", "Андрей", "Алексей", "Иван", "Михаил", "Павел", "Николай"]
+FEMALE_NAMES = ["Анна", "Мария", "Елена", "Ольга", "Наталья", "Татьяна", "Ирина", "Екатерина", "Светлана", "Юлия"]
+SURNAMES = ["Иванов", "Смирнов", "Кузнецов", "Попов", "Васильев", "Петров", "Соколов", "Михайлов",
+            "Новиков", "Фёдоров", "Морозов", "Волков", "Алексеев", "Лебедев", "Семёнов", "Егоров"]
+PATRONYMICS = ["Александров", "Дмитриев", "Сергеев", "Андреев", "Иванов", "Михайлов", "Петров", "Николаев"]
+BLOOD_TYPES = ["O+", "O-", "A+", "A-", "B+", "B-", "AB+", "AB-"]
+BLOOD_WEIGHTS = [35, 7, 30, 6, 13, 3, 5, 1]
+DURATIONS = [20, 30, 30, 30, 45, 60]
+
+APPOINTMENT_COMMENTS = [None, None, None, "Повторный приём", "Первичная консультация",
+                        "Боли в спине", "Плановый осмотр", "Контроль анализов"]
+REVIEW_COMMENTS = {
+    5: ["Отличный врач, всё объяснил", "Очень внимательный специалист", "Рекомендую!"],
+    4: ["Хороший приём, но пришлось подождать", "В целом доволен"],
+    3: ["Нормально", "Приём прошёл быстро, хотелось бы подробнее"],
+    2: ["Не всё объяснили", "Долго ждал приёма"],
+    1: ["Не рекомендую", "Приём отменили в последний момент"],
+}
+CHAT_QUESTIONS = ["У меня болит голова третий день, к какому врачу записаться?",
+                  "Что делать при температуре 38?", "Как подготовиться к анализу крови?",
+                  "Болит горло и заложен нос, это простуда?", "Можно ли заниматься спортом после ОРВИ?"]
+CHAT_ANSWERS = ["Я не могу поставить диагноз, но рекомендую обратиться к терапевту.",
+                "Пейте больше жидкости и отдыхайте; если температура держится больше трёх дней — к врачу.",
+                "Анализ крови сдают натощак, за сутки лучше исключить жирную пищу и алкоголь.",
+                "Похоже на ОРВИ. Если станет хуже — запишитесь к терапевту или отоларингологу."]
+
+SESSION_SETUP = "set session_replication_role = replica; set maintenance_work_mem = '512MB'"
+# Вторичные индексы этих таблиц на время загрузки снимаются и строятся заново
+# (индексы ограничений — pkey/unique — остаются).
+BULK_TABLES = ["appointment_slots", "appointments", "appointment_reviews", "doctor_reviews", "chat_sessions"]
+
+
+class CsvStream(io.RawIOBase):
+    """Файлоподобная обёртка над итератором строк-кортежей для copy_expert: CSV по кускам."""
+
+    def __init__(self, rows: Iterable[Sequence]):
+        self._rows = iter(rows)
+        self._buf = io.StringIO()
+        self._writer = csv.writer(self._buf, lineterminator="\n")
+        self._pending = b""
+
+    def readable(self) -> bool:
+        return True
+
+    def read(self, size: int = -1) -> bytes:
+        want = COPY_CHUNK_BYTES if size is None or size < 0 else max(size, COPY_CHUNK_BYTES)
+        while len(self._pending) < want:
+            batch = []
+            for row in self._rows:
+                batch.append(row)
+                if len(batch) >= 2000:
+                    break
+            if not batch:
+                break
+            self._writer.writerows(batch)
+            self._pending += self._buf.getvalue().encode()
+            self._buf.seek(0)
+            self._buf.truncate()
+        out, self._pending = self._pending[:want], self._pending[want:]
+        return out
+
+
+class Spool:
+    """Строки, которые появляются при генерации другой таблицы: копятся во временном CSV."""
+
+    def __init__(self):
+        self.file = io.TextIOWrapper(tempfile.TemporaryFile(), encoding="utf-8", newline="")
+        self.writer = csv.writer(self.file, lineterminator="\n")
+
+    def add(self, row: Sequence) -> None:
+        self.writer.writerow(row)
+
+    def rewind(self):
+        self.file.flush()
+        raw = self.file.detach()
+        raw.seek(0)
+        return raw
+
+
+def skewed(rnd: random.Random, n: int, power: float = 2.0) -> int:
+    """Индекс 0..n-1 с перекосом к началу: чем больше power, тем сильнее."""
+    return min(n - 1, int(n * rnd.random() ** power))
+
+
+def ts(dt: datetime) -> str:
+    return dt.isoformat(" ", "seconds")
+
+
+# "HH:MM:00" по минуте суток — строки слотов собираются без datetime
+CLOCK = [f"{m // 60:02d}:{m % 60:02d}:00" for m in range(24 * 60)]
+
+
+class Generator:
+    def __init__(self, conn, args):
+        self.conn = conn
+        self.cur = conn.cursor()
+        self.args = args
+        self.rnd = random.Random(args.seed)
+        self.now = datetime.now().replace(microsecond=0)
+        self.today = self.now.date()
+        self.password_hash = bcrypt.hash(args.password)
+        self.stats: List[Tuple[str, int, float]] = []
+
+    # --- служебное -------------------------------------------------------
+
+    def max_id(self, table: str) -> int:
+        self.cur.execute(f"select coalesce(max(id), 0) from {table}")
+        return self.cur.fetchone()[0]
+
+    def copy(self, table: str, columns: str, source) -> int:
+        t0 = time.perf_counter()
+        stream = source if hasattr(source, "read") else CsvStream(source)
+        self.cur.copy_expert(f"copy {table} ({columns}) from stdin with (format csv)", stream)
+        n = self.cur.rowcount
+        took = time.perf_counter() - t0
+        self.stats.append((table, n, took))
+        print(f"   {table:<24} {n:>11,} строк  {took:7.1f} с")
+        return n
+
+    def drop_indexes(self) -> None:
+        self.cur.execute("""
+            select i.indexrelid::regclass::text, pg_get_indexdef(i.indexrelid)
+            from pg_index i
+            where i.indrelid = any(%s::regclass[])
+              and not exists (select 1 from pg_constraint c where c.conindid = i.indexrelid)
+        """, (BULK_TABLES,))
+        self.dropped = self.cur.fetchall()
+        for name, _ in self.dropped:
+            self.cur.execute(f"drop index {name}")
+
+    def create_indexes(self) -> None:
+        t0 = time.perf_counter()
+        for _, ddl in self.dropped:
+            self.cur.execute(ddl)
+        print(f"   индексы ({len(self.dropped)})              {time.perf_counter() - t0:17.1f} с")
+
+    # --- справочники -----------------------------------------------------
+
+    def load_specializations(self) -> None:
+        self.cur.execute("select id, name, is_popular from specializations order by id")
+        rows = self.cur.fetchall()
+        if not rows:
+            raise SystemExit("❌ Таблица specializations пуста: примените sql/013_tz_specializations_and_filters.sql")
+        self.spec_ids = [r[0] for r in rows]
+        self.spec_names = {r[0]: r[1] for r in rows}
+        self.spec_weights = [POPULAR_WEIGHT if r[2] else 1 for r in rows]
+        self.cur.execute("select id from appointment_types order by id")
+        self.appointment_types = [r[0] for r in self.cur.fetchall()] or [None]
+
+    # --- клиники ---------------------------------------------------------
+
+    def clinics(self) -> None:
+        first = self.max_id("clinics") + 1
+        n = self.args.clinics
+        self.clinic_ids = list(range(first, first + n))
+        rnd = self.rnd
+        city_weights = [c[4] for c in CITIES]
+
+        def rows():
+            for i, cid in enumerate(self.clinic_ids):
+                city, region, lat, lon, _, metro = rnd.choices(CITIES, city_weights)[0]
+                name = f'Клиника "{CLINIC_WORDS[i % len(CLINIC_WORDS)]}" №{i + 1}'
+                hours = rnd.choice([{"пн-пт": "08:00-20:00", "сб": "09:00-18:00", "вс": "выходной"},
+                                    {"пн-вс": "09:00-21:00"}, {"круглосуточно": "24/7"}])
+                yield (cid, name, "Многопрофильный медицинский центр", f"{rnd.choice(STREETS)}, д. {rnd.randint(1, 150)}",
+                       city, region, f"+7 (900) {cid % 1000:03d}-{rnd.randint(0, 9999):04d}", f"clinic{cid}@example.com",
+                       None, json.dumps(hours, ensure_ascii=False), rnd.choice(metro),
+                       round(lat + rnd.uniform(-0.12, 0.12), 6), round(lon + rnd.uniform(-0.2, 0.2), 6))
+
+        self.copy("clinics", "id, name, description, address, city, region, phone, email, site, "
+                             "working_hours, metro, latitude, longitude", rows())
+
+    # --- пользователи, клиенты, врачи ------------------------------------
+
+    def person(self, rnd: random.Random) -> Tuple[str, str, str, str]:
+        if rnd.random() < 0.5:
+            return ("MALE", rnd.choice(MALE_NAMES), rnd.choice(SURNAMES), rnd.choice(PATRONYMICS) + "ич")
+        return ("FEMALE", rnd.choice(FEMALE_NAMES), rnd.choice(SURNAMES) + "а", rnd.choice(PATRONYMICS) + "на")
+
+    def users(self) -> None:
+        a = self.args
+        first_user = self.max_id("users") + 1
+        first_client = self.max_id("clients") + 1
+        first_doctor = self.max_id("doctors") + 1
+        self.client_ids = list(range(first_client, first_client + a.clients))
+        self.client_user_ids = list(range(first_user, first_user + a.clients))
+        self.doctor_ids = list(range(first_doctor, first_doctor + a.doctors))
+        self.doctor_user_ids = list(range(first_user + a.clients, first_user + a.clients + a.doctors))
+        rnd = self.rnd
+        doctor_clinic = {}
+        for did in self.doctor_ids:
+            doctor_clinic[did] = (self.clinic_ids[skewed(rnd, len(self.clinic_ids), 1.5)]
+                                  if self.clinic_ids and rnd.random() < 0.9 else None)
+        self.doctor_clinic = doctor_clinic
+        created = ts(self.now - timedelta(days=400))
+
+        def rows():
+            for uid in self.client_user_ids + self.doctor_user_ids:
+                is_doctor = uid >= first_user + a.clients
+                gender, name, surname, patronymic = self.person(rnd)
+                role = "DOCTOR" if is_doctor else "CLIENT"
+                clinic = doctor_clinic[self.doctor_ids[uid - first_user - a.clients]] if is_doctor else None
+                born = date(1950, 1, 1) + timedelta(days=rnd.randint(0, 365 * 55))
+                yield (uid, f"gen{uid}@example.com", f"gen{uid}", self.password_hash, role, name, surname,
+                       patronymic, born, f"+79{uid % 10 ** 9:09d}", gender, clinic, True,
+                       created, created, created, created)
+
+        self.copy("users", "id, email, login, password_hash, role, name, surname, patronymic, date_of_birth, "
+                           "phone_number, gender, clinic_id, is_active, email_verified_at, "
+                           "password_changed_at, created_at, updated_at", rows())
+
+        def client_rows():
+            for cid, uid in zip(self.client_ids, self.client_user_ids):
+                yield (cid, uid, rnd.choices(BLOOD_TYPES, BLOOD_WEIGHTS)[0], rnd.randint(150, 200),
+                       rnd.randint(45, 120), None, None, None, f"{cid % 10 ** 11:011d}", None,
+                       rnd.choice(["ОМС", "ДМС"]), created, created)
+
+        self.copy("clients", "id, user_id, blood_type, height, weight, emergency_contact_name, "
+                             "emergency_contact_number, address, snils, passport, dms_oms, created_at, updated_at",
+                  client_rows())
+
+        # специализации: первая — основная (profession), ещё 0–2 дополнительные
+        self.doctor_specs: Dict[int, List[int]] = {}
+        for did in self.doctor_ids:
+            specs = rnd.choices(self.spec_ids, self.spec_weights, k=rnd.choice([1, 1, 2, 3]))
+            self.doctor_specs[did] = list(dict.fromkeys(specs))
+
+        def doctor_rows():
+            for did, uid in zip(self.doctor_ids, self.doctor_user_ids):
+                main = self.spec_names[self.doctor_specs[did][0]]
+                experience = min(45, int(rnd.expovariate(1 / 10)) + 1)
+                price = int(round(1500 * math.exp(rnd.gauss(0, 0.35)) * (1 + experience / 40), -2))
+                yield (did, uid, self.doctor_clinic[did], main, f"{main}, стаж {experience} лет",
+                       rnd.random() < 0.9, 0, experience, price, rnd.random() < 0.3, created, created)
+
+        self.copy("doctors", "id, user_id, clinic_id, profession, info, is_confirmed, rating, experience, "
+                             "price, online_available, created_at, updated_at", doctor_rows())
+
+        first_ds = self.max_id("doctor_specializations") + 1
+
+        def spec_rows():
+            i = first_ds
+            for did in self.doctor_ids:
+                for sid in self.doctor_specs[did]:
+                    yield (i, did, sid)
+                    i += 1
+
+        self.copy("doctor_specializations", "id, doctor_id, specialization_id", spec_rows())
+
+    # --- расписание, записи, отзывы --------------------------------------
+
+    def doctor_days(self, rnd: random.Random, n_slots: int, duration: int) -> List[Tuple[date, int, int]]:
+        """Рабочие дни врача (день, начало в минутах, слотов в день): вперёд от сегодня, затем назад."""
+        start_hour = rnd.choice([8, 9, 9, 10, 14])
+        start_min = start_hour * 60
+        per_day = max(1, min(rnd.choice([6, 8, 8, 9, 10]), 22 - start_hour) * 60 // duration)
+        workdays = set(rnd.sample(range(7), rnd.choice([5, 5, 5, 4, 6])))
+        future = round(n_slots * FUTURE_SHARE)
+        ahead, behind = [], []
+        for out, left, d, step in ((ahead, future, self.today, 1),
+                                   (behind, n_slots - future, self.today - timedelta(days=1), -1)):
+            while left > 0:
+                if d.weekday() in workdays:
+                    k = min(per_day, left)
+                    out.append((d, start_min, k))
+                    left -= k
+                d += timedelta(days=step)
+        return behind[::-1] + ahead
+
+    def schedule(self) -> None:
+        a = self.args
+        rnd = self.rnd
+        first_slot = self.max_id("appointment_slots") + 1
+        first_app = self.max_id("appointments") + 1
+        first_review = self.max_id("appointment_reviews") + 1
+        first_dreview = self.max_id("doctor_reviews") + 1
+        self.appointments, self.reviews, self.doctor_reviews = Spool(), Spool(), Spool()
+        n_doctors = len(self.doctor_ids)
+        if not n_doctors or not self.client_ids:
+            return
+        booked_share = min(1.0, a.appointments / a.slots) if a.slots else 0.0
+        # оценка: ~90% записей в прошлом, из них ~85% COMPLETED
+        self.review_p = min(1.0, a.reviews / max(1, a.appointments * 0.9 * 0.85))
+        self.dreview_p = min(1.0, a.doctor_reviews / max(1, a.appointments * 0.9 * 0.85))
+        # популярность ~ логнормальная со средним 1, качество ~ 4.3 ± 0.5
+        popularity = [math.exp(rnd.gauss(-0.125, 0.5)) for _ in range(n_doctors)]
+        quality = [min(5.0, max(1.5, rnd.gauss(4.3, 0.5))) for _ in range(n_doctors)]
+        per_doctor = [a.slots // n_doctors + (1 if i < a.slots % n_doctors else 0) for i in range(n_doctors)]
+        today = self.today
+        created = ts(self.now)
+        self.reviewed_pairs = set()
+        self.next_id = {"app": first_app, "review": first_review, "dreview": first_dreview}
+
+        def rows():
+            emitted = 0
+            for i, did in enumerate(self.doctor_ids):
+                duration = rnd.choice(DURATIONS)
+                days = self.doctor_days(rnd, per_doctor[i], duration)
+                weights = [1.0 if day < today else math.exp(-(day - today).days / FUTURE_DECAY_DAYS)
+                           for day, _, _ in days]
+                # вероятность занятости слота ~ вес дня; в сумме ≈ booked_share * популярность врача
+                scale = per_doctor[i] * booked_share * popularity[i] / max(
+                    sum(w * k for w, (_, _, k) in zip(weights, days)), 1e-9)
+                random_ = rnd.random
+                for w, (day, start_min, k) in zip(weights, days):
+                    p = min(1.0, w * scale)
+                    day_s = day.isoformat()
+                    for j in range(k):
+                        m = start_min + j * duration
+                        slot_id = first_slot + emitted
+                        emitted += 1
+                        is_booked = random_() < p and self.appointment(did, slot_id, day, m, duration, quality[i])
+                        yield (slot_id, did, f"{day_s} {CLOCK[m]}", f"{day_s} {CLOCK[m + duration]}",
+                               is_booked, created, created)
+
+        self.copy("appointment_slots", "id, doctor_id, start_time, end_time, is_booked, "
+                                       "created_at, updated_at", rows())
+        self.copy("appointments", "id, slot_id, client_id, status, comments, created_at, updated_at, "
+                                  "canceled_at, completed_at, appointment_type_id", self.appointments.rewind())
+        self.copy("appointment_reviews", "id, appointment_id, doctor_id, client_id, rating, comment, "
+                                         "created_at, updated_at", self.reviews.rewind())
+        self.copy("doctor_reviews", "id, doctor_id, client_id, rating, comment, created_at, updated_at",
+                  self.doctor_reviews.rewind())
+
+    def rate(self, quality: float) -> int:
+        return min(5, max(1, int(round(self.rnd.gauss(quality, 0.9)))))
+
+    def appointment(self, did: int, slot_id: int, day: date, minute: int, duration: int, quality: float) -> bool:
+        """Запись на занятый слот (+ отзывы); вернуть is_booked слота."""
+        rnd = self.rnd
+        start = datetime(day.year, day.month, day.day, minute // 60, minute % 60)
+        app_id = self.next_id["app"]
+        self.next_id["app"] += 1
+        client_id = self.client_ids[skewed(rnd, len(self.client_ids), 1.8)]
+        booked_at = min(self.now, start - timedelta(minutes=int(rnd.random() * 30 * 24 * 60)))
+        end = start + timedelta(minutes=duration)
+        status, canceled_at, completed_at, is_booked = "BOOKED", None, None, True
+        if end < self.now:
+            x = rnd.random()
+            if x < 0.85:
+                status, completed_at = "COMPLETED", ts(end)
+            elif x < 0.92:
+                status = "NO_SHOW"
+            else:
+                status, canceled_at, is_booked = "CANCELED", ts(booked_at + (start - booked_at) / 2), False
+        self.appointments.add((app_id, slot_id, client_id, status, rnd.choice(APPOINTMENT_COMMENTS), ts(booked_at),
+                               completed_at or canceled_at or ts(booked_at), canceled_at, completed_at,
+                               rnd.choice(self.appointment_types)))
+        if status == "COMPLETED":
+            reviewed_at = ts(end + timedelta(minutes=60 + int(rnd.random() * 72 * 60)))
+            if rnd.random() < self.review_p:
+                r = self.rate(quality)
+                self.reviews.add((self.next_id["review"], app_id, did, client_id, r,
+                                  rnd.choice(REVIEW_COMMENTS[r]) if rnd.random() < 0.6 else None, reviewed_at, reviewed_at))
+                self.next_id["review"] += 1
+            if rnd.random() < self.dreview_p and (did, client_id) not in self.reviewed_pairs:
+                self.reviewed_pairs.add((did, client_id))
+                r = self.rate(quality)
+                self.doctor_reviews.add((self.next_id["dreview"], did, client_id, r,
+                                         rnd.choice(REVIEW_COMMENTS[r]), reviewed_at, reviewed_at))
+                self.next_id["dreview"] += 1
+        return is_booked
+
+    # --- чат ------------------------------------------------------------
+
+    def chat_sessions(self) -> None:
+        a = self.args
+        rnd = self.rnd
+        first = self.max_id("chat_sessions") + 1
+        if not self.client_user_ids:
+            return
+
+        def rows():
+            for sid in range(first, first + a.chat_sessions):
+                n = max(2, int(rnd.uniform(0.5, 1.5) * a.chat_messages)) // 2 * 2
+                started = self.now - timedelta(days=rnd.randint(0, 180), minutes=rnd.randint(0, 1440))
+                messages = []
+                for m in range(n):
+                    role = "user" if m % 2 == 0 else "model"
+                    body = rnd.choice(CHAT_QUESTIONS if role == "user" else CHAT_ANSWERS)
+                    messages.append({"role": role, "parts": [{"text": body}]})
+                user_id = self.client_user_ids[skewed(rnd, len(self.client_user_ids), 2.5)]
+                updated = started + timedelta(minutes=n)
+                yield (sid, user_id, _uuid(rnd), json.dumps(messages, ensure_ascii=False),
+                       started.strftime("%Y-%m-%d %H:%M:%S+03"), updated.strftime("%Y-%m-%d %H:%M:%S+03"))
+
+        self.copy("chat_sessions", "id, user_id, session_id, messages, created_at, updated_at", rows())
+
+    # --- после загрузки --------------------------------------------------
+
+    def finish(self) -> None:
+        self.create_indexes()
+        t0 = time.perf_counter()
+        self.cur.execute("set session_replication_role = origin")
+        self.cur.execute("select rebuild_doctor_rating_stats()")
+        print(f"   doctor_rating_stats      {self.cur.fetchone()[0]:>11,} врачей  {time.perf_counter() - t0:7.1f} с")
+        t0 = time.perf_counter()
+        self.cur.execute("select rebuild_doctor_search_index()")
+        print(f"   doctor_search_index      {self.cur.fetchone()[0]:>11,} врачей  {time.perf_counter() - t0:7.1f} с")
+        t0 = time.perf_counter()
+        self.cur.execute("select rebuild_doctor_free_slot_days()")
+        print(f"   doctor_free_slot_days    {self.cur.fetchone()[0]:>11,} дней    {time.perf_counter() - t0:7.1f} с")
+        for table in SEQUENCE_TABLES:
+            self.cur.execute(f"select setval(pg_get_serial_sequence('{table}', 'id'), "
+                             f"greatest((select max(id) from {table}), 1))")
+
+
+SEQUENCE_TABLES = ["clinics", "users", "clients", "doctors", "doctor_specializations", "appointment_slots",
+                   "appointments", "appointment_reviews", "doctor_reviews", "chat_sessions"]
+ANALYZE_TABLES = SEQUENCE_TABLES + ["doctor_rating_stats", "doctor_search_index", "doctor_free_slot_days"]
+
+
+def _uuid(rnd: random.Random) -> str:
+    return str(uuid.UUID(int=rnd.getrandbits(128), version=4))
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Синтетические данные большого объёма (COPY)")
+    parser.add_argument("--preset", choices=sorted(PRESETS), default="small",
+                        help="базовые объёмы; отдельные флаги ниже их переопределяют")
+    for name in PRESETS["small"]:
+        parser.add_argument(f"--{name.replace('_', '-')}", type=int, default=None,
+                            help=f"по пресету: small={PRESETS['small'][name]:,}, large={PRESETS['large'][name]:,}")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--password", default="generated-password", help="пароль всех сгенерированных пользователей")
+    parser.add_argument("--no-vacuum", action="store_true", help="не делать VACUUM ANALYZE после загрузки")
+    args = parser.parse_args(argv)
+    for name, value in PRESETS[args.preset].items():
+        if getattr(args, name) is None:
+            setattr(args, name, value)
+    return args
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    print(f"🧪 Генерация ({args.preset}): клиник {args.clinics:,}, клиентов {args.clients:,}, врачей {args.doctors:,}, "
+          f"слотов {args.slots:,}, записей ~{args.appointments:,}, отзывов ~{args.reviews:,}+{args.doctor_reviews:,}, "
+          f"чатов {args.chat_sessions:,} × ~{args.chat_messages} сообщений")
+    started = time.perf_counter()
+    raw = engine.raw_connection()
+    try:
+        gen = Generator(raw, args)
+        gen.cur.execute(SESSION_SETUP)
+        gen.load_specializations()
+        gen.drop_indexes()
+        gen.clinics()
+        gen.users()
+        gen.schedule()
+        gen.chat_sessions()
+        gen.finish()
+        raw.commit()
+        print(f"✅ Загружено за {time.perf_counter() - started:.1f} с")
+    except Exception:
+        raw.rollback()
+        raise
+    finally:
+        raw.close()
+
+    if not args.no_vacuum:
+        t0 = time.perf_counter()
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            for table in ANALYZE_TABLES:
+                conn.execute(text(f"vacuum analyze {table}"))
+        print(f"✅ VACUUM ANALYZE за {time.perf_counter() - t0:.1f} с")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
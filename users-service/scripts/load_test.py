@@ -0,0 +1,425 @@
+#!/usr/bin/env python3
+"""
+Нагрузочный прогон users-service: сценарии поиска, слотов, шторма записей на
+приём, входа и чата; отчёт p50/p95/p99 и req/s в JSON, который можно сравнить
+с отчётом другого коммита.
+
+Сервис работает против Postgres из docker-compose (docker compose up -d db,
+тестовые данные из sql/016_test_data.sql). Для чата
+сервис должен быть запущен с CHAT_LLM_MOCK=true (заглушка вместо OpenRouter) —
+--start-server поднимает uvicorn так сам.
+
+Прогон воспроизводим: каждый сценарий делает ровно --requests запросов с
+--concurrency параллельных клиентов, параметры запросов выбираются из
+random.Random(--seed). Слоты для шторма записей создаются перед сценарием,
+после него записи отменяются, а слоты удаляются.
+
+Зависимости скрипта (httpx): pip install -r requirements-dev.txt
+
+    python scripts/load_test.py run --start-server --out reports/$(git rev-parse --short HEAD).json
+    python scripts/load_test.py run --base-url http://localhost:8001 --scenario search slots -c 50 -n 5000
+    python scripts/load_test.py compare reports/old.json reports/new.json --threshold 10
+
+compare печатает изменения по сценариям и возвращает код 1, если p95 вырос
+или пропускная способность упала больше чем на --threshold процентов.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import time
+from collections import Counter
+from datetime import date, datetime, timedelta
+from typing import List, Optional, Tuple
+
+import httpx
+
+ROOT = os.path.join(os.path.dirname(__file__), "..")
+LOGIN_PASSWORD = "loadtest-password"
+
+Request = Tuple[str, str, Optional[dict]]  # (method, path, json)
+
+
+# ---------------------------------------------------------------- сценарии
+
+class Scenario:
+    """Сценарий: подготовка данных, генератор запросов, уборка. expected — статусы, не считающиеся ошибкой."""
+    name = ""
+    expected = {200}
+
+    async def setup(self, client: httpx.AsyncClient, data: dict) -> None:
+        pass
+
+    def request(self, rng: random.Random, data: dict) -> Request:
+        raise NotImplementedError
+
+    def on_response(self, request: Request, response: httpx.Response) -> None:
+        pass
+
+    async def teardown(self, client: httpx.AsyncClient, data: dict) -> None:
+        pass
+
+
+class SearchScenario(Scenario):
+    name = "search"
+
+    def request(self, rng, data):
+        params = {"limit": 20}
+        kind = rng.randrange(6)
+        if kind == 1 and data["cities"]:
+            params["city"] = rng.choice(data["cities"])
+        elif kind == 2 and data["specializations"]:
+            params["specialization_ids"] = rng.choice(data["specializations"])
+        elif kind == 3:
+            params["date"] = (date.today() + timedelta(days=rng.randrange(14))).isoformat()
+        elif kind == 4:
+            params["q"] = rng.choice(["терапевт", "кардиолог", "невролог", "стоматолог", "Иванов"])
+        elif kind == 5:
+            params["offset"] = 20 * rng.randrange(1, 4)
+        return "GET", "/doctors/search?" + "&".join(f"{k}={v}" for k, v in params.items()), None
+
+
+class SlotsScenario(Scenario):
+    name = "slots"
+
+    def request(self, rng, data):
+        doctor_id = rng.choice(data["doctors"])
+        if rng.random() < 0.5:
+            return "GET", f"/doctors/{doctor_id}/available-dates", None
+        day = date.today() + timedelta(days=rng.randrange(14))
+        return "GET", f"/doctors/{doctor_id}/slots?date={day.isoformat()}", None
+
+
+class BookingStormScenario(Scenario):
+    """Много клиентов бьются за несколько свободных слотов; 'слот занят' — ожидаемый ответ."""
+    name = "booking"
+    expected = {201, 409}
+    SLOTS = 20
+
+    def __init__(self):
+        self.slots: List[int] = []
+        self.appointments: List[int] = []
+
+    async def setup(self, client, data):
+        doctor_id = data["doctors"][0]
+        # случайный день далеко в будущем, чтобы не пересекаться с прошлыми прогонами
+        start = datetime.combine(date.today() + timedelta(days=300 + random.randrange(300)), datetime.min.time())
+        for i in range(self.SLOTS):
+            st = start + timedelta(minutes=30 * i)
+            r = await client.post(f"/doctors/{doctor_id}/slots", json={
+                "doctor_id": doctor_id, "start_time": st.isoformat(),
+                "end_time": (st + timedelta(minutes=30)).isoformat(),
+            })
+            r.raise_for_status()
+            self.slots.append(r.json()["id"])
+        self.doctor_id = doctor_id
+
+    def request(self, rng, data):
+        return "POST", "/appointments", {"slot_id": rng.choice(self.slots), "client_id": rng.choice(data["clients"])}
+
+    def on_response(self, request, response):
+        if response.status_code == 201:
+            self.appointments.append(response.json()["id"])
+
+    async def teardown(self, client, data):
+        for appointment_id in self.appointments:
+            await client.post(f"/appointments/{appointment_id}/cancel")
+        for slot_id in self.slots:
+            await client.delete(f"/doctors/{self.doctor_id}/slots/{slot_id}")
+
+
+class LoginScenario(Scenario):
+    """
+    Вход своих пользователей loadtest_N (создаются при первом прогоне). Email у них
+    не подтверждён: без BYPASS_EMAIL_VERIFICATION ответ EMAIL_NOT_VERIFIED — пароль
+    к этому моменту уже проверен (bcrypt), поэтому такой ответ тоже успешный.
+    """
+    name = "login"
+    USERS = 10
+
+    async def setup(self, client, data):
+        self.logins = []
+        for i in range(1, self.USERS + 1):
+            login = f"loadtest_{i}"
+            r = await client.post("/users", json={
+                "email": f"{login}@example.com", "login": login, "password": LOGIN_PASSWORD, "role": "CLIENT",
+            })
+            if r.status_code not in (201, 200, 409):
+                r.raise_for_status()
+            self.logins.append(login)
+
+    def request(self, rng, data):
+        return "POST", "/auth/login", {"login_or_email": rng.choice(self.logins), "password": LOGIN_PASSWORD}
+
+    def on_response(self, request, response):
+        body = response.json()
+        if not body.get("success") and body.get("error") != "EMAIL_NOT_VERIFIED":
+            raise RuntimeError(f"login failed: {body}")
+
+
+class ChatScenario(Scenario):
+    name = "chat"
+    MESSAGES = [
+        "У меня болит голова третий день",
+        "Давит в груди при нагрузке",
+        "Болит зуб, опухла десна",
+        "У ребёнка температура 38",
+        "Плохо вижу вдаль",
+        "Общая слабость и насморк",
+    ]
+
+    def __init__(self):
+        self.sessions: List[str] = []
+
+    def request(self, rng, data):
+        return "POST", "/chat/message", {"user_id": rng.choice(data["users"]), "message": rng.choice(self.MESSAGES)}
+
+    def on_response(self, request, response):
+        if response.status_code == 200:
+            self.sessions.append(response.json()["session_id"])
+
+    async def teardown(self, client, data):
+        for session_id in self.sessions:
+            await client.delete(f"/chat/session/{session_id}")
+
+
+SCENARIOS = {cls.name: cls for cls in (SearchScenario, SlotsScenario, BookingStormScenario, LoginScenario, ChatScenario)}
+
+
+# ---------------------------------------------------------------- прогон
+
+async def discover(client: httpx.AsyncClient) -> dict:
+    """Id врачей/клиентов/пользователей и логины тестовых пользователей — через сам API."""
+    doctors = (await client.get("/doctors/search", params={"limit": 200})).json()
+    users = (await client.get("/users", params={"role": "CLIENT"})).json()
+    clients = (await client.post("/clients/batch", json={"ids": [u["id"] for u in users][:200], "by": "user_id"})).json()
+    specs = (await client.get("/specializations")).json()
+    data = {
+        "doctors": [d["id"] for d in doctors],
+        "cities": sorted({d["city"] for d in doctors if d.get("city")}),
+        "specializations": [sp["id"] for sp in specs],
+        "users": [u["id"] for u in users],
+        "clients": [c["id"] for c in clients["items"]],
+    }
+    missing = [k for k in ("doctors", "users", "clients") if not data[k]]
+    if missing:
+        raise SystemExit(f"в БД нет тестовых данных ({', '.join(missing)}): примените sql/016_test_data.sql")
+    return data
+
+
+async def run_scenario(client: httpx.AsyncClient, scenario: Scenario, data: dict,
+                       requests: int, concurrency: int, seed: int) -> dict:
+    await scenario.setup(client, data)
+    rng = random.Random(f"{seed}:{scenario.name}")
+    plan = [scenario.request(rng, data) for _ in range(requests)]
+    latencies: List[float] = []
+    statuses: Counter = Counter()
+    errors = 0
+    queue = iter(plan)
+
+    async def worker():
+        nonlocal errors
+        for method, path, body in queue:
+            t0 = time.perf_counter()
+            try:
+                r = await client.request(method, path, json=body)
+            except httpx.HTTPError as e:
+                errors += 1
+                statuses[type(e).__name__] += 1
+                continue
+            latencies.append(time.perf_counter() - t0)
+            statuses[str(r.status_code)] += 1
+            if r.status_code not in scenario.expected:
+                errors += 1
+                continue
+            try:
+                scenario.on_response((method, path, body), r)
+            except Exception:
+                errors += 1
+
+    try:
+        t0 = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - t0
+    finally:
+        await scenario.teardown(client, data)
+    return summarize(latencies, elapsed, errors, statuses)
+
+
+def percentile(sorted_values: List[float], q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+
+def summarize(latencies: List[float], elapsed: float, errors: int, statuses: Counter) -> dict:
+    latencies = sorted(latencies)
+    ms = lambda v: round(v * 1000, 2)  # noqa: E731
+    return {
+        "requests": sum(statuses.values()),
+        "errors": errors,
+        "elapsed_s": round(elapsed, 3),
+        "rps": round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+        "p50_ms": ms(percentile(latencies, 0.50)),
+        "p95_ms": ms(percentile(latencies, 0.95)),
+        "p99_ms": ms(percentile(latencies, 0.99)),
+        "mean_ms": ms(statistics.mean(latencies)) if latencies else 0.0,
+        "max_ms": ms(latencies[-1]) if latencies else 0.0,
+        "statuses": dict(sorted(statuses.items())),
+    }
+
+
+def git_revision() -> str:
+    try:
+        rev = subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, text=True).strip()
+        dirty = subprocess.run(["git", "diff", "--quiet", "HEAD"], cwd=ROOT).returncode != 0
+        return rev + ("-dirty" if dirty else "")
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(port: int, workers: int) -> subprocess.Popen:
+    env = dict(os.environ, CHAT_LLM_MOCK="true", SPECIALIZATIONS_LISTEN="false")
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(port),
+         "--workers", str(workers), "--log-level", "warning"],
+        cwd=ROOT, env=env, stdout=subprocess.DEVNULL,
+    )
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            if httpx.get(f"http://127.0.0.1:{port}/health").status_code == 200:
+                return proc
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    proc.terminate()
+    raise RuntimeError("uvicorn не поднялся за 30 секунд")
+
+
+async def run(args) -> dict:
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    report = {
+        "meta": {
+            "revision": git_revision(),
+            "started_at": datetime.now().isoformat(timespec="seconds"),
+            "base_url": args.base_url,
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "seed": args.seed,
+            "python": platform.python_version(),
+            "host": platform.node(),
+        },
+        "scenarios": {},
+    }
+    async with httpx.AsyncClient(base_url=args.base_url, limits=limits, timeout=args.timeout) as client:
+        data = await discover(client)
+        for name in args.scenario:
+            scenario = SCENARIOS[name]()
+            # прогрев: пулы соединений, кэши, PREPARE на соединениях
+            await run_scenario(client, scenario, data, min(args.concurrency * 2, 50), args.concurrency, args.seed + 1)
+            result = await run_scenario(client, SCENARIOS[name](), data, args.requests, args.concurrency, args.seed)
+            report["scenarios"][name] = result
+            print_result(name, result)
+    return report
+
+
+def print_result(name: str, r: dict) -> None:
+    print(f"{name:<9} {r['rps']:>8.1f} req/s  p50={r['p50_ms']:>7.1f}  p95={r['p95_ms']:>7.1f}  "
+          f"p99={r['p99_ms']:>7.1f} ms  errors={r['errors']}  {r['statuses']}")
+
+
+# ---------------------------------------------------------------- сравнение
+
+def compare(old: dict, new: dict, threshold: float) -> int:
+    print(f"old: {old['meta']['revision']} ({old['meta']['started_at']})")
+    print(f"new: {new['meta']['revision']} ({new['meta']['started_at']})")
+    for key in ("requests", "concurrency", "seed"):
+        if old["meta"].get(key) != new["meta"].get(key):
+            print(f"⚠️ разные {key}: {old['meta'].get(key)} -> {new['meta'].get(key)}")
+
+    regressions = 0
+    print(f"\n{'scenario':<9} {'metric':<8} {'old':>10} {'new':>10} {'change':>8}")
+    for name in sorted(set(old["scenarios"]) | set(new["scenarios"])):
+        a, b = old["scenarios"].get(name), new["scenarios"].get(name)
+        if not a or not b:
+            print(f"{name:<9} есть только в {'new' if b else 'old'}")
+            continue
+        for metric, higher_is_better in (("rps", True), ("p50_ms", False), ("p95_ms", False),
+                                         ("p99_ms", False), ("errors", False)):
+            va, vb = a[metric], b[metric]
+            change = (vb - va) / va * 100 if va else (0.0 if vb == va else float("inf"))
+            worse = -change if higher_is_better else change
+            flag = ""
+            if metric in ("rps", "p95_ms") and worse > threshold:
+                flag = " ❌"
+                regressions += 1
+            elif metric == "errors" and vb > va:
+                flag = " ❌"
+                regressions += 1
+            print(f"{name:<9} {metric:<8} {va:>10} {vb:>10} {change:>+7.1f}%{flag}")
+    if regressions:
+        print(f"\n{regressions} регрессий (порог {threshold}%)")
+        return 1
+    print("\nРегрессий нет")
+    return 0
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_run = sub.add_parser("run", help="нагрузочный прогон")
+    p_run.add_argument("--base-url", default="http://localhost:8001")
+    p_run.add_argument("--start-server", action="store_true",
+                       help="поднять uvicorn на свободном порту (CHAT_LLM_MOCK=true) вместо --base-url")
+    p_run.add_argument("--workers", type=int, default=1, help="воркеров uvicorn для --start-server")
+    p_run.add_argument("--scenario", nargs="+", choices=list(SCENARIOS), default=list(SCENARIOS))
+    p_run.add_argument("-n", "--requests", type=int, default=1000, help="запросов на сценарий")
+    p_run.add_argument("-c", "--concurrency", type=int, default=20)
+    p_run.add_argument("--seed", type=int, default=1)
+    p_run.add_argument("--timeout", type=float, default=30.0)
+    p_run.add_argument("--out", help="куда записать JSON-отчёт")
+
+    p_cmp = sub.add_parser("compare", help="сравнить два JSON-отчёта")
+    p_cmp.add_argument("old")
+    p_cmp.add_argument("new")
+    p_cmp.add_argument("--threshold", type=float, default=10.0, help="допустимое ухудшение, %%")
+
+    args = parser.parse_args()
+    if args.command == "compare":
+        with open(args.old) as f_old, open(args.new) as f_new:
+            return compare(json.load(f_old), json.load(f_new), args.threshold)
+
+    proc = None
+    if args.start_server:
+        port = free_port()
+        proc = start_server(port, args.workers)
+        args.base_url = f"http://127.0.0.1:{port}"
+    try:
+        report = asyncio.run(run(args))
+    finally:
+        if proc:
+            proc.terminate()
+            proc.wait()
+    if args.out:
+        os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+        with open(args.out, "w") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"\nотчёт: {args.out}")
+    return 1 if any(r["errors"] for r in report["scenarios"].values()) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
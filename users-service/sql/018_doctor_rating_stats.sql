@@ -0,0 +1,181 @@
+-- 018_doctor_rating_stats.sql
+-- Хранимый агрегат рейтинга врача: суммы и количества по обоим источникам отзывов
+-- (appointment_reviews и doctor_reviews). Поиск фильтрует и сортирует по нему
+-- вместо коррелированного avg() по отзывам на каждую строку.
+
+BEGIN;
+
+CREATE TABLE IF NOT EXISTS doctor_rating_stats (
+  doctor_id                 bigint PRIMARY KEY REFERENCES doctors(id) ON DELETE CASCADE,
+  appointment_reviews_sum   NUMERIC NOT NULL DEFAULT 0,
+  appointment_reviews_count INT     NOT NULL DEFAULT 0,
+  doctor_reviews_sum        NUMERIC NOT NULL DEFAULT 0,
+  doctor_reviews_count      INT     NOT NULL DEFAULT 0,
+  rating DOUBLE PRECISION GENERATED ALWAYS AS (
+    CASE
+      WHEN appointment_reviews_count + doctor_reviews_count = 0 THEN 0
+      ELSE ((appointment_reviews_sum + doctor_reviews_sum)
+            / (appointment_reviews_count + doctor_reviews_count))::double precision
+    END
+  ) STORED,
+  updated_at                TIMESTAMP NOT NULL DEFAULT now()
+);
+
+CREATE INDEX IF NOT EXISTS idx_doctor_rating_stats_rating
+    ON doctor_rating_stats (rating DESC, doctor_id);
+
+-- Пустая строка статистики для каждого нового врача,
+-- чтобы поиск мог делать обычный join, а не left join + coalesce.
+CREATE OR REPLACE FUNCTION trg_doctor_rating_stats_init() RETURNS TRIGGER AS $$
+BEGIN
+    INSERT INTO doctor_rating_stats (doctor_id)
+    VALUES (NEW.id)
+    ON CONFLICT (doctor_id) DO NOTHING;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_doctors_rating_stats_init ON doctors;
+CREATE TRIGGER trg_doctors_rating_stats_init
+AFTER INSERT ON doctors
+FOR EACH ROW EXECUTE FUNCTION trg_doctor_rating_stats_init();
+
+-- Полный пересчёт агрегата (бэкфилл / восстановление после рассинхрона).
+-- Возвращает количество обработанных врачей.
+CREATE OR REPLACE FUNCTION rebuild_doctor_rating_stats() RETURNS INT AS $$
+DECLARE
+    v_count INT;
+BEGIN
+    INSERT INTO doctor_rating_stats (doctor_id,
+                                     appointment_reviews_sum, appointment_reviews_count,
+                                     doctor_reviews_sum, doctor_reviews_count)
+    SELECT d.id,
+           coalesce(ar.s, 0), coalesce(ar.c, 0),
+           coalesce(dr.s, 0), coalesce(dr.c, 0)
+    FROM doctors d
+    LEFT JOIN (
+        SELECT doctor_id, sum(rating) AS s, count(rating) AS c
+        FROM appointment_reviews
+        GROUP BY doctor_id
+    ) ar ON ar.doctor_id = d.id
+    LEFT JOIN (
+        SELECT doctor_id, sum(rating) AS s, count(rating) AS c
+        FROM doctor_reviews
+        GROUP BY doctor_id
+    ) dr ON dr.doctor_id = d.id
+    ON CONFLICT (doctor_id) DO UPDATE
+    SET appointment_reviews_sum   = EXCLUDED.appointment_reviews_sum,
+        appointment_reviews_count = EXCLUDED.appointment_reviews_count,
+        doctor_reviews_sum        = EXCLUDED.doctor_reviews_sum,
+        doctor_reviews_count      = EXCLUDED.doctor_reviews_count,
+        updated_at                = now();
+
+    GET DIAGNOSTICS v_count = ROW_COUNT;
+
+    -- doctors.rating остаётся зеркалом агрегата для старых клиентов
+    UPDATE doctors d
+       SET rating = round(rs.rating::numeric, 2)
+      FROM doctor_rating_stats rs
+     WHERE rs.doctor_id = d.id
+       AND d.rating IS DISTINCT FROM round(rs.rating::numeric, 2);
+
+    RETURN v_count;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Триггеры из 013 пересчитывали doctors.rating только по doctor_reviews
+-- (avg на каждую вставку). Теперь вставку отзыва учитывает репозиторий
+-- (_bump_doctor_rating), а изменение и удаление — триггеры ниже.
+DROP TRIGGER IF EXISTS trg_reviews_refresh_insert ON doctor_reviews;
+DROP TRIGGER IF EXISTS trg_reviews_refresh_update ON doctor_reviews;
+DROP TRIGGER IF EXISTS trg_reviews_refresh_delete ON doctor_reviews;
+
+-- Применить дельту к агрегату врача и отзеркалить рейтинг в doctors.rating
+-- (с тем же округлением, что и rebuild_doctor_rating_stats). Только update:
+-- при каскадном удалении врача строки агрегата уже нет, вставлять её нельзя.
+CREATE OR REPLACE FUNCTION apply_doctor_rating_delta(
+    p_doctor_id BIGINT,
+    p_appointment_sum NUMERIC, p_appointment_count INT,
+    p_doctor_sum NUMERIC, p_doctor_count INT
+) RETURNS VOID AS $$
+DECLARE
+    v_rating DOUBLE PRECISION;
+BEGIN
+    UPDATE doctor_rating_stats
+       SET appointment_reviews_sum   = appointment_reviews_sum + p_appointment_sum,
+           appointment_reviews_count = appointment_reviews_count + p_appointment_count,
+           doctor_reviews_sum        = doctor_reviews_sum + p_doctor_sum,
+           doctor_reviews_count      = doctor_reviews_count + p_doctor_count,
+           updated_at                = now()
+     WHERE doctor_id = p_doctor_id
+    RETURNING rating INTO v_rating;
+
+    IF FOUND THEN
+        UPDATE doctors
+           SET rating = round(v_rating::numeric, 2)
+         WHERE id = p_doctor_id
+           AND rating IS DISTINCT FROM round(v_rating::numeric, 2);
+    END IF;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Изменение и удаление отзыва (в том числе каскадом от клиента, записи или слота):
+-- вычесть старую оценку, прибавить новую. Один обработчик на обе таблицы отзывов.
+CREATE OR REPLACE FUNCTION trg_doctor_rating_stats_review_change() RETURNS TRIGGER AS $$
+DECLARE
+    v_appointment BOOLEAN := TG_TABLE_NAME = 'appointment_reviews';
+BEGIN
+    IF OLD.rating IS NOT NULL THEN
+        PERFORM apply_doctor_rating_delta(
+            OLD.doctor_id,
+            CASE WHEN v_appointment THEN -OLD.rating ELSE 0 END,
+            CASE WHEN v_appointment THEN -1 ELSE 0 END,
+            CASE WHEN v_appointment THEN 0 ELSE -OLD.rating END,
+            CASE WHEN v_appointment THEN 0 ELSE -1 END);
+    END IF;
+    IF TG_OP = 'UPDATE' AND NEW.rating IS NOT NULL THEN
+        PERFORM apply_doctor_rating_delta(
+            NEW.doctor_id,
+            CASE WHEN v_appointment THEN NEW.rating ELSE 0 END,
+            CASE WHEN v_appointment THEN 1 ELSE 0 END,
+            CASE WHEN v_appointment THEN 0 ELSE NEW.rating END,
+            CASE WHEN v_appointment THEN 0 ELSE 1 END);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_appointment_reviews_rating_update ON appointment_reviews;
+CREATE TRIGGER trg_appointment_reviews_rating_update
+AFTER UPDATE OF rating, doctor_id ON appointment_reviews
+FOR EACH ROW
+WHEN (OLD.rating IS DISTINCT FROM NEW.rating OR OLD.doctor_id IS DISTINCT FROM NEW.doctor_id)
+EXECUTE FUNCTION trg_doctor_rating_stats_review_change();
+
+DROP TRIGGER IF EXISTS trg_appointment_reviews_rating_delete ON appointment_reviews;
+CREATE TRIGGER trg_appointment_reviews_rating_delete
+AFTER DELETE ON appointment_reviews
+FOR EACH ROW EXECUTE FUNCTION trg_doctor_rating_stats_review_change();
+
+DROP TRIGGER IF EXISTS trg_doctor_reviews_rating_update ON doctor_reviews;
+CREATE TRIGGER trg_doctor_reviews_rating_update
+AFTER UPDATE OF rating, doctor_id ON doctor_reviews
+FOR EACH ROW
+WHEN (OLD.rating IS DISTINCT FROM NEW.rating OR OLD.doctor_id IS DISTINCT FROM NEW.doctor_id)
+EXECUTE FUNCTION trg_doctor_rating_stats_review_change();
+
+DROP TRIGGER IF EXISTS trg_doctor_reviews_rating_delete ON doctor_reviews;
+CREATE TRIGGER trg_doctor_reviews_rating_delete
+AFTER DELETE ON doctor_reviews
+FOR EACH ROW EXECUTE FUNCTION trg_doctor_rating_stats_review_change();
+
+-- Первичный бэкфилл (только при пустой таблице, повторный прогон миграции ничего не делает)
+DO $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM doctor_rating_stats) THEN
+        PERFORM rebuild_doctor_rating_stats();
+    END IF;
+END;
+$$;
+
+COMMIT;
@@ -0,0 +1,267 @@
+-- 019_doctor_search_index.sql
+-- Денормализованная read-модель поиска врачей: всё, по чему фильтрует и что
+-- возвращает /doctors/search, в одной таблице. Поддерживается триггерами на
+-- исходных таблицах; полная пересборка — rebuild_doctor_search_index().
+
+BEGIN;
+
+CREATE TABLE IF NOT EXISTS doctor_search_index (
+  doctor_id            bigint PRIMARY KEY REFERENCES doctors(id) ON DELETE CASCADE,
+  user_id              bigint NOT NULL,
+  clinic_id            bigint,
+  profession           VARCHAR(255) NOT NULL,
+  info                 TEXT,
+  is_confirmed         BOOLEAN,
+  experience           INT,
+  price                NUMERIC(10,2),
+  online_available     BOOLEAN NOT NULL DEFAULT FALSE,
+  gender               VARCHAR(20),
+  date_of_birth        DATE,
+  city                 VARCHAR(100),
+  region               VARCHAR(100),
+  metro                VARCHAR(255),
+  specialization_ids   INT[]     NOT NULL DEFAULT '{}',
+  specialization_names VARCHAR[] NOT NULL DEFAULT '{}',
+  rating               DOUBLE PRECISION NOT NULL DEFAULT 0
+);
+
+-- Порядок выдачи поиска: rating desc, price asc nulls last, id
+CREATE INDEX IF NOT EXISTS idx_dsi_order
+    ON doctor_search_index (rating DESC, price ASC NULLS LAST, doctor_id);
+CREATE INDEX IF NOT EXISTS idx_dsi_online_order
+    ON doctor_search_index (rating DESC, price ASC NULLS LAST, doctor_id)
+    WHERE online_available;
+CREATE INDEX IF NOT EXISTS idx_dsi_specializations
+    ON doctor_search_index USING gin (specialization_ids);
+CREATE INDEX IF NOT EXISTS idx_dsi_city          ON doctor_search_index (city);
+CREATE INDEX IF NOT EXISTS idx_dsi_region        ON doctor_search_index (region);
+CREATE INDEX IF NOT EXISTS idx_dsi_metro         ON doctor_search_index (metro);
+CREATE INDEX IF NOT EXISTS idx_dsi_gender        ON doctor_search_index (gender);
+CREATE INDEX IF NOT EXISTS idx_dsi_date_of_birth ON doctor_search_index (date_of_birth);
+CREATE INDEX IF NOT EXISTS idx_dsi_price         ON doctor_search_index (price);
+CREATE INDEX IF NOT EXISTS idx_dsi_experience    ON doctor_search_index (experience);
+
+-- Источник строк индекса (одна строка на врача) — общий для точечного
+-- обновления из триггеров и для полной пересборки.
+DROP VIEW IF EXISTS doctor_search_source;
+CREATE VIEW doctor_search_source AS
+SELECT
+    d.id AS doctor_id,
+    d.user_id,
+    d.clinic_id,
+    d.profession,
+    d.info,
+    d.is_confirmed,
+    d.experience,
+    d.price,
+    d.online_available,
+    u.gender,
+    u.date_of_birth,
+    c.city,
+    c.region,
+    c.metro,
+    coalesce(
+        array(
+            SELECT ds.specialization_id
+            FROM doctor_specializations ds
+            WHERE ds.doctor_id = d.id
+            ORDER BY ds.specialization_id
+        ),
+        array[]::int[]
+    ) AS specialization_ids,
+    coalesce(
+        array(
+            SELECT s.name
+            FROM doctor_specializations ds
+            JOIN specializations s ON s.id = ds.specialization_id
+            WHERE ds.doctor_id = d.id
+            ORDER BY s.name
+        ),
+        array[]::varchar[]
+    ) AS specialization_names,
+    coalesce(rs.rating, 0) AS rating
+FROM doctors d
+JOIN users u ON u.id = d.user_id
+LEFT JOIN clinics c ON c.id = d.clinic_id
+LEFT JOIN doctor_rating_stats rs ON rs.doctor_id = d.id;
+
+-- Точечное обновление строки индекса для одного врача
+CREATE OR REPLACE FUNCTION refresh_doctor_search_index(p_doctor_id BIGINT) RETURNS VOID AS $$
+BEGIN
+    INSERT INTO doctor_search_index (
+        doctor_id, user_id, clinic_id, profession, info, is_confirmed,
+        experience, price, online_available, gender, date_of_birth,
+        city, region, metro, specialization_ids, specialization_names, rating
+    )
+    SELECT
+        doctor_id, user_id, clinic_id, profession, info, is_confirmed,
+        experience, price, online_available, gender, date_of_birth,
+        city, region, metro, specialization_ids, specialization_names, rating
+    FROM doctor_search_source
+    WHERE doctor_id = p_doctor_id
+    ON CONFLICT (doctor_id) DO UPDATE
+    SET user_id              = EXCLUDED.user_id,
+        clinic_id            = EXCLUDED.clinic_id,
+        profession           = EXCLUDED.profession,
+        info                 = EXCLUDED.info,
+        is_confirmed         = EXCLUDED.is_confirmed,
+        experience           = EXCLUDED.experience,
+        price                = EXCLUDED.price,
+        online_available     = EXCLUDED.online_available,
+        gender               = EXCLUDED.gender,
+        date_of_birth        = EXCLUDED.date_of_birth,
+        city                 = EXCLUDED.city,
+        region               = EXCLUDED.region,
+        metro                = EXCLUDED.metro,
+        specialization_ids   = EXCLUDED.specialization_ids,
+        specialization_names = EXCLUDED.specialization_names,
+        rating               = EXCLUDED.rating;
+
+    IF NOT FOUND THEN
+        -- врача нет (удаляется каскадом) — строки индекса тоже быть не должно
+        DELETE FROM doctor_search_index WHERE doctor_id = p_doctor_id;
+    END IF;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Полная пересборка (восстановление). Возвращает количество строк индекса.
+CREATE OR REPLACE FUNCTION rebuild_doctor_search_index() RETURNS INT AS $$
+DECLARE
+    v_count INT;
+BEGIN
+    DELETE FROM doctor_search_index;
+
+    INSERT INTO doctor_search_index (
+        doctor_id, user_id, clinic_id, profession, info, is_confirmed,
+        experience, price, online_available, gender, date_of_birth,
+        city, region, metro, specialization_ids, specialization_names, rating
+    )
+    SELECT
+        doctor_id, user_id, clinic_id, profession, info, is_confirmed,
+        experience, price, online_available, gender, date_of_birth,
+        city, region, metro, specialization_ids, specialization_names, rating
+    FROM doctor_search_source;
+
+    GET DIAGNOSTICS v_count = ROW_COUNT;
+    RETURN v_count;
+END;
+$$ LANGUAGE plpgsql;
+
+-- ---------- Триггеры синхронизации ----------
+
+-- doctors: профиль, цена, стаж, онлайн, клиника
+CREATE OR REPLACE FUNCTION trg_dsi_doctors() RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM refresh_doctor_search_index(NEW.id);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_doctors_search_index_insert ON doctors;
+CREATE TRIGGER trg_doctors_search_index_insert
+AFTER INSERT ON doctors
+FOR EACH ROW EXECUTE FUNCTION trg_dsi_doctors();
+
+DROP TRIGGER IF EXISTS trg_doctors_search_index_update ON doctors;
+CREATE TRIGGER trg_doctors_search_index_update
+AFTER UPDATE OF user_id, clinic_id, profession, info, is_confirmed,
+                experience, price, online_available ON doctors
+FOR EACH ROW EXECUTE FUNCTION trg_dsi_doctors();
+
+-- users: пол и дата рождения врача
+CREATE OR REPLACE FUNCTION trg_dsi_users() RETURNS TRIGGER AS $$
+DECLARE
+    v_doctor_id BIGINT;
+BEGIN
+    FOR v_doctor_id IN SELECT id FROM doctors WHERE user_id = NEW.id LOOP
+        PERFORM refresh_doctor_search_index(v_doctor_id);
+    END LOOP;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_users_search_index ON users;
+CREATE TRIGGER trg_users_search_index
+AFTER UPDATE OF gender, date_of_birth ON users
+FOR EACH ROW EXECUTE FUNCTION trg_dsi_users();
+
+-- clinics: локация
+CREATE OR REPLACE FUNCTION trg_dsi_clinics() RETURNS TRIGGER AS $$
+DECLARE
+    v_doctor_id BIGINT;
+BEGIN
+    FOR v_doctor_id IN SELECT id FROM doctors WHERE clinic_id = NEW.id LOOP
+        PERFORM refresh_doctor_search_index(v_doctor_id);
+    END LOOP;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_clinics_search_index ON clinics;
+CREATE TRIGGER trg_clinics_search_index
+AFTER UPDATE OF city, region, metro ON clinics
+FOR EACH ROW EXECUTE FUNCTION trg_dsi_clinics();
+
+-- doctor_specializations: набор специализаций врача
+CREATE OR REPLACE FUNCTION trg_dsi_doctor_specializations() RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP <> 'INSERT' THEN
+        PERFORM refresh_doctor_search_index(OLD.doctor_id);
+    END IF;
+    IF TG_OP = 'INSERT' OR (TG_OP = 'UPDATE' AND NEW.doctor_id <> OLD.doctor_id) THEN
+        PERFORM refresh_doctor_search_index(NEW.doctor_id);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_doctor_specializations_search_index ON doctor_specializations;
+CREATE TRIGGER trg_doctor_specializations_search_index
+AFTER INSERT OR UPDATE OR DELETE ON doctor_specializations
+FOR EACH ROW EXECUTE FUNCTION trg_dsi_doctor_specializations();
+
+-- specializations: переименование специализации
+CREATE OR REPLACE FUNCTION trg_dsi_specializations() RETURNS TRIGGER AS $$
+DECLARE
+    v_doctor_id BIGINT;
+BEGIN
+    FOR v_doctor_id IN
+        SELECT doctor_id FROM doctor_specializations WHERE specialization_id = NEW.id
+    LOOP
+        PERFORM refresh_doctor_search_index(v_doctor_id);
+    END LOOP;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_specializations_search_index ON specializations;
+CREATE TRIGGER trg_specializations_search_index
+AFTER UPDATE OF name ON specializations
+FOR EACH ROW EXECUTE FUNCTION trg_dsi_specializations();
+
+-- doctor_rating_stats: рейтинг обновляем без полной перестройки строки
+CREATE OR REPLACE FUNCTION trg_dsi_rating_stats() RETURNS TRIGGER AS $$
+BEGIN
+    UPDATE doctor_search_index
+       SET rating = NEW.rating
+     WHERE doctor_id = NEW.doctor_id
+       AND rating IS DISTINCT FROM NEW.rating;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_doctor_rating_stats_search_index ON doctor_rating_stats;
+CREATE TRIGGER trg_doctor_rating_stats_search_index
+AFTER INSERT OR UPDATE ON doctor_rating_stats
+FOR EACH ROW EXECUTE FUNCTION trg_dsi_rating_stats();
+
+-- Первичное наполнение
+DO $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM doctor_search_index) THEN
+        PERFORM rebuild_doctor_search_index();
+    END IF;
+END;
+$$;
+
+COMMIT;
@@ -0,0 +1,24 @@
+-- 020_specializations_notify.sql
+-- Уведомление API об изменении справочника специализаций: процесс держит
+-- справочник в памяти и сбрасывает кэш по NOTIFY specializations_changed.
+
+BEGIN;
+
+CREATE OR REPLACE FUNCTION trg_specializations_notify() RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM pg_notify('specializations_changed', TG_OP);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_specializations_notify ON specializations;
+CREATE TRIGGER trg_specializations_notify
+AFTER INSERT OR UPDATE OR DELETE ON specializations
+FOR EACH STATEMENT EXECUTE FUNCTION trg_specializations_notify();
+
+DROP TRIGGER IF EXISTS trg_specializations_notify_truncate ON specializations;
+CREATE TRIGGER trg_specializations_notify_truncate
+AFTER TRUNCATE ON specializations
+FOR EACH STATEMENT EXECUTE FUNCTION trg_specializations_notify();
+
+COMMIT;
@@ -0,0 +1,42 @@
+-- 021_doctor_search_source_grouped.sql
+-- doctor_search_source: специализации собираются одним сгруппированным join'ом
+-- вместо двух коррелированных array(select ...) на каждого врача.
+-- Для точечного refresh_doctor_search_index(id) условие doctor_id = :id
+-- проталкивается планировщиком внутрь группировки, так что читается только один врач.
+
+BEGIN;
+
+CREATE OR REPLACE VIEW doctor_search_source AS
+SELECT
+    d.id AS doctor_id,
+    d.user_id,
+    d.clinic_id,
+    d.profession,
+    d.info,
+    d.is_confirmed,
+    d.experience,
+    d.price,
+    d.online_available,
+    u.gender,
+    u.date_of_birth,
+    c.city,
+    c.region,
+    c.metro,
+    coalesce(sp.specialization_ids, array[]::int[]) AS specialization_ids,
+    coalesce(sp.specialization_names, array[]::varchar[]) AS specialization_names,
+    coalesce(rs.rating, 0) AS rating
+FROM doctors d
+JOIN users u ON u.id = d.user_id
+LEFT JOIN clinics c ON c.id = d.clinic_id
+LEFT JOIN doctor_rating_stats rs ON rs.doctor_id = d.id
+LEFT JOIN (
+    SELECT
+        ds.doctor_id,
+        array_agg(ds.specialization_id ORDER BY ds.specialization_id) AS specialization_ids,
+        array_agg(s.name ORDER BY s.name)::varchar[] AS specialization_names
+    FROM doctor_specializations ds
+    JOIN specializations s ON s.id = ds.specialization_id
+    GROUP BY ds.doctor_id
+) sp ON sp.doctor_id = d.id;
+
+COMMIT;
@@ -0,0 +1,150 @@
+-- 022_doctor_search_text.sql
+-- Полнотекстовый и нечёткий поиск врачей (параметр q в /doctors/search).
+--   search_vector — tsvector (russian): ФИО (вес A), профессия и специализации (B), info (C);
+--   search_text   — ФИО, профессия и специализации одной строкой в нижнем регистре
+--                   для pg_trgm (опечатки: "Петроф" -> "Петров"). info сюда не входит:
+--                   длинный текст делает триграммы дорогими и шумными, его покрывает tsvector.
+
+BEGIN;
+
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+ALTER TABLE doctor_search_index
+    ADD COLUMN IF NOT EXISTS name          VARCHAR(100),
+    ADD COLUMN IF NOT EXISTS surname       VARCHAR(100),
+    ADD COLUMN IF NOT EXISTS patronymic    VARCHAR(100),
+    ADD COLUMN IF NOT EXISTS search_text   TEXT     NOT NULL DEFAULT '',
+    ADD COLUMN IF NOT EXISTS search_vector TSVECTOR NOT NULL DEFAULT ''::tsvector;
+
+CREATE INDEX IF NOT EXISTS idx_dsi_search_vector
+    ON doctor_search_index USING gin (search_vector);
+CREATE INDEX IF NOT EXISTS idx_dsi_search_text_trgm
+    ON doctor_search_index USING gin (search_text gin_trgm_ops);
+
+-- Новые колонки добавляются в конец представления (CREATE OR REPLACE VIEW это допускает)
+CREATE OR REPLACE VIEW doctor_search_source AS
+SELECT
+    d.id AS doctor_id,
+    d.user_id,
+    d.clinic_id,
+    d.profession,
+    d.info,
+    d.is_confirmed,
+    d.experience,
+    d.price,
+    d.online_available,
+    u.gender,
+    u.date_of_birth,
+    c.city,
+    c.region,
+    c.metro,
+    coalesce(sp.specialization_ids, array[]::int[]) AS specialization_ids,
+    coalesce(sp.specialization_names, array[]::varchar[]) AS specialization_names,
+    coalesce(rs.rating, 0) AS rating,
+    u.name,
+    u.surname,
+    u.patronymic,
+    lower(concat_ws(' ', u.surname, u.name, u.patronymic, d.profession,
+                    array_to_string(sp.specialization_names, ' '))) AS search_text,
+    setweight(to_tsvector('russian', concat_ws(' ', u.surname, u.name, u.patronymic)), 'A')
+    || setweight(to_tsvector('russian', concat_ws(' ', d.profession,
+                                                  array_to_string(sp.specialization_names, ' '))), 'B')
+    || setweight(to_tsvector('russian', coalesce(d.info, '')), 'C') AS search_vector
+FROM doctors d
+JOIN users u ON u.id = d.user_id
+LEFT JOIN clinics c ON c.id = d.clinic_id
+LEFT JOIN doctor_rating_stats rs ON rs.doctor_id = d.id
+LEFT JOIN (
+    SELECT
+        ds.doctor_id,
+        array_agg(ds.specialization_id ORDER BY ds.specialization_id) AS specialization_ids,
+        array_agg(s.name ORDER BY s.name)::varchar[] AS specialization_names
+    FROM doctor_specializations ds
+    JOIN specializations s ON s.id = ds.specialization_id
+    GROUP BY ds.doctor_id
+) sp ON sp.doctor_id = d.id;
+
+CREATE OR REPLACE FUNCTION refresh_doctor_search_index(p_doctor_id BIGINT) RETURNS VOID AS $$
+BEGIN
+    INSERT INTO doctor_search_index (
+        doctor_id, user_id, clinic_id, profession, info, is_confirmed,
+        experience, price, online_available, gender, date_of_birth,
+        city, region, metro, specialization_ids, specialization_names, rating,
+        name, surname, patronymic, search_text, search_vector
+    )
+    SELECT
+        doctor_id, user_id, clinic_id, profession, info, is_confirmed,
+        experience, price, online_available, gender, date_of_birth,
+        city, region, metro, specialization_ids, specialization_names, rating,
+        name, surname, patronymic, search_text, search_vector
+    FROM doctor_search_source
+    WHERE doctor_id = p_doctor_id
+    ON CONFLICT (doctor_id) DO UPDATE
+    SET user_id              = EXCLUDED.user_id,
+        clinic_id            = EXCLUDED.clinic_id,
+        profession           = EXCLUDED.profession,
+        info                 = EXCLUDED.info,
+        is_confirmed         = EXCLUDED.is_confirmed,
+        experience           = EXCLUDED.experience,
+        price                = EXCLUDED.price,
+        online_available     = EXCLUDED.online_available,
+        gender               = EXCLUDED.gender,
+        date_of_birth        = EXCLUDED.date_of_birth,
+        city                 = EXCLUDED.city,
+        region               = EXCLUDED.region,
+        metro                = EXCLUDED.metro,
+        specialization_ids   = EXCLUDED.specialization_ids,
+        specialization_names = EXCLUDED.specialization_names,
+        rating               = EXCLUDED.rating,
+        name                 = EXCLUDED.name,
+        surname              = EXCLUDED.surname,
+        patronymic           = EXCLUDED.patronymic,
+        search_text          = EXCLUDED.search_text,
+        search_vector        = EXCLUDED.search_vector;
+
+    IF NOT FOUND THEN
+        DELETE FROM doctor_search_index WHERE doctor_id = p_doctor_id;
+    END IF;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION rebuild_doctor_search_index() RETURNS INT AS $$
+DECLARE
+    v_count INT;
+BEGIN
+    DELETE FROM doctor_search_index;
+
+    INSERT INTO doctor_search_index (
+        doctor_id, user_id, clinic_id, profession, info, is_confirmed,
+        experience, price, online_available, gender, date_of_birth,
+        city, region, metro, specialization_ids, specialization_names, rating,
+        name, surname, patronymic, search_text, search_vector
+    )
+    SELECT
+        doctor_id, user_id, clinic_id, profession, info, is_confirmed,
+        experience, price, online_available, gender, date_of_birth,
+        city, region, metro, specialization_ids, specialization_names, rating,
+        name, surname, patronymic, search_text, search_vector
+    FROM doctor_search_source;
+
+    GET DIAGNOSTICS v_count = ROW_COUNT;
+    RETURN v_count;
+END;
+$$ LANGUAGE plpgsql;
+
+-- ФИО теперь тоже часть индекса
+DROP TRIGGER IF EXISTS trg_users_search_index ON users;
+CREATE TRIGGER trg_users_search_index
+AFTER UPDATE OF gender, date_of_birth, name, surname, patronymic ON users
+FOR EACH ROW EXECUTE FUNCTION trg_dsi_users();
+
+-- Заполнение новых колонок для уже существующих строк
+DO $$
+BEGIN
+    IF EXISTS (SELECT 1 FROM doctor_search_index WHERE search_text = '') THEN
+        PERFORM rebuild_doctor_search_index();
+    END IF;
+END;
+$$;
+
+COMMIT;
@@ -0,0 +1,172 @@
+-- 023_clinic_coordinates.sql
+-- Координаты клиник и гео-поиск врачей (near=lat,lon&radius_km= в /doctors/search).
+-- Без PostGIS: в doctor_search_index хранится point(lon, lat) с GiST-индексом,
+-- запрос сначала отсекает кандидатов прямоугольником (location <@ box), затем
+-- считает точное расстояние по гаверсинусу (distance_km).
+
+BEGIN;
+
+ALTER TABLE clinics
+    ADD COLUMN IF NOT EXISTS latitude  DOUBLE PRECISION CHECK (latitude BETWEEN -90 AND 90),
+    ADD COLUMN IF NOT EXISTS longitude DOUBLE PRECISION CHECK (longitude BETWEEN -180 AND 180);
+
+ALTER TABLE doctor_search_index
+    ADD COLUMN IF NOT EXISTS latitude  DOUBLE PRECISION,
+    ADD COLUMN IF NOT EXISTS longitude DOUBLE PRECISION,
+    ADD COLUMN IF NOT EXISTS location  POINT;
+
+CREATE INDEX IF NOT EXISTS idx_dsi_location
+    ON doctor_search_index USING gist (location);
+
+-- Расстояние по большому кругу, км
+CREATE OR REPLACE FUNCTION distance_km(lat1 DOUBLE PRECISION, lon1 DOUBLE PRECISION,
+                                       lat2 DOUBLE PRECISION, lon2 DOUBLE PRECISION)
+RETURNS DOUBLE PRECISION AS $$
+    SELECT 2 * 6371.0088 * asin(sqrt(
+        power(sin(radians(lat2 - lat1) / 2), 2)
+        + cos(radians(lat1)) * cos(radians(lat2)) * power(sin(radians(lon2 - lon1) / 2), 2)
+    ))
+$$ LANGUAGE sql IMMUTABLE STRICT PARALLEL SAFE;
+
+CREATE OR REPLACE VIEW doctor_search_source AS
+SELECT
+    d.id AS doctor_id,
+    d.user_id,
+    d.clinic_id,
+    d.profession,
+    d.info,
+    d.is_confirmed,
+    d.experience,
+    d.price,
+    d.online_available,
+    u.gender,
+    u.date_of_birth,
+    c.city,
+    c.region,
+    c.metro,
+    coalesce(sp.specialization_ids, array[]::int[]) AS specialization_ids,
+    coalesce(sp.specialization_names, array[]::varchar[]) AS specialization_names,
+    coalesce(rs.rating, 0) AS rating,
+    u.name,
+    u.surname,
+    u.patronymic,
+    lower(concat_ws(' ', u.surname, u.name, u.patronymic, d.profession,
+                    array_to_string(sp.specialization_names, ' '))) AS search_text,
+    setweight(to_tsvector('russian', concat_ws(' ', u.surname, u.name, u.patronymic)), 'A')
+    || setweight(to_tsvector('russian', concat_ws(' ', d.profession,
+                                                  array_to_string(sp.specialization_names, ' '))), 'B')
+    || setweight(to_tsvector('russian', coalesce(d.info, '')), 'C') AS search_vector,
+    c.latitude,
+    c.longitude,
+    point(c.longitude, c.latitude) AS location
+FROM doctors d
+JOIN users u ON u.id = d.user_id
+LEFT JOIN clinics c ON c.id = d.clinic_id
+LEFT JOIN doctor_rating_stats rs ON rs.doctor_id = d.id
+LEFT JOIN (
+    SELECT
+        ds.doctor_id,
+        array_agg(ds.specialization_id ORDER BY ds.specialization_id) AS specialization_ids,
+        array_agg(s.name ORDER BY s.name)::varchar[] AS specialization_names
+    FROM doctor_specializations ds
+    JOIN specializations s ON s.id = ds.specialization_id
+    GROUP BY ds.doctor_id
+) sp ON sp.doctor_id = d.id;
+
+CREATE OR REPLACE FUNCTION refresh_doctor_search_index(p_doctor_id BIGINT) RETURNS VOID AS $$
+BEGIN
+    INSERT INTO doctor_search_index (
+        doctor_id, user_id, clinic_id, profession, info, is_confirmed,
+        experience, price, online_available, gender, date_of_birth,
+        city, region, metro, specialization_ids, specialization_names, rating,
+        name, surname, patronymic, search_text, search_vector,
+        latitude, longitude, location
+    )
+    SELECT
+        doctor_id, user_id, clinic_id, profession, info, is_confirmed,
+        experience, price, online_available, gender, date_of_birth,
+        city, region, metro, specialization_ids, specialization_names, rating,
+        name, surname, patronymic, search_text, search_vector,
+        latitude, longitude, location
+    FROM doctor_search_source
+    WHERE doctor_id = p_doctor_id
+    ON CONFLICT (doctor_id) DO UPDATE
+    SET user_id              = EXCLUDED.user_id,
+        clinic_id            = EXCLUDED.clinic_id,
+        profession           = EXCLUDED.profession,
+        info                 = EXCLUDED.info,
+        is_confirmed         = EXCLUDED.is_confirmed,
+        experience           = EXCLUDED.experience,
+        price                = EXCLUDED.price,
+        online_available     = EXCLUDED.online_available,
+        gender               = EXCLUDED.gender,
+        date_of_birth        = EXCLUDED.date_of_birth,
+        city                 = EXCLUDED.city,
+        region               = EXCLUDED.region,
+        metro                = EXCLUDED.metro,
+        specialization_ids   = EXCLUDED.specialization_ids,
+        specialization_names = EXCLUDED.specialization_names,
+        rating               = EXCLUDED.rating,
+        name                 = EXCLUDED.name,
+        surname              = EXCLUDED.surname,
+        patronymic           = EXCLUDED.patronymic,
+        search_text          = EXCLUDED.search_text,
+        search_vector        = EXCLUDED.search_vector,
+        latitude             = EXCLUDED.latitude,
+        longitude            = EXCLUDED.longitude,
+        location             = EXCLUDED.location;
+
+    IF NOT FOUND THEN
+        DELETE FROM doctor_search_index WHERE doctor_id = p_doctor_id;
+    END IF;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION rebuild_doctor_search_index() RETURNS INT AS $$
+DECLARE
+    v_count INT;
+BEGIN
+    DELETE FROM doctor_search_index;
+
+    INSERT INTO doctor_search_index (
+        doctor_id, user_id, clinic_id, profession, info, is_confirmed,
+        experience, price, online_available, gender, date_of_birth,
+        city, region, metro, specialization_ids, specialization_names, rating,
+        name, surname, patronymic, search_text, search_vector,
+        latitude, longitude, location
+    )
+    SELECT
+        doctor_id, user_id, clinic_id, profession, info, is_confirmed,
+        experience, price, online_available, gender, date_of_birth,
+        city, region, metro, specialization_ids, specialization_names, rating,
+        name, surname, patronymic, search_text, search_vector,
+        latitude, longitude, location
+    FROM doctor_search_source;
+
+    GET DIAGNOSTICS v_count = ROW_COUNT;
+    RETURN v_count;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Координаты клиники тоже часть индекса
+DROP TRIGGER IF EXISTS trg_clinics_search_index ON clinics;
+CREATE TRIGGER trg_clinics_search_index
+AFTER UPDATE OF city, region, metro, latitude, longitude ON clinics
+FOR EACH ROW EXECUTE FUNCTION trg_dsi_clinics();
+
+-- Координаты тестовых клиник из 016_test_data.sql (только если ещё не заданы;
+-- в остальных БД строк с такими названиями нет и UPDATE ничего не делает)
+UPDATE clinics c
+   SET latitude = v.lat, longitude = v.lon
+  FROM (VALUES
+    ('Клиника "Здоровье+"',   59.9311, 30.3609),
+    ('Клиника "МедСервис"',   59.9326, 30.3534),
+    ('Клиника "ПроМед"',      59.9165, 30.3181),
+    ('Клиника "ВитаЛайф"',    59.9356, 30.3271),
+    ('Клиника "Медлюкс"',     55.0415, 82.9170),
+    ('Клиника "ДокторПлюс"',  56.8380, 60.5975)
+  ) AS v(name, lat, lon)
+ WHERE c.name = v.name
+   AND c.latitude IS NULL;
+
+COMMIT;
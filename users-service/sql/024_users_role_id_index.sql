@@ -0,0 +1,9 @@
+-- 024_users_role_id_index.sql
+-- Постраничный /users?role=...&after_id=...&limit=...: keyset по id внутри роли
+-- (без индекса — обход PK с фильтром по role через всех пользователей других ролей).
+
+BEGIN;
+
+CREATE INDEX IF NOT EXISTS idx_users_role_id ON users(role, id);
+
+COMMIT;
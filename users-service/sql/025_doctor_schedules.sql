@@ -0,0 +1,58 @@
+-- 025_doctor_schedules.sql
+-- Недельные шаблоны расписания врача и исключения по дням. Слоты из них создаются
+-- пачкой (POST /doctors/{id}/schedule/generate) одним insert ... select по
+-- generate_series, а не по одному POST /doctors/{id}/slots на слот.
+
+BEGIN;
+
+-- Рабочий интервал в день недели (ISO: 1 = пн … 7 = вс). Несколько интервалов
+-- в один день — несколько строк; перерыв внутри интервала — break_start/break_end.
+CREATE TABLE IF NOT EXISTS doctor_schedule_templates (
+  id           BIGSERIAL PRIMARY KEY,
+  doctor_id    BIGINT   NOT NULL REFERENCES doctors(id) ON DELETE CASCADE,
+  weekday      SMALLINT NOT NULL CHECK (weekday BETWEEN 1 AND 7),
+  start_time   TIME     NOT NULL,
+  end_time     TIME     NOT NULL,
+  slot_minutes INT      NOT NULL CHECK (slot_minutes BETWEEN 5 AND 480),
+  break_start  TIME,
+  break_end    TIME,
+  created_at   TIMESTAMP NOT NULL DEFAULT now(),
+  updated_at   TIMESTAMP NOT NULL DEFAULT now(),
+  CHECK (start_time < end_time),
+  CHECK ((break_start IS NULL) = (break_end IS NULL)),
+  CHECK (break_start IS NULL
+         OR (start_time <= break_start AND break_start < break_end AND break_end <= end_time))
+);
+
+CREATE INDEX IF NOT EXISTS idx_schedule_templates_doctor
+    ON doctor_schedule_templates (doctor_id, weekday);
+
+-- Исключение на конкретный день: без часов — выходной, с часами — они заменяют
+-- все шаблоны этого дня недели.
+CREATE TABLE IF NOT EXISTS doctor_schedule_exceptions (
+  id           BIGSERIAL PRIMARY KEY,
+  doctor_id    BIGINT NOT NULL REFERENCES doctors(id) ON DELETE CASCADE,
+  day          DATE   NOT NULL,
+  start_time   TIME,
+  end_time     TIME,
+  slot_minutes INT,
+  reason       TEXT,
+  created_at   TIMESTAMP NOT NULL DEFAULT now(),
+  updated_at   TIMESTAMP NOT NULL DEFAULT now(),
+  UNIQUE (doctor_id, day),
+  CHECK ((start_time IS NULL) = (end_time IS NULL)),
+  CHECK (start_time IS NULL
+         OR (start_time < end_time AND slot_minutes IS NOT NULL AND slot_minutes BETWEEN 5 AND 480))
+);
+
+DROP TRIGGER IF EXISTS trg_schedule_templates_updated ON doctor_schedule_templates;
+CREATE TRIGGER trg_schedule_templates_updated
+BEFORE UPDATE ON doctor_schedule_templates
+FOR EACH ROW EXECUTE FUNCTION set_updated_at();
+
+DROP TRIGGER IF EXISTS trg_schedule_exceptions_updated ON doctor_schedule_exceptions;
+CREATE TRIGGER trg_schedule_exceptions_updated
+BEFORE UPDATE ON doctor_schedule_exceptions
+FOR EACH ROW EXECUTE FUNCTION set_updated_at();
+
+COMMIT;
@@ -0,0 +1,146 @@
+-- 026_doctor_free_slot_days.sql
+-- Хранимый агрегат «свободных слотов у врача в день». Поиск по дате, список
+-- доступных дат и календарь врачей читают его по первичному ключу вместо
+-- просмотра строк appointment_slots. Строка есть только у дней, где free_count > 0.
+
+BEGIN;
+
+CREATE TABLE IF NOT EXISTS doctor_free_slot_days (
+  doctor_id  BIGINT NOT NULL REFERENCES doctors(id) ON DELETE CASCADE,
+  day        DATE   NOT NULL,
+  free_count INT    NOT NULL CHECK (free_count > 0),
+  PRIMARY KEY (doctor_id, day)
+);
+
+-- Применить изменения числа свободных слотов (массивы одной длины, отсортированы
+-- по (doctor_id, day) — строки агрегата блокируются в одном порядке, без дедлоков).
+-- Отрицательная дельта только уменьшает/удаляет существующую строку: при каскадном
+-- удалении врача его строки агрегата уже удалены, вставлять их заново нельзя.
+CREATE OR REPLACE FUNCTION apply_doctor_free_slot_days(
+    p_doctor_ids BIGINT[], p_days DATE[], p_deltas INT[]
+) RETURNS VOID AS $$
+BEGIN
+    IF p_doctor_ids IS NULL THEN
+        RETURN;
+    END IF;
+
+    INSERT INTO doctor_free_slot_days AS f (doctor_id, day, free_count)
+    SELECT d.doctor_id, d.day, d.delta
+    FROM unnest(p_doctor_ids, p_days, p_deltas) AS d(doctor_id, day, delta)
+    WHERE d.delta > 0
+    ON CONFLICT (doctor_id, day) DO UPDATE
+    SET free_count = f.free_count + EXCLUDED.free_count;
+
+    WITH d AS (
+        SELECT * FROM unnest(p_doctor_ids, p_days, p_deltas) AS d(doctor_id, day, delta)
+        WHERE d.delta < 0
+    ), dec AS (
+        UPDATE doctor_free_slot_days f
+           SET free_count = f.free_count + d.delta
+          FROM d
+         WHERE f.doctor_id = d.doctor_id AND f.day = d.day
+           AND f.free_count + d.delta > 0
+    )
+    DELETE FROM doctor_free_slot_days f
+     USING d
+     WHERE f.doctor_id = d.doctor_id AND f.day = d.day
+       AND f.free_count + d.delta <= 0;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Триггеры уровня выражения: пачка слотов из генерации расписания — один пересчёт
+-- по таблице переходов, а не по триггеру на каждую строку.
+CREATE OR REPLACE FUNCTION trg_free_slot_days_insert() RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM apply_doctor_free_slot_days(array_agg(doctor_id), array_agg(day), array_agg(delta))
+    FROM (
+        SELECT doctor_id, date(start_time) AS day, count(*)::int AS delta
+        FROM new_slots
+        WHERE NOT is_booked
+        GROUP BY 1, 2
+        ORDER BY 1, 2
+    ) d;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION trg_free_slot_days_update() RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM apply_doctor_free_slot_days(array_agg(doctor_id), array_agg(day), array_agg(delta))
+    FROM (
+        SELECT doctor_id, day, sum(delta)::int AS delta
+        FROM (
+            SELECT doctor_id, date(start_time) AS day, 1 AS delta FROM new_slots WHERE NOT is_booked
+            UNION ALL
+            SELECT doctor_id, date(start_time), -1 FROM old_slots WHERE NOT is_booked
+        ) x
+        GROUP BY 1, 2
+        HAVING sum(delta) <> 0
+        ORDER BY 1, 2
+    ) d;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION trg_free_slot_days_delete() RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM apply_doctor_free_slot_days(array_agg(doctor_id), array_agg(day), array_agg(delta))
+    FROM (
+        SELECT doctor_id, date(start_time) AS day, -count(*)::int AS delta
+        FROM old_slots
+        WHERE NOT is_booked
+        GROUP BY 1, 2
+        ORDER BY 1, 2
+    ) d;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_slots_free_days_insert ON appointment_slots;
+CREATE TRIGGER trg_slots_free_days_insert
+AFTER INSERT ON appointment_slots
+REFERENCING NEW TABLE AS new_slots
+FOR EACH STATEMENT EXECUTE FUNCTION trg_free_slot_days_insert();
+
+DROP TRIGGER IF EXISTS trg_slots_free_days_update ON appointment_slots;
+CREATE TRIGGER trg_slots_free_days_update
+AFTER UPDATE ON appointment_slots
+REFERENCING OLD TABLE AS old_slots NEW TABLE AS new_slots
+FOR EACH STATEMENT EXECUTE FUNCTION trg_free_slot_days_update();
+
+DROP TRIGGER IF EXISTS trg_slots_free_days_delete ON appointment_slots;
+CREATE TRIGGER trg_slots_free_days_delete
+AFTER DELETE ON appointment_slots
+REFERENCING OLD TABLE AS old_slots
+FOR EACH STATEMENT EXECUTE FUNCTION trg_free_slot_days_delete();
+
+-- Полный пересчёт агрегата (бэкфилл, после загрузки с выключенными триггерами,
+-- восстановление после рассинхрона). Возвращает количество строк агрегата.
+CREATE OR REPLACE FUNCTION rebuild_doctor_free_slot_days() RETURNS INT AS $$
+DECLARE
+    v_count INT;
+BEGIN
+    LOCK TABLE doctor_free_slot_days IN EXCLUSIVE MODE;
+    DELETE FROM doctor_free_slot_days;
+
+    INSERT INTO doctor_free_slot_days (doctor_id, day, free_count)
+    SELECT doctor_id, date(start_time), count(*)
+    FROM appointment_slots
+    WHERE NOT is_booked
+    GROUP BY 1, 2;
+
+    GET DIAGNOSTICS v_count = ROW_COUNT;
+    RETURN v_count;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Первичный бэкфилл (только при пустой таблице, повторный прогон миграции ничего не делает)
+DO $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM doctor_free_slot_days) THEN
+        PERFORM rebuild_doctor_free_slot_days();
+    END IF;
+END;
+$$;
+
+COMMIT;